@@ -0,0 +1,375 @@
+import time
+_startTime = time.perf_counter()
+
+import argparse
+import os
+import sys
+
+# Headless entry point for batch nodes. Nothing heavy is imported at startup:
+# each subcommand imports only the modules it needs, and the time spent
+# starting up and importing is reported on stderr.
+#
+#   python BatchCLI.py closest surveys/*.csv --output-dir out --workers 8
+#   python BatchCLI.py convert country.csv --output-dir stores
+#   python BatchCLI.py closest stores/country_store --format npy --tile-rows 50000
+#   python BatchCLI.py map --pair sites.csv path.csv --output-dir out --image
+#   python BatchCLI.py map --pair sites.csv path.csv --output-dir out --tiled
+#   python BatchCLI.py export maps.csv --output-dir out --workers 4
+
+# Imports a module and returns it along with the seconds the import took
+def timedImport(name):
+    start = time.perf_counter()
+    module = __import__(name)
+    return module, time.perf_counter() - start
+
+# argparse type for integer options that must be at least minimum
+def intAtLeast(minimum):
+    def parse(text):
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid int value: {text!r}")
+        if value < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}: {value}")
+        return value
+    return parse
+
+positiveInt = intAtLeast(1)
+nonNegativeInt = intAtLeast(0)
+
+def outputPath(outputDir, inputPath, suffix):
+    stem = os.path.splitext(os.path.basename(os.path.normpath(inputPath)))[0]
+    return os.path.join(outputDir, f"{stem}_{suffix}")
+
+# Output names only keep the input's file name, so a/sites.csv and b/sites.csv
+# would overwrite each other. Reports every such clash and returns True if any;
+# entries are (inputPath, identity) so the same input listed twice is not a clash.
+def reportOutputCollisions(entries):
+    owners = {}
+    for inputPath, identity in entries:
+        owners.setdefault(outputPath("", inputPath, ""), {}).setdefault(identity, inputPath)
+    collisions = [list(inputs.values()) for inputs in owners.values() if len(inputs) > 1]
+    for inputs in collisions:
+        print(f"{', '.join(inputs)}: outputs would have the same name; rename the inputs or run them separately",
+              file=sys.stderr)
+    return bool(collisions)
+
+# Rendering raises selenium's own exceptions (e.g. WebDriverException when
+# Chrome is missing); checked by module so selenium is not imported up front
+def isRenderError(error):
+    return type(error).__module__.startswith("selenium.")
+
+def openCache(args):
+    if args.cache_dir is None:
+        return None
+    from ResultCache import ResultCache
+    return ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+def reportCache(cache, report):
+    if cache is not None:
+        stats = cache.stats()
+        report(f"cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries, {stats['bytes']} bytes")
+
+def runClosest(args, report):
+    # The incremental path always re-queries one KD-tree on a single process
+    if args.incremental and (args.method != 'kdtree' or args.workers != 1):
+        print("--incremental cannot be combined with --method blocked/approximate or --workers", file=sys.stderr)
+        return 2
+    if reportOutputCollisions((inputPath, os.path.abspath(inputPath)) for inputPath in args.inputs):
+        return 2
+    Cleaner, importSeconds = timedImport("Cleaner")
+    report(f"import Cleaner: {importSeconds * 1000:.1f} ms")
+    import ResultWriters
+    cache = openCache(args)
+    failures = 0
+    for inputPath in args.inputs:
+        start = time.perf_counter()
+        try:
+            extension = "." + args.format
+            resultPath = outputPath(args.output_dir, inputPath, "ClosestPoints" + extension)
+            outputs = {"ClosestPoints" + extension: resultPath}
+            if args.co_channel:
+                outputs["CoChannelPoints" + extension] = outputPath(args.output_dir, inputPath, "CoChannelPoints" + extension)
+            if args.format == 'npy':
+                # The run's mode (and recall) is kept next to .npy results
+                outputs["ClosestPoints.npy.meta.json"] = resultPath + ".meta.json"
+            if args.within is not None:
+                outputs["PointsWithinRadius.csv"] = outputPath(args.output_dir, inputPath, "PointsWithinRadius.csv")
+            if cache is not None:
+                # A point store is identified by its meta.json, which changes on every conversion
+                keyInputs = [os.path.join(inputPath, "meta.json")] if os.path.isdir(inputPath) else [inputPath]
+                cacheKey = cache.key(keyInputs, kind="closest", k=args.k, co_channel=args.co_channel,
+                                     channel_spread=args.channel_spread, radius=args.radius, within=args.within,
+                                     format=args.format, approximate=args.method == 'approximate',
+                                     candidates=args.candidates if args.method == 'approximate' else None)
+                if cache.get(cacheKey, outputs):
+                    report(f"{inputPath}: cached -> {resultPath}")
+                    continue
+            if os.path.isdir(inputPath):
+                points = runTiled(args, inputPath, resultPath, report)
+            else:
+                lat, lon, wifiChannel, topThree = Cleaner.readCSV(inputPath)
+                # Results are streamed to the writer as they are produced rather than kept in topThree
+                with ResultWriters.openResultWriter(resultPath, lat, lon, wifiChannel, k=args.k) as writer:
+                    if args.incremental:
+                        stats = Cleaner.calculateClosestPointsIncremental(lat, lon, wifiChannel, None, k=args.k, writer=writer,
+                                                                          statePath=outputPath(args.output_dir, inputPath, "ClosestPoints.state"))
+                        report(f"{inputPath}: {stats['added']} added, {stats['removed']} removed, {stats['recomputed']} recomputed")
+                    else:
+                        info = Cleaner.calculateClosestPoints(lat, lon, wifiChannel, None, k=args.k, method=args.method,
+                                                              blockSize=args.block_size, workers=args.workers, writer=writer,
+                                                              candidates=args.candidates, recallSample=args.recall_sample)
+                        if info['mode'] == 'approximate':
+                            report(f"{inputPath}: approximate, recall@{args.k} {info[f'recall@{args.k}']:.4f} "
+                                   f"on {info['recallSample']} sampled points")
+                if args.co_channel:
+                    with ResultWriters.openResultWriter(outputs["CoChannelPoints" + extension], lat, lon, wifiChannel,
+                                                        k=args.k, mode='cochannel') as writer:
+                        Cleaner.calculateCoChannelPoints(lat, lon, wifiChannel, None, k=args.k,
+                                                         radius=args.radius, spread=args.channel_spread, writer=writer)
+                if args.within is not None:
+                    counts, offsets, indices = Cleaner.calculatePointsWithinRadius(lat, lon, args.within)
+                    Cleaner.writeRadiusCSV(lat, lon, counts, filePath=outputs["PointsWithinRadius.csv"])
+                points = len(lat)
+            if cache is not None:
+                cache.put(cacheKey, outputs)
+        except (OSError, ValueError, ImportError) as e:
+            failures += 1
+            print(f"{inputPath}: {e}", file=sys.stderr)
+            continue
+        report(f"{inputPath}: {points} points -> {resultPath} in {time.perf_counter() - start:.2f} s")
+    reportCache(cache, report)
+    return 1 if failures else 0
+
+# Closest points for a point store directory, computed tile by tile
+def runTiled(args, storePath, resultPath, report):
+    import PointStore
+    import ResultWriters
+    if args.co_channel or args.within is not None or args.incremental or args.method == 'approximate':
+        raise ValueError("--co-channel, --within, --incremental and --method approximate are not supported for point stores")
+    store = PointStore.PointStore(storePath)
+    with ResultWriters.openResultWriter(resultPath, store.lat, store.lon, store.wifiChannel, k=args.k) as writer:
+        writer.setMetadata({'mode': 'exact'})
+        stats = PointStore.tiledNeighbors(store, k=args.k, tileRows=args.tile_rows, writer=writer)
+    report(f"{storePath}: {len(store)} points in {stats['tiles']} tiles, {stats['researched']} regions "
+           f"searched again, largest search {stats['largestSearch']} points")
+    return len(store)
+
+def runConvert(args, report):
+    if reportOutputCollisions((inputPath, os.path.abspath(inputPath)) for inputPath in args.inputs):
+        return 2
+    import PointStore
+    failures = 0
+    for inputPath in args.inputs:
+        start = time.perf_counter()
+        storePath = outputPath(args.output_dir, inputPath, "store")
+        try:
+            store = PointStore.convertCSV(inputPath, storePath, chunkRows=args.chunk_rows)
+        except (OSError, ValueError) as e:
+            failures += 1
+            print(f"{inputPath}: {e}", file=sys.stderr)
+            continue
+        report(f"{inputPath}: {len(store)} points -> {storePath} in {time.perf_counter() - start:.2f} s")
+    return 1 if failures else 0
+
+# Writes the map's points as tiles in <site>_map_tiles/ next to a small HTML page
+def runTiledMap(args, siteFile, pathFile, htmlPath, outputs, report):
+    import TileExport
+    stats = TileExport.exportTiledMap(siteFile, pathFile, htmlPath, site_color=args.site_color,
+                                      path_color=args.path_color, minZoom=args.min_zoom, maxZoom=args.max_zoom)
+    report(f"{pathFile}: {stats['sites']} sites and {stats['pathPoints']} path points in {stats['tiles']} tiles "
+           f"({stats['tileBytes'] / 1024:.0f} KiB), HTML {stats['htmlBytes'] / 1024:.0f} KiB "
+           f"in {stats['seconds']:.2f} s")
+    if args.image:
+        import MapGenerator
+        MapGenerator.saveHtmlAsImage(htmlPath, outputs["map.png"], outputs["map_presentation.pptx"])
+
+def runMap(args, report):
+    if args.tiled:
+        import TileExport
+        try:
+            TileExport.checkZoomRange(args.min_zoom, args.max_zoom)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    if reportOutputCollisions((siteFile, (os.path.abspath(siteFile), os.path.abspath(pathFile)))
+                              for siteFile, pathFile in args.pair):
+        return 2
+    # Imported on the first cache miss, so fully cached runs never load folium/pandas
+    MapGenerator = None
+    cache = openCache(args)
+    failures = 0
+    for siteFile, pathFile in args.pair:
+        start = time.perf_counter()
+        try:
+            htmlPath = outputPath(args.output_dir, siteFile, "map.html")
+            outputs = {"map.html": htmlPath}
+            if args.image:
+                outputs["map.png"] = outputPath(args.output_dir, siteFile, "map.png")
+                outputs["map_presentation.pptx"] = outputPath(args.output_dir, siteFile, "map_presentation.pptx")
+            if args.tiled:
+                # The tiles are a directory, which the cache does not hold
+                runTiledMap(args, siteFile, pathFile, htmlPath, outputs, report)
+                report(f"{siteFile}, {pathFile} -> {htmlPath} in {time.perf_counter() - start:.2f} s")
+                continue
+            if cache is not None:
+                cacheKey = cache.key([siteFile, pathFile], kind="map-image" if args.image else "map-html",
+                                     site_color=args.site_color, path_color=args.path_color,
+                                     path_mode=args.path_mode, path_downsample=args.path_downsample)
+                if cache.get(cacheKey, outputs):
+                    report(f"{siteFile}, {pathFile}: cached -> {htmlPath}")
+                    continue
+            if MapGenerator is None:
+                MapGenerator, importSeconds = timedImport("MapGenerator")
+                report(f"import MapGenerator: {importSeconds * 1000:.1f} ms")
+            map, pathStats = MapGenerator.buildMap(siteFile, pathFile, site_color=args.site_color,
+                                                   path_color=args.path_color, mode=args.path_mode,
+                                                   downsample=args.path_downsample)
+            saveStart = time.perf_counter()
+            MapGenerator.saveMapHtml(map, htmlPath)
+            report(f"{pathFile}: {pathStats['points']} path points drawn as {pathStats['rendered']} "
+                   f"({pathStats['mode']}) in {pathStats['seconds']:.2f} s, "
+                   f"HTML {os.path.getsize(htmlPath) / 1024:.0f} KiB written in {time.perf_counter() - saveStart:.2f} s")
+            if args.image:
+                MapGenerator.saveHtmlAsImage(htmlPath, outputs["map.png"], outputs["map_presentation.pptx"])
+            if cache is not None:
+                cache.put(cacheKey, outputs)
+        except Exception as e:
+            if not isinstance(e, (OSError, ValueError)) and not isRenderError(e):
+                raise
+            failures += 1
+            print(f"{siteFile}, {pathFile}: {e}", file=sys.stderr)
+            continue
+        report(f"{siteFile}, {pathFile} -> {htmlPath} in {time.perf_counter() - start:.2f} s")
+    reportCache(cache, report)
+    return 1 if failures else 0
+
+def runExport(args, report):
+    import BatchExport
+    entries = BatchExport.readManifest(args.manifest)
+    pptxPath = os.path.join(args.output_dir, args.output)
+    workers = args.workers or os.cpu_count()
+    renderPool = None
+    if args.stub_renderer:
+        from MapRenderer import RenderPool, StubDriver
+        renderPool = RenderPool(size=workers, driverFactory=StubDriver, idleTime=0, pollInterval=0)
+    mapOptions = {"site_color": args.site_color, "path_color": args.path_color,
+                  "mode": args.path_mode, "downsample": args.path_downsample}
+    results = BatchExport.exportMaps(entries, pptxPath, workers=workers, renderPool=renderPool,
+                                     keepDirectory=args.keep_dir, mapOptions=mapOptions)
+    failures = 0
+    for result in results["maps"]:
+        if result["error"] is not None:
+            failures += 1
+            print(f"{result['site']}, {result['path']}: {result['error']}", file=sys.stderr)
+        else:
+            note = "" if result["ready"] else " (page not ready before timeout)"
+            report(f"{result['site']}, {result['path']}: {result['pathPoints']} path points, built in "
+                   f"{result['buildSeconds']:.2f} s, {result['seconds']:.2f} s in total{note}")
+    report(f"{results['slides']} slides -> {pptxPath}: deck assembled in {results['deckSeconds']:.2f} s, "
+           f"{len(entries)} maps in {results['seconds']:.2f} s")
+    return 1 if failures else 0
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Batch closest-point and map generation without the GUI.")
+    parser.add_argument("--quiet", action="store_true", help="only report errors")
+    parser.add_argument("--trace", default=None, help="write per-stage timings and counters to this JSON file")
+    parser.add_argument("--profile", action="store_true",
+                        help="also record a cProfile dump next to the trace (default trace: <output-dir>/trace.json)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse outputs stored here for inputs and options seen before")
+    parser.add_argument("--cache-max-mb", type=nonNegativeInt, default=512, help="evict least recently used outputs above this size")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    closest = subcommands.add_parser("closest", help="compute the closest points for each survey CSV")
+    closest.add_argument("inputs", nargs="+",
+                         help="survey CSV files with Lat, Lon and WiFi Channel columns, or point stores from 'convert'")
+    closest.add_argument("--output-dir", default=".", help="directory for <input>_ClosestPoints.<format> files")
+    closest.add_argument("--format", choices=["csv", "parquet", "npy"], default="csv",
+                         help="result format; every row carries the point's index and coordinates "
+                              "(parquet needs pyarrow, npy is a structured array for np.load(mmap_mode='r'))")
+    closest.add_argument("-k", type=positiveInt, default=3, help="number of neighbours per point")
+    closest.add_argument("--method", choices=["kdtree", "blocked", "approximate"], default="kdtree",
+                         help="approximate trades exactness for speed; its measured recall is stored with the output")
+    closest.add_argument("--candidates", type=positiveInt, default=8,
+                         help="points compared on either side of each point along each curve for --method approximate")
+    closest.add_argument("--recall-sample", type=positiveInt, default=1000,
+                         help="points checked against the exact result to measure recall for --method approximate")
+    closest.add_argument("--block-size", type=positiveInt, default=1024, help="tile size for --method blocked")
+    closest.add_argument("--workers", type=nonNegativeInt, default=1, help="worker processes (0 for one per core)")
+    closest.add_argument("--incremental", action="store_true",
+                         help="reuse <input>_ClosestPoints.state in the output directory from the last run and only "
+                              "recompute changed rows (KD-tree on one process)")
+    closest.add_argument("--co-channel", action="store_true",
+                         help="also write <input>_CoChannelPoints.<format> with the nearest same-channel points")
+    closest.add_argument("--channel-spread", type=nonNegativeInt, default=0,
+                         help="count channels this far apart as interferers (4 covers overlapping 2.4 GHz channels)")
+    closest.add_argument("--radius", type=float, default=None, help="only report interferers within this many miles")
+    closest.add_argument("--within", type=float, default=None, metavar="MILES",
+                         help="also write <input>_PointsWithinRadius.csv with the number of points within MILES")
+    closest.add_argument("--tile-rows", type=positiveInt, default=50000,
+                         help="points per tile for point stores; memory use grows with this, not the store size")
+    closest.set_defaults(handler=runClosest)
+
+    convert = subcommands.add_parser("convert", help="convert survey CSVs too large for memory into point stores")
+    convert.add_argument("inputs", nargs="+", help="survey CSV files with Lat, Lon and WiFi Channel columns")
+    convert.add_argument("--output-dir", default=".", help="directory for <input>_store directories")
+    convert.add_argument("--chunk-rows", type=positiveInt, default=1000000, help="rows held in memory at a time")
+    convert.set_defaults(handler=runConvert)
+
+    mapCommand = subcommands.add_parser("map", help="build a map for each site/path file pair")
+    mapCommand.add_argument("--pair", nargs=2, action="append", required=True, metavar=("SITE_CSV", "PATH_CSV"))
+    mapCommand.add_argument("--output-dir", default=".", help="directory for <site>_map.html/.png/.pptx files")
+    mapCommand.add_argument("--image", action="store_true", help="also render a PNG and PowerPoint slide")
+    mapCommand.add_argument("--site-color", default="red")
+    mapCommand.add_argument("--path-color", default="black")
+    mapCommand.add_argument("--path-mode", choices=["auto", "markers", "geojson", "polyline", "cluster"], default="auto",
+                            help="how path points are drawn (auto picks by point count)")
+    mapCommand.add_argument("--path-downsample", choices=["grid", "douglas-peucker"], default=None,
+                            help="thin the path before drawing it")
+    mapCommand.add_argument("--tiled", action="store_true",
+                            help="draw sites and path from tiles in <site>_map_tiles/ so the HTML stays small "
+                                 "(not cached; --path-mode and --path-downsample do not apply)")
+    mapCommand.add_argument("--min-zoom", type=int, default=0, help="shallowest zoom level tiles are written for with --tiled")
+    mapCommand.add_argument("--max-zoom", type=int, default=16, help="deepest zoom level tiles are written for with --tiled")
+    mapCommand.set_defaults(handler=runMap)
+
+    export = subcommands.add_parser("export", help="render every map in a manifest into one multi-slide PowerPoint")
+    export.add_argument("manifest", help="CSV with SiteFile and PathFile columns, relative to the manifest")
+    export.add_argument("--output-dir", default=".", help="directory for the presentation")
+    export.add_argument("--output", default="maps_presentation.pptx", help="presentation file name")
+    export.add_argument("--workers", type=nonNegativeInt, default=2,
+                        help="maps built and rendered at the same time (0 for one per core)")
+    export.add_argument("--keep-dir", default=None, help="keep each map's HTML and PNG in this directory")
+    export.add_argument("--site-color", default="red")
+    export.add_argument("--path-color", default="black")
+    export.add_argument("--path-mode", choices=["auto", "markers", "geojson", "polyline", "cluster"], default="auto")
+    export.add_argument("--path-downsample", choices=["grid", "douglas-peucker"], default=None)
+    export.add_argument("--stub-renderer", action="store_true", help="write placeholder images instead of starting Chrome")
+    export.set_defaults(handler=runExport)
+    return parser
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    if getattr(args, "workers", 1) == 0:
+        args.workers = None
+
+    def report(message):
+        if not args.quiet:
+            print(message, file=sys.stderr)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report(f"startup: {(time.perf_counter() - _startTime) * 1000:.1f} ms")
+    if args.trace or args.profile:
+        import Instrumentation
+        Instrumentation.enable(profile=args.profile)
+        with Instrumentation.run(args.command, tracePath=args.trace or os.path.join(args.output_dir, "trace.json")):
+            status = args.handler(args, report)
+        report(Instrumentation.formatTrace(Instrumentation.lastTrace))
+    else:
+        status = args.handler(args, report)
+    report(f"total: {time.perf_counter() - _startTime:.2f} s")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
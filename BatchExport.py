@@ -0,0 +1,134 @@
+import contextvars
+import csv
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from MapRenderer import RenderPool, placeholderPng
+from Instrumentation import stage
+
+# Batch map export: every site/path pair listed in a manifest is built and
+# rendered concurrently into its own files under a temporary directory, and
+# the images end up as the slides of one PowerPoint deck, in manifest order.
+#
+#   results = exportMaps(readManifest("maps.csv"), "maps.pptx", workers=4)
+#
+# The manifest is a CSV with SiteFile and PathFile columns; relative paths are
+# taken relative to the manifest.
+
+MANIFEST_COLUMNS = ["SiteFile", "PathFile"]
+
+def readManifest(manifestPath):
+    base = os.path.dirname(os.path.abspath(manifestPath))
+    with open(manifestPath, 'r', newline='') as file:
+        reader = csv.DictReader(file)
+        missing = [column for column in MANIFEST_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Missing columns in manifest: {', '.join(missing)}")
+        entries = []
+        for row in reader:
+            siteFile, pathFile = (row[column].strip() if row[column] else '' for column in MANIFEST_COLUMNS)
+            if not siteFile or not pathFile:
+                raise ValueError(f"Row {reader.line_num}: SiteFile and PathFile are both required")
+            entries.append({"site": os.path.join(base, siteFile), "path": os.path.join(base, pathFile)})
+    return entries
+
+# Builds, saves and renders one map; returns its paths and timings, or the error
+def exportMap(entry, number, directory, renderPool, mapOptions):
+    import MapGenerator
+    start = time.perf_counter()
+    stem = f"{number:04d}_{os.path.splitext(os.path.basename(entry['site']))[0]}"
+    result = dict(entry, number=number, html=os.path.join(directory, stem + ".html"),
+                  image=os.path.join(directory, stem + ".png"), error=None)
+    try:
+        map, pathStats = MapGenerator.buildMap(entry["site"], entry["path"], **mapOptions)
+        MapGenerator.saveMapHtml(map, result["html"])
+        result["buildSeconds"] = time.perf_counter() - start
+        result["ready"] = renderPool.render(result["html"], result["image"])
+        result["pathPoints"] = pathStats["points"]
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+# Writes one slide per image. python-pptx keeps every picture in memory until
+# the deck is saved, so each slide gets a tiny placeholder through the public
+# add_picture (a different width each, as identical images would share one
+# part) and the real PNGs are then copied into the saved file a block at a
+# time. The deck is written next to pptxPath and moved into place.
+@stage("assembleDeck")
+def assembleDeck(imagePaths, pptxPath):
+    from pptx import Presentation
+    from pptx.opc.constants import RELATIONSHIP_TYPE
+    from MapGenerator import addImageSlide
+    prs = Presentation()
+    media = {}
+    for n, imagePath in enumerate(imagePaths):
+        slidePart = addImageSlide(prs, io.BytesIO(placeholderPng(n + 1, 1))).part
+        imagePart, = (rel.target_part for rel in slidePart.rels.values() if rel.reltype == RELATIONSHIP_TYPE.IMAGE)
+        media[imagePart.partname.lstrip('/')] = imagePath
+
+    savedPath = pptxPath + ".tmp"
+    temporaryPath = pptxPath + ".part"
+    try:
+        prs.save(savedPath)
+        with zipfile.ZipFile(savedPath) as source, zipfile.ZipFile(temporaryPath, 'w', zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                if info.filename in media:
+                    # PNGs are already compressed, so they are stored as-is
+                    with open(media[info.filename], 'rb') as image, \
+                            target.open(zipfile.ZipInfo(info.filename, info.date_time), 'w', force_zip64=True) as out:
+                        shutil.copyfileobj(image, out, 1024 * 1024)
+                else:
+                    with source.open(info) as data, target.open(info, 'w') as out:
+                        shutil.copyfileobj(data, out, 1024 * 1024)
+        os.replace(temporaryPath, pptxPath)
+    finally:
+        for path in (savedPath, temporaryPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+# Exports every manifest entry and assembles the deck. Maps are built and
+# rendered on `workers` threads sharing a pool of `workers` browser sessions
+# (or renderPool, if given). Files go to a new temporary directory that is
+# removed afterwards unless keepDirectory is given. progress, if given, is
+# called as progress(done, total, message) as maps finish. Returns
+# {'maps': per-map results in manifest order, 'slides', 'deckSeconds', 'seconds'};
+# the html/image paths in the results only remain with keepDirectory.
+@stage("exportMaps")
+def exportMaps(entries, pptxPath, workers=2, renderPool=None, keepDirectory=None, mapOptions=None, progress=None):
+    start = time.perf_counter()
+    entries = list(entries)
+    mapOptions = mapOptions or {}
+    directory = keepDirectory or tempfile.mkdtemp(prefix="tws_export_")
+    os.makedirs(directory, exist_ok=True)
+    ownPool = renderPool is None
+    if ownPool:
+        renderPool = RenderPool(size=workers)
+    try:
+        results = [None] * len(entries)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # Each map runs in a copy of this context so its stages count towards the caller's trace
+            futures = {executor.submit(contextvars.copy_context().run, exportMap, entry, number, directory,
+                                       renderPool, mapOptions): number - 1
+                       for number, entry in enumerate(entries, 1)}
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results[futures[future]] = result
+                if progress:
+                    progress(done, len(entries), os.path.basename(result["site"]))
+
+        deckStart = time.perf_counter()
+        images = [result["image"] for result in results if result["error"] is None]
+        assembleDeck(images, pptxPath)
+        deckSeconds = time.perf_counter() - deckStart
+    finally:
+        if ownPool:
+            renderPool.close()
+        if keepDirectory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {"maps": results, "slides": len(images), "deckSeconds": deckSeconds,
+            "seconds": time.perf_counter() - start}
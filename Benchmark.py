@@ -0,0 +1,248 @@
+import argparse
+import csv
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline benchmark and regression check for the closest-point and map
+# pipelines. Synthetic WiFi, site and path CSVs are generated for each size and
+# distribution, every stage is timed on its own, peak Python memory per stage
+# is recorded with tracemalloc in a second pass, and the results can be saved
+# as a baseline or compared against one. Chrome is replaced by StubDriver.
+#
+#   python Benchmark.py --sizes 1k,10k --save-baseline benchmark_baseline.json
+#   python Benchmark.py --sizes 1k,10k --baseline benchmark_baseline.json --threshold 0.25
+#
+# Every pipeline is run once on a tiny dataset before anything is timed, so
+# first-use imports and caches are not charged to the first size. A stage is
+# only reported as a regression when it got slower by more than the threshold
+# and by more than --min-seconds (peak memory: --min-bytes), so millisecond
+# jitter on small sizes is not flagged.
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+DISTRIBUTIONS = ("uniform", "clustered")
+CHANNELS = ["1", "6", "11", "3", "#N/A"]
+# Points in the untimed warm-up dataset
+WARMUP_SIZE = 200
+
+# Yields n (lat, lon) pairs, either uniform over a 1x1 degree box or in 25 tight clusters
+def generatePoints(n, distribution, seed):
+    rng = random.Random(seed)
+    if distribution == "uniform":
+        for _ in range(n):
+            yield rng.uniform(40, 41), rng.uniform(-75, -74)
+    elif distribution == "clustered":
+        centers = [(rng.uniform(40, 41), rng.uniform(-75, -74)) for _ in range(25)]
+        for _ in range(n):
+            lat, lon = rng.choice(centers)
+            yield lat + rng.gauss(0, 0.01), lon + rng.gauss(0, 0.01)
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
+
+def writeWifiFile(filePath, n, distribution, seed=1):
+    rng = random.Random(seed)
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Lat", "Lon", "WiFi Channel"])
+        for lat, lon in generatePoints(n, distribution, seed):
+            writer.writerow([f"{lat:.6f}", f"{lon:.6f}", rng.choice(CHANNELS)])
+
+def writeSiteFile(filePath, n, distribution, seed=2):
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["SiteName", "Lat", "Long"])
+        for i, (lat, lon) in enumerate(generatePoints(n, distribution, seed)):
+            writer.writerow([f"Site{i}", f"{lat:.6f}", f"{lon:.6f}"])
+
+def writePathFile(filePath, n, distribution, seed=3):
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Latitude", "Longitude"])
+        for lat, lon in generatePoints(n, distribution, seed):
+            writer.writerow([f"{lat:.6f}", f"{lon:.6f}"])
+
+# Pipeline stages in order. Each takes the shared context dict and stores its
+# output there for the stages after it.
+def closestPointStages():
+    import Cleaner
+
+    def readCSV(ctx):
+        ctx["lat"], ctx["lon"], ctx["wifiChannel"], ctx["topThree"] = Cleaner.readCSV(ctx["wifiFile"])
+
+    def calculateClosestPoints(ctx):
+        Cleaner.calculateClosestPoints(ctx["lat"], ctx["lon"], ctx["wifiChannel"], ctx["topThree"])
+
+    def writeCSV(ctx):
+        Cleaner.writeCSV(ctx["topThree"], filePath=os.path.join(ctx["directory"], "ClosestPoints.csv"))
+
+    return [("readCSV", readCSV), ("calculateClosestPoints", calculateClosestPoints), ("writeCSV", writeCSV)]
+
+def mapStages():
+    import MapGenerator
+    from MapRenderer import RenderPool, StubDriver
+
+    def readSiteColumns(ctx):
+        ctx["sites"], ctx["siteDF"] = MapGenerator.readSiteColumns(ctx["siteFile"])
+
+    def readPathColumns(ctx):
+        ctx["path"], ctx["pathDF"] = MapGenerator.readPathColumns(ctx["pathFile"])
+
+    def addSiteMarkers(ctx):
+        ctx["map"] = MapGenerator.createMap(ctx["sites"])
+        MapGenerator.addSiteMarkers(ctx["sites"], ctx["siteDF"], ctx["map"])
+
+    def addPathMarkers(ctx):
+        MapGenerator.addPathMarkers(ctx["path"], ctx["map"])
+        MapGenerator.fitMapBounds(ctx["map"], ctx["sites"], ctx["path"])
+
+    def saveHtml(ctx):
+        ctx["htmlPath"] = os.path.join(ctx["directory"], "map.html")
+        ctx["map"].save(ctx["htmlPath"])
+
+    def renderImage(ctx):
+        ctx["imagePath"] = os.path.join(ctx["directory"], "map.png")
+        with RenderPool(driverFactory=StubDriver, idleTime=0, pollInterval=0) as pool:
+            pool.render(ctx["htmlPath"], ctx["imagePath"])
+
+    def saveImageToPowerPoint(ctx):
+        MapGenerator.saveImageToPowerPoint(ctx["imagePath"], os.path.join(ctx["directory"], "map_presentation.pptx"))
+
+    return [("readSiteColumns", readSiteColumns), ("readPathColumns", readPathColumns),
+            ("addSiteMarkers", addSiteMarkers), ("addPathMarkers", addPathMarkers), ("saveHtml", saveHtml),
+            ("renderImage", renderImage), ("saveImageToPowerPoint", saveImageToPowerPoint)]
+
+# Runs the stages once, returning {stage: seconds} or {stage: peak bytes}
+def runStages(stages, ctx, measureMemory):
+    results = {}
+    for name, stage in stages:
+        gc.collect()
+        if measureMemory:
+            tracemalloc.start()
+            stage(ctx)
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            stage(ctx)
+            results[name] = time.perf_counter() - start
+    return results
+
+# Stage lists by the name given to --pipelines
+PIPELINES = {"closest": closestPointStages, "map": mapStages}
+
+# Writes the wifi, site and path files for n points and returns the stage context
+def writeDataset(directory, n, distribution):
+    files = {"directory": directory,
+             "wifiFile": os.path.join(directory, "wifi.csv"),
+             "siteFile": os.path.join(directory, "sites.csv"),
+             "pathFile": os.path.join(directory, "path.csv")}
+    writeWifiFile(files["wifiFile"], n, distribution)
+    writeSiteFile(files["siteFile"], n, distribution)
+    writePathFile(files["pathFile"], n, distribution)
+    return files
+
+# Runs each pipeline once, untimed, so lazy imports and first-call setup are done
+def warmUp(pipelines):
+    with tempfile.TemporaryDirectory() as directory:
+        files = writeDataset(directory, WARMUP_SIZE, DISTRIBUTIONS[0])
+        for pipeline in pipelines:
+            runStages(PIPELINES[pipeline](), dict(files), False)
+
+def benchmarkDataset(sizeName, distribution, pipelines, repeat, measureMemory):
+    n = SIZES[sizeName]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        files = writeDataset(directory, n, distribution)
+        for pipeline in pipelines:
+            stages = PIPELINES[pipeline]()
+            timings = [runStages(stages, dict(files), False) for _ in range(repeat)]
+            memory = runStages(stages, dict(files), True) if measureMemory else {}
+            for name, stage in stages:
+                results[f"{sizeName}/{distribution}/{name}"] = {
+                    "seconds": min(timing[name] for timing in timings),
+                    "peakBytes": memory.get(name)}
+    return results
+
+# Smallest slowdown and peak memory growth that count as a regression
+MIN_SECONDS = 0.005
+MIN_BYTES = 1024 * 1024
+
+# True if current exceeds previous both by the relative threshold and by minimum
+def exceeds(current, previous, threshold, minimum):
+    return current - previous > max(previous * threshold, minimum)
+
+# Lists stages that got slower (or used more memory) than the baseline allows
+def compareWithBaseline(results, baseline, threshold, memoryThreshold, minSeconds=MIN_SECONDS, minBytes=MIN_BYTES):
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if exceeds(current["seconds"], previous["seconds"], threshold, minSeconds):
+            regressions.append(f"{key}: {previous['seconds']:.4f} s -> {current['seconds']:.4f} s")
+        if current["peakBytes"] is not None and previous.get("peakBytes") is not None \
+                and exceeds(current["peakBytes"], previous["peakBytes"], memoryThreshold, minBytes):
+            regressions.append(f"{key}: {previous['peakBytes']} B -> {current['peakBytes']} B peak")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the closest-point and map pipelines offline.")
+    parser.add_argument("--sizes", default="1k,10k", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS))
+    parser.add_argument("--pipelines", default="closest,map", help=f"comma-separated, from {', '.join(PIPELINES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="timing runs per stage; the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--memory-threshold", type=float, default=0.2, help="allowed peak memory growth")
+    parser.add_argument("--min-seconds", type=float, default=MIN_SECONDS,
+                        help="slowdowns smaller than this are never regressions")
+    parser.add_argument("--min-bytes", type=int, default=MIN_BYTES,
+                        help="peak memory growth smaller than this is never a regression")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip().lower() for size in args.sizes.split(",")]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+    distributions = [name.strip() for name in args.distributions.split(",")]
+    unknown = [name for name in distributions if name not in DISTRIBUTIONS]
+    if unknown:
+        parser.error(f"unknown distributions: {', '.join(unknown)}")
+    pipelines = [name.strip() for name in args.pipelines.split(",")]
+    unknown = [name for name in pipelines if name not in PIPELINES]
+    if unknown:
+        parser.error(f"unknown pipelines: {', '.join(unknown)}")
+
+    warmUp(pipelines)
+    results = {}
+    for sizeName in sizes:
+        for distribution in distributions:
+            results.update(benchmarkDataset(sizeName, distribution, pipelines, args.repeat, not args.no_memory))
+
+    for key, result in results.items():
+        peak = f"{result['peakBytes'] / 1024 / 1024:9.1f} MiB" if result["peakBytes"] is not None else ""
+        print(f"{key:<48}{result['seconds']:10.4f} s {peak}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compareWithBaseline(results, baseline, args.threshold, args.memory_threshold,
+                                          args.min_seconds, args.min_bytes)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
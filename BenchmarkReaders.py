@@ -0,0 +1,63 @@
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+# Compares the GeoDataFrame readers (readSiteInfo/readPathInfo) with the
+# columnar readers (readSiteColumns/readPathColumns) on synthetic files.
+#
+#   python BenchmarkReaders.py --rows 1000000
+
+def writeSiteFile(filePath, rows, seed=1):
+    rng = random.Random(seed)
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["SiteName", "Lat", "Long", "Height"])
+        for i in range(rows):
+            writer.writerow([f"Site{i}", f"{rng.uniform(40, 41):.6f}", f"{rng.uniform(-75, -74):.6f}", rng.randint(10, 60)])
+
+def writePathFile(filePath, rows, seed=2):
+    rng = random.Random(seed)
+    lat, lon = 40.5, -74.5
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Latitude", "Longitude", "RSRP"])
+        for i in range(rows):
+            lat += rng.uniform(-1e-4, 1e-4)
+            lon += rng.uniform(-1e-4, 1e-4)
+            writer.writerow([f"{lat:.6f}", f"{lon:.6f}", rng.randint(-120, -60)])
+
+def timeCall(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the site/path readers.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, default=250000)
+    args = parser.parse_args(argv)
+
+    import MapGenerator
+    with tempfile.TemporaryDirectory() as directory:
+        sitePath = os.path.join(directory, "sites.csv")
+        pathPath = os.path.join(directory, "path.csv")
+        writeSiteFile(sitePath, args.rows)
+        writePathFile(pathPath, args.rows)
+
+        results = [
+            ("readSiteInfo", timeCall(MapGenerator.readSiteInfo, sitePath)),
+            ("readSiteColumns", timeCall(MapGenerator.readSiteColumns, sitePath)),
+            ("readSiteColumns (chunked)", timeCall(MapGenerator.readSiteColumns, sitePath, args.chunk_size)),
+            ("readPathInfo", timeCall(MapGenerator.readPathInfo, pathPath)),
+            ("readPathColumns", timeCall(MapGenerator.readPathColumns, pathPath)),
+            ("readPathColumns (chunked)", timeCall(MapGenerator.readPathColumns, pathPath, args.chunk_size)),
+        ]
+    print(f"{args.rows} rows")
+    for name, seconds in results:
+        print(f"{name:<28}{seconds:8.3f} s")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,23 @@
 import csv
+import json
+import os
+from array import array
 from math import *
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from SpatialIndex import KDTree, ChannelIndex, GridIndex, sphericalDistance
+from DistanceKernel import blockedTopK, approximateTopK, measureRecall
+from ParallelNeighbors import parallelNeighbors
+from IncrementalUpdate import updateNeighbors
+from Instrumentation import stage, count
+
+#WiFi Channel value stored for '#N/A'
+NO_CHANNEL = -32768
 
 #Uses the haversine formula to calculate the distance between two points
+#(the same scalar formula the KD-tree ranks candidates with, so method='kdtree'
+#and the brute-force reference give identical distances and ordering)
 def haversine(lat1, lat2, lon1, lon2):
-    lat1 = float(lat1)
-    lat2 = float(lat2)
-    lon1 = float(lon1)
-    lon2 = float(lon2)
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dLat = lat2 - lat1
-    dLon = lon2 - lon1
-    a = sin(dLat/2)**2 + cos(lat1) * cos(lat2) * sin(dLon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 3959.87433
-    return(c * r)
+    lat1, lat2, lon1, lon2 = map(radians, map(float, [lat1, lat2, lon1, lon2]))
+    return sphericalDistance(lat1, lat2, lon1, lon2, cos(lat1), cos(lat2))
 
 #Prints Extracted CSV data
 def printData(lat, lon, wifiChannel):
@@ -28,8 +30,108 @@ def printDict(dict):
     for key, value in dict.items():
         print(f"{key}: {value}\n")
 
-#Calculates the 3 closest points to each point
-def calculateClosestPoints(lat, lon, wifiChannel, topThree):
+#How many points are processed between progress callbacks
+PROGRESS_INTERVAL = 1000
+
+#Stores one point's neighbors [(j, distance)] in topThree and passes them on to
+#writer (see ResultWriters); either may be None
+def storeNeighbors(i, neighbors, lat, lon, wifiChannel, topThree, writer):
+    if topThree is not None:
+        topThree[i] = [(lat[j], lon[j], dist, wifiChannel[i] == wifiChannel[j]) for j, dist in neighbors]
+    if writer is not None:
+        writer.add(i, neighbors)
+
+#Calculates the k closest points to each point
+#method='kdtree' uses a KD-tree over the unit sphere, method='blocked' compares
+#all pairs with the vectorized kernel in memory-bounded tiles (its distances
+#match the KD-tree's to DistanceKernel.DISTANCE_TOLERANCE, see there)
+#method='approximate' only compares each point with the `candidates` points on
+#either side of it along a few space-filling curves (more candidates: higher
+#recall, more time) and measures recall@k against the exact kernel on
+#recallSample random points
+#workers > 1 spreads the queries over a process pool with identical output
+#progress, if given, is called as progress(done, total) as points complete
+#writer, if given, receives each point's results as they are produced; pass
+#topThree=None to stream results to the writer without keeping them
+#Returns {'mode': 'exact'} or {'mode': 'approximate', 'candidates', 'recall@k', 'recallSample'};
+#this is also handed to the writer, which stores it next to the results (see ResultWriters)
+@stage("calculateClosestPoints")
+def calculateClosestPoints(lat, lon, wifiChannel, topThree, k=3, method='kdtree', blockSize=1024, workers=1, progress=None, writer=None,
+                           candidates=8, recallSample=1000):
+    if method not in ('kdtree', 'blocked', 'approximate'):
+        raise ValueError(f"Unknown closest point method: {method}")
+    total = len(lat)
+    count("points", total)
+    if method == 'approximate':
+        indices, distances = approximateTopK(lat, lon, k, candidates, progress=progress)
+        recall, sampled = measureRecall(lat, lon, distances, k, recallSample)
+        info = {'mode': 'approximate', 'candidates': candidates, f'recall@{k}': round(recall, 4), 'recallSample': sampled}
+        if writer is not None:
+            writer.setMetadata(info)
+        for i, (row, dist) in enumerate(zip(indices.tolist(), distances.tolist())):
+            storeNeighbors(i, [(j, d) for j, d in zip(row, dist) if j >= 0], lat, lon, wifiChannel, topThree, writer)
+        return info
+    info = {'mode': 'exact'}
+    if writer is not None:
+        writer.setMetadata(info)
+    if workers != 1:
+        neighbors = parallelNeighbors(lat, lon, k, method, blockSize, workers, progress=progress)
+        for i in range(total):
+            storeNeighbors(i, neighbors[i], lat, lon, wifiChannel, topThree, writer)
+    elif method == 'kdtree':
+        tree = KDTree(lat, lon)
+        for i in range(total):
+            storeNeighbors(i, tree.query(i, k), lat, lon, wifiChannel, topThree, writer)
+            if progress and (i + 1) % PROGRESS_INTERVAL == 0:
+                progress(i + 1, total)
+    elif method == 'blocked':
+        #Rows are handed to the kernel a few tiles at a time so progress can be reported
+        step = max(blockSize, PROGRESS_INTERVAL // blockSize * blockSize)
+        for rowStart in range(0, total, step):
+            indices, distances = blockedTopK(lat, lon, k, blockSize, rowStart, rowStart + step)
+            for offset, (row, dist) in enumerate(zip(indices.tolist(), distances.tolist())):
+                storeNeighbors(rowStart + offset, list(zip(row, dist)), lat, lon, wifiChannel, topThree, writer)
+            if progress:
+                progress(min(rowStart + step, total), total)
+    if progress:
+        progress(total, total)
+    return info
+
+#Calculates the k closest points to each point, reusing the results saved in
+#statePath by the previous run so only rows that were added, removed or edited
+#(and the points near them) are recomputed. Returns counts of added, removed
+#and recomputed points. topThree and writer work as in calculateClosestPoints.
+@stage("calculateClosestPointsIncremental")
+def calculateClosestPointsIncremental(lat, lon, wifiChannel, topThree, k=3, statePath='ClosestPoints.state', progress=None, writer=None):
+    neighbors, stats = updateNeighbors(lat, lon, wifiChannel, k, statePath, progress)
+    if writer is not None:
+        writer.setMetadata({'mode': 'exact'})
+    for i in range(len(lat)):
+        storeNeighbors(i, neighbors[i], lat, lon, wifiChannel, topThree, writer)
+    return stats
+
+#Calculates the k nearest co-channel interferers of each point: points whose WiFi
+#Channel is within spread of its own (0 = same channel only) and, if radius is
+#given, within radius miles. Points with '#N/A' channels get no interferers.
+#writer (opened with mode='cochannel') and interferers=None work as in calculateClosestPoints.
+def calculateCoChannelPoints(lat, lon, wifiChannel, interferers, k=3, radius=None, spread=0, writer=None):
+    index = ChannelIndex(lat, lon, wifiChannel, noChannel=NO_CHANNEL)
+    for i in range(len(lat)):
+        neighbors = index.query(i, k, spread, radius)
+        if interferers is not None:
+            interferers[i] = [(lat[j], lon[j], dist, wifiChannel[j]) for j, dist in neighbors]
+        if writer is not None:
+            writer.add(i, neighbors)
+    return None
+
+#Finds every point within radius miles of each point using a uniform grid index.
+#Returns per-point counts and, with withLists, the neighbors in CSR layout
+#(offsets, indices); otherwise offsets and indices are None.
+def calculatePointsWithinRadius(lat, lon, radius, withLists=False):
+    return GridIndex(lat, lon, radius).neighborsWithin(withLists)
+
+#Calculates the k closest points to each point by comparing every pair (reference implementation)
+def calculateClosestPointsBruteForce(lat, lon, wifiChannel, topThree, k=3):
     for i in range(len(lat)):
         distances = []
         for j in range(len(lat)):
@@ -39,84 +141,132 @@ def calculateClosestPoints(lat, lon, wifiChannel, topThree):
                 distances.append((j, distance, same_channel))
         #sorts based on the distance values
         distances.sort(key=lambda x: x[1])
-        topThree[i] = [(lat[index], lon[index], dist, same_channel) for index, dist, same_channel in distances[:3]]
+        topThree[i] = [(lat[index], lon[index], dist, same_channel) for index, dist, same_channel in distances[:k]]
     return None
 
-#Reads from CSV file
-def readCSV(filePath):
-    fileName = open(filePath, 'r')
-    
-    file = csv.DictReader(fileName)
-    required_fields = ['Lat', 'Lon', 'WiFi Channel']
-        
+#Streams (lat, lon, wifiChannel) from a CSV file, validating every row
+#('#N/A' and blank channels come back as NO_CHANNEL). Errors name the CSV row number.
+#Like csv.DictReader, blank lines are skipped and a repeated header name refers
+#to its last column. Lat/Lon come back as floats, so results carry float
+#values (e.g. '40.10' is written back as 40.1) rather than the original text.
+def readCSVRows(filePath):
+    with open(filePath, 'r', newline='') as fileName:
+        file = csv.reader(fileName)
+        header = next(file, [])
+        required_fields = ['Lat', 'Lon', 'WiFi Channel']
+
         # Check if required fields are present
-    if not all(field in file.fieldnames for field in required_fields):
-        missing_fields = [field for field in required_fields if field not in file.fieldnames]
-        messagebox.showerror("Missing Fields", f"The following required fields are missing: {', '.join(missing_fields)}")
-        return None, None, None, None
-    lat = []
-    lon = []
-    wifiChannel = []
-    topThree = {}  
-
-    for col in file:
-        try:
-            latitude = float(col['Lat'])
-            longitude = float(col['Lon'])
-            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
-                raise ValueError
-        except ValueError:
-            raise ValueError(f"Invalid latitude or longitude value: {col['Lat']}, {col['Lon']}")
-        
-        wifi_channel = col['WiFi Channel']
-        if wifi_channel != '#N/A':
+        if not all(field in header for field in required_fields):
+            missing_fields = [field for field in required_fields if field not in header]
+            raise ValueError(f"The following required fields are missing: {', '.join(missing_fields)}")
+        latColumn, lonColumn, channelColumn = (len(header) - 1 - header[::-1].index(field) for field in required_fields)
+
+        for row in file:
+            if not row:
+                continue
+            rowNumber = file.line_num
             try:
-                wifi_channel = int(wifi_channel)
-            except ValueError:
-                raise ValueError(f"WiFi Channel must be a number or '#N/A': {wifi_channel}")
-        
-        lat.append(col['Lat'])
-        lon.append(col['Lon'])
-        wifiChannel.append(col['WiFi Channel'])
-    
+                latitude = float(row[latColumn])
+                longitude = float(row[lonColumn])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise ValueError
+            except (ValueError, IndexError):
+                values = [row[column] for column in (latColumn, lonColumn) if column < len(row)]
+                raise ValueError(f"Row {rowNumber}: Invalid latitude or longitude value: {', '.join(values)}")
+
+            wifi_channel = row[channelColumn] if channelColumn < len(row) else ''
+            if wifi_channel in ('#N/A', ''):
+                wifi_channel = NO_CHANNEL
+            else:
+                try:
+                    wifi_channel = int(wifi_channel)
+                    if not (NO_CHANNEL < wifi_channel <= 32767):
+                        raise ValueError
+                except ValueError:
+                    raise ValueError(f"Row {rowNumber}: WiFi Channel must be a number or '#N/A': {wifi_channel}")
+
+            yield latitude, longitude, wifi_channel
+
+#Reads from CSV file into typed columns: float64 arrays for Lat/Lon and an
+#int16 array for WiFi Channel (NO_CHANNEL for '#N/A'), about 18 bytes per row
+#(PointStore converts files too large for memory into a memory-mapped store)
+@stage("readCSV")
+def readCSV(filePath):
+    lat = array('d')
+    lon = array('d')
+    wifiChannel = array('h')
+    topThree = {}
+    for latitude, longitude, wifi_channel in readCSVRows(filePath):
+        lat.append(latitude)
+        lon.append(longitude)
+        wifiChannel.append(wifi_channel)
+    count("rows read", len(lat))
     return(lat, lon, wifiChannel, topThree)
 
-#Writes to CSV file
-def writeCSV(dict):
-    fields = ['Lat1', 'Lon1', 'Distance1', 'Same Channel 1', 
-              'Lat2', 'Lon2', 'Distance2', 'Same Channel 2', 
-              'Lat3', 'Lon3', 'Distance3', 'Same Channel 3']
-    with open('ClosestPoints.csv', 'w', newline='') as file:
+#Builds the header for k neighbors per row
+#mode='closest' flags whether each neighbor shares the channel,
+#mode='cochannel' lists each interferer's channel
+def closestPointFields(k=3, mode='closest'):
+    if mode not in ('closest', 'cochannel'):
+        raise ValueError(f"Unknown output mode: {mode}")
+    fields = []
+    for n in range(1, k + 1):
+        last = f'Same Channel {n}' if mode == 'closest' else f'Channel {n}'
+        fields.extend([f'Lat{n}', f'Lon{n}', f'Distance{n}', last])
+    return fields
+
+#Rows handed to the csv writer at a time
+WRITE_CHUNK_ROWS = 50000
+
+#Columns that close a closest-point CSV row when run metadata is given, so the
+#file itself says whether it is exact or approximate (and with what recall)
+RUN_FIELDS = ['Mode', 'Recall']
+
+#RUN_FIELDS values for run metadata from calculateClosestPoints; exact runs have recall 1
+def runValues(metadata):
+    recall = next((value for key, value in metadata.items() if key.startswith('recall@')), 1.0)
+    return [metadata.get('mode', 'exact'), recall]
+
+#.npy results have no room for metadata, so it is kept in a JSON file next to them
+def metadataPath(filePath):
+    return filePath + ".meta.json"
+
+#Writes metadata next to filePath, or removes one left by an earlier run if there is none
+def writeMetadata(filePath, metadata):
+    if metadata:
+        with open(metadataPath(filePath), 'w') as file:
+            json.dump(metadata, file, indent=2)
+    elif os.path.exists(metadataPath(filePath)):
+        os.remove(metadataPath(filePath))
+
+#Writes to CSV file, in chunks of WRITE_CHUNK_ROWS rows through a 1 MB buffer
+#(ResultWriters has writers that also keep each point's index and coordinates)
+#metadata, if given, adds the RUN_FIELDS columns (rows with fewer than k
+#neighbors are padded so they line up)
+@stage("writeCSV")
+def writeCSV(dict, k=3, filePath='ClosestPoints.csv', mode='closest', metadata=None):
+    fields = closestPointFields(k, mode)
+    run = runValues(metadata) if metadata else None
+    with open(filePath, 'w', newline='', buffering=1024 * 1024) as file:
         writer = csv.writer(file)
-        writer.writerow(fields)
-        for key, value in dict.items():
+        writer.writerow(fields + RUN_FIELDS if run else fields)
+        rows = []
+        for value in dict.values():
             row = []
             for item in value:
-                row.extend([item[0], item[1], item[2], item[3]])
-            writer.writerow(row)
-
-
-def importCSV():
-    file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
-    if file_path:
-        try:
-            global lat, lon, wifiChannel, topThree
-            lat, lon, wifiChannel, topThree = readCSV(file_path)
-            if(lat and lon and wifiChannel):
-                file_label.config(text=f"File: {file_path}")
-                messagebox.showinfo("Import Successful", "CSV file imported successfully!")
-        except ValueError as e:
-            messagebox.showerror("Error", str(e))
-
-def runCalculation():
-    global lat, lon, wifiChannel, topThree
-    try:
-        calculateClosestPoints(lat, lon, wifiChannel, topThree)
-        writeCSV(topThree)
-    # printDict(topThree)
-    except:
-        messagebox.showerror("Calculation Error", "Please input valid data")
-    else:
-        messagebox.showinfo("Calculation Complete", "Closest points calculated and saved to ClosestPoints.csv!")
-
+                row.extend(item[:4])
+            if run:
+                row.extend([''] * (len(fields) - len(row)) + run)
+            rows.append(row)
+            if len(rows) >= WRITE_CHUNK_ROWS:
+                writer.writerows(rows)
+                rows = []
+        writer.writerows(rows)
+    count("rows written", len(dict))
 
+#Writes the number of points within the radius of each point
+def writeRadiusCSV(lat, lon, counts, filePath='PointsWithinRadius.csv'):
+    with open(filePath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Lat', 'Lon', 'Count'])
+        writer.writerows(zip(lat, lon, counts))
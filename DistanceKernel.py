@@ -0,0 +1,173 @@
+import numpy as np
+from SpatialIndex import EARTH_RADIUS
+from Instrumentation import stage
+
+# NumPy's sin/cos/arcsin can differ from the math module's in the last bit, so
+# distances from this kernel match SpatialIndex.sphericalDistance (used by the
+# KD-tree and Cleaner.haversine) to this relative tolerance rather than
+# exactly, and neighbours whose distances are that close may be ordered
+# differently between method='blocked' and method='kdtree'
+DISTANCE_TOLERANCE = 1e-12
+
+# Haversine distance in miles on arrays already converted to radians.
+# cosLat1/cosLat2 can be passed in when they have been precomputed.
+def haversineRadians(lat1, lat2, lon1, lon2, cosLat1=None, cosLat2=None):
+    if cosLat1 is None:
+        cosLat1 = np.cos(lat1)
+    if cosLat2 is None:
+        cosLat2 = np.cos(lat2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + cosLat1 * cosLat2 * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0))) * EARTH_RADIUS
+
+# Haversine distance in miles on array-likes of degrees (broadcasts like numpy)
+def haversineArray(lat1, lat2, lon1, lon2):
+    lat1, lat2, lon1, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lat2, lon1, lon2))
+    return haversineRadians(lat1, lat2, lon1, lon2)
+
+# Keeps the k smallest distances of each row, ordered by (distance, column) so ties
+# resolve to the lower index exactly like a stable sort would
+def _selectTopK(distances, columns, k):
+    if distances.shape[1] > k:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        kth = np.take_along_axis(distances, part, axis=1).max(axis=1)
+        # argpartition is free to pick any of several equal kth values; redo those rows
+        ties = np.count_nonzero(distances <= kth[:, None], axis=1) > k
+        for row in np.nonzero(ties)[0]:
+            part[row] = np.lexsort((columns[row], distances[row]))[:k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        columns = np.take_along_axis(columns, part, axis=1)
+    order = np.lexsort((columns, distances), axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+# k nearest neighbours of the points at `rows` (an index array) among all
+# points, comparing them against blockSize columns at a time
+def _rowsTopK(latRad, lonRad, cosLat, rows, k, blockSize):
+    n = len(latRad)
+    bestIndex = np.empty((len(rows), 0), dtype=np.int64)
+    bestDistance = np.empty((len(rows), 0), dtype=np.float64)
+    rowLat, rowLon, rowCos = latRad[rows, None], lonRad[rows, None], cosLat[rows, None]
+    for colStart in range(0, n, blockSize):
+        colStop = min(colStart + blockSize, n)
+        cols = slice(colStart, colStop)
+        tile = haversineRadians(rowLat, latRad[None, cols], rowLon, lonRad[None, cols], rowCos, cosLat[None, cols])
+        tileColumns = np.broadcast_to(np.arange(colStart, colStop), tile.shape)
+        # A point is never its own neighbour
+        if len(rows) and rows.min() < colStop and rows.max() >= colStart:
+            tile[rows[:, None] == tileColumns] = np.inf
+        tileIndex, tileDistance = _selectTopK(tile, tileColumns, k)
+
+        # Merge the tile's best with the running best for these rows
+        bestIndex, bestDistance = _selectTopK(np.concatenate((bestDistance, tileDistance), axis=1),
+                                              np.concatenate((bestIndex, tileIndex), axis=1), k)
+    return bestIndex, bestDistance
+
+def _prepareRadians(lat, lon):
+    latRad = np.radians(np.asarray(lat, dtype=np.float64))
+    lonRad = np.radians(np.asarray(lon, dtype=np.float64))
+    return latRad, lonRad, np.cos(latRad)
+
+# Finds the k nearest neighbours of every point by comparing all pairs in
+# blockSize x blockSize tiles. Peak memory is one tile plus the running
+# (n, k) result, whatever the number of points. rowStart/rowStop restrict
+# the query points to a slice while still searching every point.
+@stage("blockedTopK")
+def blockedTopK(lat, lon, k=3, blockSize=1024, rowStart=0, rowStop=None):
+    latRad, lonRad, cosLat = _prepareRadians(lat, lon)
+    n = len(latRad)
+    k = max(0, min(k, n - 1))
+    firstRow = rowStart
+    lastRow = n if rowStop is None else min(rowStop, n)
+    indices = np.empty((max(0, lastRow - firstRow), k), dtype=np.int64)
+    distances = np.empty((max(0, lastRow - firstRow), k), dtype=np.float64)
+    if k == 0:
+        return indices, distances
+
+    for rowStart in range(firstRow, lastRow, blockSize):
+        rowStop = min(rowStart + blockSize, lastRow)
+        block = slice(rowStart - firstRow, rowStop - firstRow)
+        indices[block], distances[block] = _rowsTopK(latRad, lonRad, cosLat, np.arange(rowStart, rowStop), k, blockSize)
+    return indices, distances
+
+# Exact k nearest neighbours of the points at `rows` only (e.g. a sample)
+def sampleTopK(lat, lon, rows, k=3, blockSize=1024):
+    latRad, lonRad, cosLat = _prepareRadians(lat, lon)
+    k = max(0, min(k, len(latRad) - 1))
+    return _rowsTopK(latRad, lonRad, cosLat, np.asarray(rows, dtype=np.int64), k, blockSize)
+
+# Shifted space-filling curves searched by approximateTopK
+APPROXIMATE_CURVES = 4
+
+# Approximate k nearest neighbours. Points are ordered along APPROXIMATE_CURVES
+# Z-order curves over their unit-sphere coordinates, each with its grid
+# shifted by a random offset, and only the `candidates` points on either side
+# of a point along each curve are compared with it. More candidates means
+# higher recall and more time; missing neighbours get index -1 and distance inf.
+@stage("approximateTopK")
+def approximateTopK(lat, lon, k=3, candidates=16, blockSize=65536, seed=0, progress=None):
+    latRad, lonRad, cosLat = _prepareRadians(lat, lon)
+    n = len(latRad)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.empty((n, 0), dtype=np.int64), np.empty((n, 0), dtype=np.float64)
+    candidates = max(candidates, k)
+    xyz = np.stack((cosLat * np.cos(lonRad), cosLat * np.sin(lonRad), np.sin(latRad)), axis=1)
+    rng = np.random.default_rng(seed)
+    orders = []
+    ranks = []
+    for curve in range(APPROXIMATE_CURVES):
+        shift = 0.0 if curve == 0 else rng.uniform(0.0, 2.0, 3)
+        # 21 bits per axis over [-1, 3), so every shifted coordinate fits
+        q = np.clip(((xyz + 1.0 + shift) / 4.0 * (1 << 21)).astype(np.int64), 0, (1 << 21) - 1)
+        key = _spreadBits3(q[:, 0]) | (_spreadBits3(q[:, 1]) << 1) | (_spreadBits3(q[:, 2]) << 2)
+        order = np.argsort(key, kind='stable')
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        orders.append(order)
+        ranks.append(rank)
+
+    offsets = np.concatenate((np.arange(-candidates, 0), np.arange(1, candidates + 1)))
+    indices = np.empty((n, k), dtype=np.int64)
+    distances = np.empty((n, k), dtype=np.float64)
+    for rowStart in range(0, n, blockSize):
+        rows = np.arange(rowStart, min(rowStart + blockSize, n))
+        columns = np.concatenate([order[np.clip(rank[rows, None] + offsets, 0, n - 1)]
+                                  for order, rank in zip(orders, ranks)], axis=1)
+        tile = haversineRadians(latRad[rows, None], latRad[columns], lonRad[rows, None], lonRad[columns],
+                                cosLat[rows, None], cosLat[columns])
+        # Drop the point itself and repeats of a candidate found on several curves
+        sortedOrder = np.argsort(columns, axis=1, kind='stable')
+        columns = np.take_along_axis(columns, sortedOrder, axis=1)
+        tile = np.take_along_axis(tile, sortedOrder, axis=1)
+        tile[:, 1:][columns[:, 1:] == columns[:, :-1]] = np.inf
+        tile[columns == rows[:, None]] = np.inf
+        blockIndex, blockDistance = _selectTopK(tile, columns, k)
+        blockIndex[np.isinf(blockDistance)] = -1
+        indices[rows], distances[rows] = blockIndex, blockDistance
+        if progress:
+            progress(rows[-1] + 1, n)
+    return indices, distances
+
+# Spreads the low 21 bits of each value out to every third bit position.
+# PointStore's keys interleave two 32-bit lat/lon values; these interleave
+# three 21-bit xyz values, so the curves have no seam at the antimeridian
+def _spreadBits3(values):
+    x = values & 0x1FFFFF
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        x = (x | (x << shift)) & mask
+    return x
+
+# Fraction of the true k nearest neighbours found, over a random sample of
+# sampleSize points checked against the exact kernel. A neighbour counts as
+# found if it is no farther than the true k-th neighbour, so ties are not
+# counted as misses.
+def measureRecall(lat, lon, distances, k=3, sampleSize=1000, seed=0, blockSize=1024):
+    n = len(lat)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return 1.0, 0
+    rows = np.sort(np.random.default_rng(seed).choice(n, min(sampleSize, n), replace=False))
+    exactIndex, exactDistance = sampleTopK(lat, lon, rows, k, blockSize)
+    limit = exactDistance[:, -1:] * (1 + DISTANCE_TOLERANCE)
+    found = np.count_nonzero(np.asarray(distances)[rows, :k] <= limit, axis=1)
+    return float(found.sum()) / (len(rows) * k), len(rows)
@@ -1,17 +1,19 @@
+import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, colorchooser
-import folium
-import pandas as pd
-import geopandas
-import webbrowser
-from selenium import webdriver
-from PIL import Image
-import time
-import os
-import csv
-from math import radians, sin, cos, sqrt, asin
-from Cleaner import runCalculation, importCSV, writeCSV, readCSV, calculateClosestPoints, haversine
-from MapGenerator import readSiteInfo, readPathInfo, createMap, addSiteMarkers, addPathMarkers, fitMapBounds, openMap, saveMapAsImage
+from Cleaner import writeCSV, readCSV, calculateClosestPointsIncremental
+from IncrementalUpdate import statePathFor
+from ResultCache import ResultCache
+from JobRunner import Job, formatProgress
+import Instrumentation
+# MapGenerator (folium, pandas, geopandas, selenium) is imported when a map is built
+
+# Outputs from earlier runs on identical inputs, shared by every window
+resultCache = ResultCache()
+
+# Shows the stage timings of the last instrumented run (enabled with TWS_TRACE=1)
+def show_last_trace():
+    messagebox.showinfo("Timing", Instrumentation.formatTrace(Instrumentation.lastTrace))
 
 
 # Application 1: Map Generator
@@ -24,6 +26,7 @@ class MapGeneratorApp:
         self.pathFilePath = ""
         self.site_color = 'red'
         self.path_color = 'black'
+        self.job = None
         self.create_widgets()
 
     def create_widgets(self):
@@ -53,8 +56,28 @@ class MapGeneratorApp:
         # create_map_btn = ttk.Button(frame, text="Create Map", command=self.create_map, style='TButton')
         # create_map_btn.pack(pady=10, fill='x')
 
-        save_image_btn = ttk.Button(frame, text="Save Map as Image", command=self.save_map_as_image, style='TButton')
-        save_image_btn.pack(pady=10, fill='x')
+        self.save_image_btn = ttk.Button(frame, text="Save Map as Image", command=self.save_map_as_image, style='TButton')
+        self.save_image_btn.pack(pady=10, fill='x')
+
+        self.progress_label = ttk.Label(frame, text="", style='TLabel')
+        self.progress_label.pack(pady=5, fill='x')
+
+        self.cancel_btn = ttk.Button(frame, text="Cancel", command=self.cancel_job, style='TButton', state='disabled')
+        self.cancel_btn.pack(pady=10, fill='x')
+
+        if Instrumentation.isEnabled():
+            timing_btn = ttk.Button(frame, text="Show Timing", command=show_last_trace, style='TButton')
+            timing_btn.pack(pady=10, fill='x')
+
+    def cancel_job(self):
+        if self.job:
+            self.job.cancel()
+            self.progress_label.config(text="Cancelling...")
+
+    def job_finished(self):
+        self.job = None
+        self.save_image_btn.config(state='normal')
+        self.cancel_btn.config(state='disabled')
 
     def select_site_file(self):
         self.siteFilePath = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
@@ -87,10 +110,11 @@ class MapGeneratorApp:
         if not self.siteFilePath or not self.pathFilePath:
             messagebox.showwarning("Warning", "Please select both site info and path info files")
             return
+        from MapGenerator import readSiteColumns, readPathColumns, createMap, addSiteMarkers, addPathMarkers, fitMapBounds, openMap
 
         try:
-            geoSiteList, geoSiteDF = readSiteInfo(self.siteFilePath)
-            geoPathList, geoPathDF = readPathInfo(self.pathFilePath)
+            geoSiteList, geoSiteDF = readSiteColumns(self.siteFilePath)
+            geoPathList, geoPathDF = readPathColumns(self.pathFilePath)
 
             map = createMap(geoSiteList)
             addSiteMarkers(geoSiteList, geoSiteDF, map, site_color=self.site_color)
@@ -104,19 +128,56 @@ class MapGeneratorApp:
         if not self.siteFilePath or not self.pathFilePath:
             messagebox.showwarning("Warning", "Please select both site info and path info files")
             return
+        if self.job:
+            return
 
-        try:
-            geoSiteList, geoSiteDF = readSiteInfo(self.siteFilePath)
-            geoPathList, geoPathDF = readPathInfo(self.pathFilePath)
+        outputs = {"map.html": "map.html", "map.png": "map.png", "map_presentation.pptx": "map_presentation.pptx"}
+        cacheKey = resultCache.key([self.siteFilePath, self.pathFilePath], kind="map-image",
+                                   site_color=self.site_color, path_color=self.path_color)
+        if resultCache.get(cacheKey, outputs):
+            messagebox.showinfo("Save Complete", "Map has been saved as map.png (from cache)")
+            return
 
-            map = createMap(geoSiteList)
-            addSiteMarkers(geoSiteList, geoSiteDF, map, site_color=self.site_color)
-            addPathMarkers(geoPathList, map, path_color=self.path_color)
-            fitMapBounds(map, geoSiteList, geoPathList)
-            saveMapAsImage(map)
+        siteFilePath, pathFilePath = self.siteFilePath, self.pathFilePath
+        site_color, path_color = self.site_color, self.path_color
+
+        # Runs on the job's worker thread; no Tk calls in here
+        def work(job):
+            from MapGenerator import readSiteColumns, readPathColumns, createMap, addSiteMarkers, addPathMarkers, fitMapBounds, saveMapAsImage
+            with Instrumentation.run("save-map-image", tracePath="map_trace.json"):
+                job.report(0, 5, "Reading files")
+                geoSiteList, geoSiteDF = readSiteColumns(siteFilePath)
+                geoPathList, geoPathDF = readPathColumns(pathFilePath)
+                job.report(1, 5, "Adding site markers")
+                map = createMap(geoSiteList)
+                addSiteMarkers(geoSiteList, geoSiteDF, map, site_color=site_color)
+                job.report(2, 5, "Adding path")
+                addPathMarkers(geoPathList, map, path_color=path_color)
+                fitMapBounds(map, geoSiteList, geoPathList)
+                job.report(3, 5, "Rendering image")
+                saveMapAsImage(map)
+            job.report(4, 5, "Caching result")
+            resultCache.put(cacheKey, outputs)
+            job.report(5, 5)
+
+        def done(result):
+            self.job_finished()
+            self.progress_label.config(text="")
             messagebox.showinfo("Save Complete", "Map has been saved as map.png")
-        except ValueError as e:
-            messagebox.showerror("Error", str(e))
+
+        def failed(error):
+            self.job_finished()
+            self.progress_label.config(text="")
+            messagebox.showerror("Error", str(error))
+
+        def cancelled():
+            self.job_finished()
+            self.progress_label.config(text="Cancelled")
+
+        self.save_image_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.job = Job(self.root, work, onProgress=lambda job: self.progress_label.config(text=formatProgress(job, "steps")),
+                       onDone=done, onError=failed, onCancelled=cancelled).start()
 
 
 # Application 2: CSV Processing
@@ -125,6 +186,11 @@ class CSVProcessingApp:
         self.root = root
         self.root.title("CSV Processing GUI")
         self.root.configure(bg='#5083a0')
+        # Per-window survey data and the running calculation, if any
+        self.filePath = ""
+        self.cacheKey = None
+        self.lat = self.lon = self.wifiChannel = None
+        self.job = None
         self.create_widgets()
 
     def create_widgets(self):
@@ -142,31 +208,96 @@ class CSVProcessingApp:
         self.file_label = ttk.Label(frame, text="No file selected", style='TLabel')
         self.file_label.pack(padx=50, pady=10, fill='x')
 
-        calc_btn = ttk.Button(frame, text="Calculate Closest Points", command=self.runCalculation, style='TButton')
-        calc_btn.pack(pady=10, fill='x')
+        self.calc_btn = ttk.Button(frame, text="Calculate Closest Points", command=self.runCalculation, style='TButton')
+        self.calc_btn.pack(pady=10, fill='x')
+
+        self.progress_bar = ttk.Progressbar(frame, mode='determinate', maximum=1.0)
+        self.progress_bar.pack(pady=5, fill='x')
+
+        self.progress_label = ttk.Label(frame, text="", style='TLabel')
+        self.progress_label.pack(pady=5, fill='x')
+
+        self.cancel_btn = ttk.Button(frame, text="Cancel", command=self.cancelCalculation, style='TButton', state='disabled')
+        self.cancel_btn.pack(pady=10, fill='x')
+
+        if Instrumentation.isEnabled():
+            timing_btn = ttk.Button(frame, text="Show Timing", command=show_last_trace, style='TButton')
+            timing_btn.pack(pady=10, fill='x')
 
     def importCSV(self):
         file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if file_path:
             try:
-                global lat, lon, wifiChannel, topThree
                 lat, lon, wifiChannel, topThree = readCSV(file_path)
                 if lat and lon and wifiChannel:
+                    self.lat, self.lon, self.wifiChannel = lat, lon, wifiChannel
+                    self.filePath = file_path
+                    self.cacheKey = resultCache.key([file_path], kind="closest", k=3)
                     self.file_label.config(text=f"File: {file_path}")
                     messagebox.showinfo("Import Successful", "CSV file imported successfully!")
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
 
     def runCalculation(self):
-        global lat, lon, wifiChannel, topThree
-        try:
-            calculateClosestPoints(lat, lon, wifiChannel, topThree)
-            writeCSV(topThree)
-        except:
+        if self.job:
+            return
+        if self.lat is None:
             messagebox.showerror("Calculation Error", "Please input valid data")
-        else:
+            return
+        outputs = {"ClosestPoints.csv": "ClosestPoints.csv"}
+        if self.cacheKey and resultCache.get(self.cacheKey, outputs):
+            messagebox.showinfo("Calculation Complete", "Closest points loaded from cache and saved to ClosestPoints.csv!")
+            return
+
+        lat, lon, wifiChannel = self.lat, self.lon, self.wifiChannel
+        statePath = statePathFor(self.filePath, os.path.join(resultCache.directory, "state"))
+        cacheKey = self.cacheKey
+
+        # Runs on the job's worker thread; no Tk calls in here
+        def work(job):
+            topThree = {}
+            with Instrumentation.run("closest-points", tracePath="closest_points_trace.json"):
+                # Previous results are kept in the cache directory so re-runs only redo changed rows
+                calculateClosestPointsIncremental(lat, lon, wifiChannel, topThree, statePath=statePath,
+                                                  progress=job.report)
+                job.checkCancelled()
+                writeCSV(topThree)
+            resultCache.put(cacheKey, outputs)
+
+        def done(result):
+            self.calculationFinished()
             messagebox.showinfo("Calculation Complete", "Closest points calculated and saved to ClosestPoints.csv!")
 
+        def failed(error):
+            self.calculationFinished()
+            messagebox.showerror("Calculation Error", "Please input valid data")
+
+        def cancelled():
+            self.calculationFinished()
+            self.progress_label.config(text="Cancelled")
+
+        self.calc_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.job = Job(self.root, work, onProgress=self.showProgress, onDone=done, onError=failed,
+                       onCancelled=cancelled).start()
+
+    def showProgress(self, job):
+        done, total, rate, eta = job.progress()
+        self.progress_bar['value'] = done / total if total else 0
+        self.progress_label.config(text=formatProgress(job))
+
+    def cancelCalculation(self):
+        if self.job:
+            self.job.cancel()
+            self.progress_label.config(text="Cancelling...")
+
+    def calculationFinished(self):
+        self.job = None
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text="")
+        self.calc_btn.config(state='normal')
+        self.cancel_btn.config(state='disabled')
+
 
 # Main Application to switch between Map Generator and CSV Processing
 class MainApp:
@@ -202,6 +333,7 @@ class MainApp:
 
 
 if __name__ == "__main__":
+    Instrumentation.enableFromEnvironment()
     root = tk.Tk()
     app = MainApp(root)
     root.mainloop()
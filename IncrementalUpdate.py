@@ -0,0 +1,151 @@
+import hashlib
+import os
+import struct
+from collections import defaultdict, deque
+import numpy as np
+from SpatialIndex import KDTree
+from ResultCache import DEFAULT_CACHE_DIR
+
+# Bump when the layout of the saved state changes
+STATE_VERSION = 3
+
+# Where the GUI keeps state between runs, so nothing is written next to the input
+DEFAULT_STATE_DIR = os.path.join(DEFAULT_CACHE_DIR, "state")
+
+# State file for an input file, named by a hash of its absolute path
+def statePathFor(inputPath, directory=DEFAULT_STATE_DIR):
+    name = hashlib.sha256(os.path.abspath(inputPath).encode()).hexdigest()[:32]
+    return os.path.join(directory, name + ".state")
+
+# Stable hash of each row's coordinates and channel, used to match rows between runs
+def rowHashes(lat, lon, wifiChannel):
+    return [hashlib.blake2b(struct.pack('<ddq', float(la), float(lo), int(ch)), digest_size=16).digest()
+            for la, lo, ch in zip(lat, lon, wifiChannel)]
+
+# The state is plain arrays in an .npz archive (loaded without pickle): row
+# hashes, each point's neighbour indices and distances padded with -1/inf, and
+# whether another point lies at exactly its k-th neighbour distance. Anything unreadable, from another version or inconsistent is ignored, so the
+# caller recomputes everything.
+def loadState(statePath):
+    try:
+        with np.load(statePath, allow_pickle=False) as archive:
+            version, k = (int(value) for value in archive['header'])
+            hashes = archive['hashes']
+            indices = archive['indices']
+            distances = archive['distances']
+            ties = archive['ties']
+        if version != STATE_VERSION or hashes.ndim != 2 or hashes.shape[1] != 16 or \
+                indices.shape != (len(hashes), k) or distances.shape != indices.shape or ties.shape != (len(hashes),):
+            return None
+        neighbors = [[(j, dist) for j, dist in zip(row, dist) if j >= 0]
+                     for row, dist in zip(indices.tolist(), distances.tolist())]
+        return {'version': version, 'k': k, 'hashes': [row.tobytes() for row in hashes], 'neighbors': neighbors,
+                'ties': ties.astype(bool).tolist()}
+    except Exception:
+        return None
+
+# Saves the state for the next run. Failing to save (e.g. a read-only
+# directory) is not an error: the next run just starts from scratch.
+def saveState(statePath, hashes, neighbors, ties, k):
+    indices = np.full((len(neighbors), k), -1, dtype=np.int64)
+    distances = np.full((len(neighbors), k), np.inf)
+    for i, row in enumerate(neighbors):
+        for n, (j, dist) in enumerate(row):
+            indices[i, n] = j
+            distances[i, n] = dist
+    temporaryPath = statePath + '.tmp'
+    try:
+        directory = os.path.dirname(statePath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(temporaryPath, 'wb') as file:
+            np.savez(file, header=np.array([STATE_VERSION, k], dtype=np.int64),
+                     hashes=np.frombuffer(b''.join(hashes), dtype=np.uint8).reshape(-1, 16),
+                     indices=indices, distances=distances, ties=np.array(ties, dtype=np.uint8))
+        os.replace(temporaryPath, statePath)
+        return True
+    except OSError:
+        return False
+
+# Queries each listed point into neighbors, reporting progress every 1000 points.
+# One extra neighbour is looked up to record in ties whether the k-th distance
+# is shared with a point outside the list, where row order picks the winner.
+def _queryAll(tree, points, k, neighbors, ties, progress):
+    total = len(points)
+    for done, i in enumerate(points, 1):
+        found = tree.query(i, k + 1)
+        neighbors[i] = found[:k]
+        ties[i] = 0 < k < len(found) and found[k][1] == found[k - 1][1]
+        if progress and (done % 1000 == 0 or done == total):
+            progress(done, total)
+    return neighbors
+
+# Computes the k nearest neighbours of every point, reusing the results saved in
+# statePath by the previous run. Rows are matched by hash; only these points are
+# queried again:
+#   - rows that are new (added, or edited so their hash changed)
+#   - points that had a removed or edited row among their neighbours
+#   - points with an added row within their own current k-th neighbour distance
+#   - points whose k-th distance was tied with a point outside their list,
+#     if rows were reordered (ties go to the lower row index)
+# Kept lists are re-sorted by (distance, current index) for the same reason.
+# Returns the neighbour lists as [(index, distance), ...] per point and a dict
+# of counts (added, removed, recomputed). The state file is rewritten afterwards.
+# progress, if given, is called as progress(done, total) over the recomputed points.
+def updateNeighbors(lat, lon, wifiChannel, k, statePath, progress=None):
+    count = len(lat)
+    hashes = rowHashes(lat, lon, wifiChannel)
+    tree = KDTree(lat, lon)
+    state = loadState(statePath)
+
+    if state is None or state['k'] != k:
+        ties = [False] * count
+        neighbors = _queryAll(tree, range(count), k, [None] * count, ties, progress)
+        saveState(statePath, hashes, neighbors, ties, k)
+        return neighbors, {'added': count, 'removed': 0, 'recomputed': count}
+
+    # Match new rows to old rows with the same hash, in file order
+    unmatched = defaultdict(deque)
+    for old, rowHash in enumerate(state['hashes']):
+        unmatched[rowHash].append(old)
+    oldToNew = {}
+    added = []
+    for i, rowHash in enumerate(hashes):
+        if unmatched[rowHash]:
+            oldToNew[unmatched[rowHash].popleft()] = i
+        else:
+            added.append(i)
+    removedCount = len(state['hashes']) - len(oldToNew)
+    # Kept rows are in the same relative order unless the file was reordered
+    kept = [oldToNew[old] for old in sorted(oldToNew)]
+    reordered = any(a > b for a, b in zip(kept, kept[1:]))
+
+    neighbors = [None] * count
+    ties = [False] * count
+    dirty = set(added)
+    # Each kept point's k-th neighbour distance; -1 for points recomputed anyway
+    reach = [-1.0] * count
+    for old, i in oldToNew.items():
+        previous = state['neighbors'][old]
+        if any(j not in oldToNew for j, dist in previous) or (reordered and state['ties'][old]):
+            dirty.add(i)
+            continue
+        neighbors[i] = sorted(((oldToNew[j], dist) for j, dist in previous), key=lambda item: (item[1], item[0]))
+        ties[i] = state['ties'][old]
+        # Fewer than k neighbours means any new point can join the list
+        if len(previous) < k:
+            reach[i] = float('inf')
+        elif previous:
+            reach[i] = previous[-1][1]
+
+    # A kept point needs recomputing if an added point is within its own
+    # k-th neighbour distance, found by a reverse search from each added point
+    if added and oldToNew:
+        nodeMax = tree.nodeReach(reach)
+        for p in added:
+            dirty.update(tree.queryReach(lat[p], lon[p], reach, nodeMax))
+
+    _queryAll(tree, sorted(dirty), k, neighbors, ties, progress)
+
+    saveState(statePath, hashes, neighbors, ties, k)
+    return neighbors, {'added': len(added), 'removed': removedCount, 'recomputed': len(dirty)}
@@ -0,0 +1,122 @@
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Stage timers and counters for the closest-point and map pipelines. Everything
+# is off by default: a decorated stage then costs one extra call and a flag
+# check. Once enabled, each run (see run()) records the time and call count of
+# every stage, any counters, and optionally a cProfile dump, and is written out
+# as a JSON trace.
+#
+#   Instrumentation.enable(profile=True)
+#   with Instrumentation.run("closest-points", tracePath="trace.json"):
+#       ...
+
+_enabled = False
+_profile = False
+_lock = threading.Lock()
+# The trace of the run active in this context. Threads start with no run, so
+# runs on different threads (two GUI jobs, the server and a job) never see
+# each other's trace; hand work to a pool with contextvars.copy_context().run
+# to record it in the submitting run.
+_current = contextvars.ContextVar("trace", default=None)
+lastTrace = None
+
+def enable(profile=False):
+    global _enabled, _profile
+    _enabled = True
+    _profile = profile
+
+def disable():
+    global _enabled, _profile
+    _enabled = False
+    _profile = False
+
+def isEnabled():
+    return _enabled
+
+# Turns instrumentation on when TWS_TRACE (and TWS_PROFILE for cProfile) is set
+def enableFromEnvironment():
+    if os.environ.get("TWS_TRACE"):
+        enable(profile=bool(os.environ.get("TWS_PROFILE")))
+
+def _newTrace(name):
+    return {"run": name, "started": time.time(), "seconds": None, "stages": {}, "events": [],
+            "counters": {}, "profile": None, "_start": time.perf_counter()}
+
+def _record(trace, name, seconds, startOffset):
+    with _lock:
+        entry = trace["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        trace["events"].append({"stage": name, "start": startOffset, "seconds": seconds})
+
+# Decorator that times every call of a pipeline stage while a run is active
+def stage(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if not _enabled or trace is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(trace, name, time.perf_counter() - start, start - trace["_start"])
+        return wrapper
+    return decorate
+
+# Adds value to a named counter of the active run
+def count(name, value=1):
+    trace = _current.get()
+    if not _enabled or trace is None:
+        return
+    with _lock:
+        trace["counters"][name] = trace["counters"].get(name, 0) + value
+
+# Collects one run's trace. The trace is stored in lastTrace and, if tracePath is
+# given, written there as JSON (with the cProfile output next to it as .prof).
+@contextmanager
+def run(name, tracePath=None):
+    global lastTrace
+    if not _enabled:
+        yield None
+        return
+    trace = _newTrace(name)
+    profiler = cProfile.Profile() if _profile else None
+    token = _current.set(trace)
+    if profiler:
+        profiler.enable()
+    try:
+        yield trace
+    finally:
+        if profiler:
+            profiler.disable()
+        _current.reset(token)
+        trace["seconds"] = time.perf_counter() - trace["_start"]
+        if profiler and tracePath:
+            trace["profile"] = os.path.splitext(tracePath)[0] + ".prof"
+            profiler.dump_stats(trace["profile"])
+        if tracePath:
+            with open(tracePath, 'w') as file:
+                json.dump({key: value for key, value in trace.items() if not key.startswith("_")}, file, indent=2)
+        lastTrace = trace
+
+# Short text summary of a trace, slowest stage first
+def formatTrace(trace):
+    if not trace:
+        return "No trace recorded. Set TWS_TRACE=1 before starting to enable timing."
+    lines = [f"{trace['run']}: {trace['seconds']:.3f} s"]
+    for name, entry in sorted(trace["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        lines.append(f"  {name}: {entry['seconds']:.3f} s ({entry['calls']} calls)")
+    for name, value in sorted(trace["counters"].items()):
+        lines.append(f"  {name}: {value:,}")
+    if trace["profile"]:
+        lines.append(f"  profile: {trace['profile']}")
+    return "\n".join(lines)
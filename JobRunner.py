@@ -0,0 +1,100 @@
+import threading
+import time
+
+# Raised inside a job's work function once the job has been cancelled
+class Cancelled(Exception):
+    pass
+
+# Runs work(job) on a background thread and reports back on the Tk thread.
+# The work function calls job.report(done, total, message) as it goes; each
+# call also raises Cancelled if cancel() has been requested. Every pollMs the
+# Tk thread passes the latest progress to onProgress(job), and once the work
+# ends it calls exactly one of onDone(result), onError(exception) or
+# onCancelled(). Callbacks always run on the Tk thread, so they can touch widgets.
+class Job:
+    def __init__(self, root, work, onProgress=None, onDone=None, onError=None, onCancelled=None, pollMs=100):
+        self.root = root
+        self.work = work
+        self.onProgress = onProgress
+        self.onDone = onDone
+        self.onError = onError
+        self.onCancelled = onCancelled
+        self.pollMs = pollMs
+        self.lock = threading.Lock()
+        self.cancelRequested = threading.Event()
+        self.done = 0
+        self.total = 0
+        self.message = ""
+        self.startTime = None
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        self.startTime = time.monotonic()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.root.after(self.pollMs, self._poll)
+        return self
+
+    def cancel(self):
+        self.cancelRequested.set()
+
+    @property
+    def cancelled(self):
+        return self.cancelRequested.is_set()
+
+    # Called from the work function
+    def report(self, done, total=None, message=None):
+        with self.lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            if message is not None:
+                self.message = message
+        self.checkCancelled()
+
+    def checkCancelled(self):
+        if self.cancelRequested.is_set():
+            raise Cancelled()
+
+    # (done, total, items per second, seconds remaining or None)
+    def progress(self):
+        with self.lock:
+            done, total = self.done, self.total
+        elapsed = time.monotonic() - self.startTime if self.startTime else 0.0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 and total >= done else None
+        return done, total, rate, eta
+
+    def _run(self):
+        try:
+            self.result = self.work(self)
+        except Exception as e:
+            self.error = e
+        self.finished = True
+
+    def _poll(self):
+        if self.onProgress:
+            self.onProgress(self)
+        if not self.finished:
+            self.root.after(self.pollMs, self._poll)
+        elif isinstance(self.error, Cancelled) or (self.error is None and self.cancelled):
+            if self.onCancelled:
+                self.onCancelled()
+        elif self.error is not None:
+            if self.onError:
+                self.onError(self.error)
+        elif self.onDone:
+            self.onDone(self.result)
+
+# One-line progress text: "1,200/5,000 points  800 points/s  ETA 5 s"
+def formatProgress(job, unit="points"):
+    done, total, rate, eta = job.progress()
+    text = f"{done:,}/{total:,} {unit}  {rate:,.0f} {unit}/s"
+    if eta is not None:
+        text += f"  ETA {eta:.0f} s"
+    if job.message:
+        text = f"{job.message}  {text}"
+    return text
@@ -1,17 +1,14 @@
 import folium
 import pandas as pd
 import geopandas
+import numpy as np
 import webbrowser
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from selenium import webdriver
-from PIL import Image
 import time
-import os
-from pptx import Presentation
-from pptx.util import Inches
+from MapRenderer import sharedRenderPool
+from Instrumentation import stage, count
 
 # Function to read site info from a file
+@stage("readSiteInfo")
 def readSiteInfo(filePath):
     df = pd.read_csv(filePath)
     required_columns = ["SiteName", "Lat", "Long"]
@@ -27,6 +24,7 @@ def readSiteInfo(filePath):
     return geoSiteList, geoSiteDF
 
 # Function to read path info from a file
+@stage("readPathInfo")
 def readPathInfo(filePath):
     df = pd.read_csv(filePath)
     required_columns = ["Latitude", "Longitude"]
@@ -41,13 +39,62 @@ def readPathInfo(filePath):
     geoPathList = [[point.xy[1][0], point.xy[0][0]] for point in geoPathDF.geometry]
     return geoPathList, geoPathDF
 
+# Checks a CSV header for the required columns without reading the rows
+def checkColumns(filePath, required_columns, kind):
+    columns = pd.read_csv(filePath, nrows=0).columns
+    missing_columns = [column for column in required_columns if column not in columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns in {kind} file: {', '.join(missing_columns)}")
+
+# Reads only the given columns with fixed dtypes, chunkSize rows at a time if given
+def readColumns(filePath, dtypes, chunkSize=None):
+    if chunkSize is None:
+        return pd.read_csv(filePath, usecols=list(dtypes), dtype=dtypes)
+    chunks = pd.read_csv(filePath, usecols=list(dtypes), dtype=dtypes, chunksize=chunkSize)
+    return pd.concat(chunks, ignore_index=True)
+
+# Rejects rows whose coordinates are blank (NaN) or outside the valid range
+def checkCoordinates(lat, lon, kind):
+    valid = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    if not valid.all():
+        i = int(np.argmin(valid))
+        raise ValueError(f"Invalid latitude or longitude value in {kind} file: {lat[i]}, {lon[i]}")
+
+# Fast site reader: returns an (n, 2) float64 array of [lat, lon] and a plain
+# DataFrame of SiteName/Lat/Long. No geometry is built; use toGeoDataFrame when needed.
+@stage("readSiteColumns")
+def readSiteColumns(filePath, chunkSize=None):
+    checkColumns(filePath, ["SiteName", "Lat", "Long"], "site info")
+    df = readColumns(filePath, {"SiteName": str, "Lat": np.float64, "Long": np.float64}, chunkSize)
+    df = df[["SiteName", "Lat", "Long"]]
+    checkCoordinates(df.Lat.to_numpy(), df.Long.to_numpy(), "site info")
+    return np.column_stack((df.Lat.to_numpy(), df.Long.to_numpy())), df
+
+# Fast path reader: returns an (n, 2) float64 array of [lat, lon] and a plain
+# DataFrame of Latitude/Longitude
+@stage("readPathColumns")
+def readPathColumns(filePath, chunkSize=None):
+    checkColumns(filePath, ["Latitude", "Longitude"], "path info")
+    df = readColumns(filePath, {"Latitude": np.float64, "Longitude": np.float64}, chunkSize)
+    df = df[["Latitude", "Longitude"]]
+    checkCoordinates(df.Latitude.to_numpy(), df.Longitude.to_numpy(), "path info")
+    return np.column_stack((df.Latitude.to_numpy(), df.Longitude.to_numpy())), df
+
+# Builds the GeoDataFrame for a DataFrame from readSiteColumns/readPathColumns
+def toGeoDataFrame(df, latColumn, lonColumn):
+    return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df[lonColumn], df[latColumn]))
+
 # Function to create a folium map
 def createMap(geoSiteList):
-    map_center = geoSiteList[0] if geoSiteList else [0, 0]
+    map_center = list(geoSiteList[0]) if len(geoSiteList) else [0, 0]
     return folium.Map(location=map_center, zoom_start=12)
 
 # Function to add site markers to the map
+@stage("addSiteMarkers")
 def addSiteMarkers(geoSiteList, geoSiteDF, map, site_color='red'):
+    if isinstance(geoSiteList, np.ndarray):
+        geoSiteList = geoSiteList.tolist()
+    count("site markers", len(geoSiteList))
     for i, location in enumerate(geoSiteList):
         if site_color in folium.Icon.color_options:
             folium.Marker(location=location, popup="SiteName: " + str(geoSiteDF.SiteName[i]),
@@ -58,44 +105,147 @@ def addSiteMarkers(geoSiteList, geoSiteDF, map, site_color='red'):
                               <div style="background-color:{site_color}; width:12px; height:12px;
                               border-radius:50%; border:1px solid black;"></div>""")).add_to(map)
 
-def addPathMarkers(geoPathList, map, path_color='black'):
-    for location in geoPathList:
-        folium.CircleMarker(location=location, radius=1, color=path_color, fill=True, fill_color=path_color).add_to(map)
+# Path sizes used by addPathMarkers in mode='auto'
+PATH_MARKER_LIMIT = 5000
+PATH_POINT_LIMIT = 100000
+
+# Keeps the first point in each cell of a grid x grid lattice over the path's bounding box,
+# in track order
+def gridDownsample(geoPathList, grid=300):
+    points = np.asarray(geoPathList, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return []
+    low = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - low, 1e-12)
+    cells = np.minimum(((points - low) / span * grid).astype(np.int64), grid - 1)
+    keys = cells[:, 0] * grid + cells[:, 1]
+    _, first = np.unique(keys, return_index=True)
+    return points[np.sort(first)].tolist()
+
+# Simplifies a track with the Douglas-Peucker algorithm; tolerance is in degrees
+# and defaults to 1/2000th of the track's extent
+def douglasPeucker(geoPathList, tolerance=None):
+    points = np.asarray(geoPathList, dtype=np.float64).reshape(-1, 2)
+    if len(points) <= 2:
+        return points.tolist()
+    if tolerance is None:
+        tolerance = float((points.max(axis=0) - points.min(axis=0)).max()) / 2000
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return points[keep].tolist()
+
+# Adds the path to the map. mode picks how:
+#   'markers'  one CircleMarker per point (the original output)
+#   'geojson'  every point in a single GeoJSON MultiPoint layer drawn as circle markers
+#   'polyline' the track as one line
+#   'cluster'  client-side clustering with FastMarkerCluster
+#   'auto'     markers up to PATH_MARKER_LIMIT points, geojson above that,
+#              grid-downsampled to about PATH_POINT_LIMIT points when larger still
+# downsample ('grid' or 'douglas-peucker') thins the path first.
+# Returns the mode used, point counts and build time.
+@stage("addPathMarkers")
+def addPathMarkers(geoPathList, map, path_color='black', mode='auto', downsample=None):
+    start = time.perf_counter()
+    if isinstance(geoPathList, np.ndarray):
+        geoPathList = geoPathList.tolist()
+    points = len(geoPathList)
+    count("path points", points)
+    if mode == 'auto':
+        mode = 'markers' if points <= PATH_MARKER_LIMIT else 'geojson'
+        if downsample is None and points > PATH_POINT_LIMIT:
+            downsample = 'grid'
+    if downsample == 'grid':
+        geoPathList = gridDownsample(geoPathList, grid=int(PATH_POINT_LIMIT ** 0.5))
+    elif downsample == 'douglas-peucker':
+        geoPathList = douglasPeucker(geoPathList)
+    elif downsample is not None:
+        raise ValueError(f"Unknown path downsampling: {downsample}")
+
+    if mode == 'markers':
+        for location in geoPathList:
+            folium.CircleMarker(location=location, radius=1, color=path_color, fill=True, fill_color=path_color).add_to(map)
+    elif mode == 'geojson':
+        coordinates = [[round(lon, 6), round(lat, 6)] for lat, lon in geoPathList]
+        folium.GeoJson({"type": "Feature", "properties": {}, "geometry": {"type": "MultiPoint", "coordinates": coordinates}},
+                       marker=folium.CircleMarker(radius=1, color=path_color, fill=True, fill_color=path_color)).add_to(map)
+    elif mode == 'polyline':
+        if geoPathList:
+            folium.PolyLine(locations=geoPathList, color=path_color, weight=2).add_to(map)
+    elif mode == 'cluster':
+        from folium.plugins import FastMarkerCluster
+        callback = ("function (row) { return L.circleMarker(new L.LatLng(row[0], row[1]), "
+                    f"{{radius: 1, color: '{path_color}', fill: true, fillColor: '{path_color}'}}); }}")
+        FastMarkerCluster(geoPathList, callback=callback).add_to(map)
+    else:
+        raise ValueError(f"Unknown path rendering mode: {mode}")
+    return {"mode": mode, "points": points, "rendered": len(geoPathList), "seconds": time.perf_counter() - start}
 
 
 # Function to fit map bounds
+# (only the south-west and north-east corners go into the HTML, not every point)
 def fitMapBounds(map, geoSiteList, geoPathList):
-    all_locations = geoSiteList + geoPathList
-    map.fit_bounds(all_locations)
+    all_locations = np.concatenate((np.asarray(geoSiteList, dtype=np.float64).reshape(-1, 2),
+                                    np.asarray(geoPathList, dtype=np.float64).reshape(-1, 2)))
+    if len(all_locations):
+        map.fit_bounds([all_locations.min(axis=0).tolist(), all_locations.max(axis=0).tolist()])
+
+# Reads a site/path file pair and builds the complete map; returns the map and
+# the addPathMarkers stats
+def buildMap(siteFile, pathFile, site_color='red', path_color='black', mode='auto', downsample=None):
+    geoSiteList, geoSiteDF = readSiteColumns(siteFile)
+    geoPathList, geoPathDF = readPathColumns(pathFile)
+    map = createMap(geoSiteList)
+    addSiteMarkers(geoSiteList, geoSiteDF, map, site_color=site_color)
+    pathStats = addPathMarkers(geoPathList, map, path_color=path_color, mode=mode, downsample=downsample)
+    fitMapBounds(map, geoSiteList, geoPathList)
+    return map, pathStats
 
 # Function to save and open the map in a web browser
-def openMap(map):
-    map.save("map.html")
-    webbrowser.open("map.html")
-
-# Function to save the map as a PNG
-def saveMapAsImage(map):
-    map.save("map.html")
-
-    # Set up selenium WebDriver (you may need to adjust the path to your chromedriver)
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    driver = webdriver.Chrome(options=options)
-
-    # Open the HTML file in the headless browser
-    driver.get("file://" + os.path.abspath("map.html"))
-    time.sleep(5)  
-
-    # Save the screenshot
-    driver.save_screenshot("map.png")
-    driver.quit()
-    saveImageToPowerPoint("map.png", "map_presentation.pptx")
-
-def saveImageToPowerPoint(image_path, pptx_path):
-    # Create a presentation object
-    prs = Presentation()
+def openMap(map, htmlPath="map.html"):
+    map.save(htmlPath)
+    webbrowser.open(htmlPath)
+
+# Writes the folium map's HTML
+@stage("saveMapHtml")
+def saveMapHtml(map, htmlPath="map.html"):
+    map.save(htmlPath)
+
+# Function to save the map as a PNG (and a one-slide PowerPoint)
+# Rendering goes through a pool of warm headless browsers that waits for the
+# map tiles to finish loading instead of sleeping for a fixed time
+@stage("saveMapAsImage")
+def saveMapAsImage(map, htmlPath="map.html", imagePath="map.png", pptxPath="map_presentation.pptx", renderPool=None):
+    saveMapHtml(map, htmlPath)
+    saveHtmlAsImage(htmlPath, imagePath, pptxPath, renderPool)
+
+# Renders an already saved map page to a PNG and a one-slide PowerPoint
+def saveHtmlAsImage(htmlPath, imagePath="map.png", pptxPath="map_presentation.pptx", renderPool=None):
+    if renderPool is None:
+        renderPool = sharedRenderPool()
+    renderPool.render(htmlPath, imagePath)
+    saveImageToPowerPoint(imagePath, pptxPath)
+
+# Adds a slide showing one image to a presentation
+def addImageSlide(prs, image_path):
+    from pptx.util import Inches
 
     # Add a slide
     slide_layout = prs.slide_layouts[5]  # Use a blank slide layout
@@ -104,12 +254,20 @@ def saveImageToPowerPoint(image_path, pptx_path):
     # Add image to the slide
     left = Inches(0)
     top = Inches(0)
-    pic = slide.shapes.add_picture(image_path, left, top, width=Inches(10), height=Inches(7.5))
+    return slide.shapes.add_picture(image_path, left, top, width=Inches(10), height=Inches(7.5))
+
+@stage("saveImageToPowerPoint")
+def saveImageToPowerPoint(image_path, pptx_path):
+    from pptx import Presentation
+
+    # Create a presentation object
+    prs = Presentation()
+    addImageSlide(prs, image_path)
 
     # Save the presentation
     prs.save(pptx_path)
 
-# Tkinter GUI setup
+# Tkinter GUI setup (tkinter is imported on use so the map functions work headless)
 class App:
     def __init__(self, root):
         self.root = root
@@ -122,6 +280,9 @@ class App:
         self.create_widgets()
 
     def create_widgets(self):
+        import tkinter as tk
+        from tkinter import ttk
+
         # Load image
         img = tk.PhotoImage(file="logo.png")
         img_label = ttk.Label(self.root, image=img, background='#5083a0')
@@ -147,12 +308,14 @@ class App:
         save_image_btn.pack(pady=10, fill='x')
 
     def select_site_file(self):
+        from tkinter import filedialog, messagebox
         self.siteFilePath = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if self.siteFilePath:
             self.update_file_label()
             messagebox.showinfo("Selected File", f"Site info file selected: {self.siteFilePath}")
 
     def select_path_file(self):
+        from tkinter import filedialog, messagebox
         self.pathFilePath = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if self.pathFilePath:
             self.update_file_label()
@@ -164,6 +327,7 @@ class App:
         self.file_label.config(text=f"Site File: {site_file}\n Path File: {path_file}")
 
     def create_map(self):
+        from tkinter import messagebox
         if not self.siteFilePath or not self.pathFilePath:
             messagebox.showwarning("Warning", "Please select both site info and path info files")
             return
@@ -181,6 +345,7 @@ class App:
             messagebox.showerror("Error", str(e))
 
     def save_map_as_image(self):
+        from tkinter import messagebox
         if not self.siteFilePath or not self.pathFilePath:
             messagebox.showwarning("Warning", "Please select both site info and path info files")
             return
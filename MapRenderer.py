@@ -0,0 +1,171 @@
+import atexit
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from Instrumentation import stage
+
+# True once the page has loaded, no Leaflet tile (image, or canvas as drawn by
+# TileExport's point layers) is still pending and no image is still downloading.
+# Leaflet only marks tiles that loaded; a tile image that failed (offline or a
+# 404) is complete with no pixels and counts as settled, as does one with
+# leaflet-tile-error, so one missing base tile does not hold up the render.
+READY_SCRIPT = """
+if (document.readyState !== 'complete') { return false; }
+var tiles = document.querySelectorAll('.leaflet-tile:not(.leaflet-tile-loaded):not(.leaflet-tile-error)');
+var pending = Array.prototype.some.call(tiles, function (tile) {
+    return !(tile.tagName === 'IMG' && tile.complete && tile.naturalWidth === 0);
+});
+if (pending) { return false; }
+return Array.prototype.every.call(document.images, function (img) { return img.complete; });
+"""
+
+# Starts a headless Chrome session with the options saveMapAsImage has always used
+def chromeDriver():
+    from selenium import webdriver
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    return webdriver.Chrome(options=options)
+
+# Builds a blank RGB PNG for StubDriver screenshots
+def placeholderPng(width=1, height=1):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    pixels = zlib.compress(b''.join(b'\x00' + b'\xff' * (3 * width) for _ in range(height)))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', pixels) + chunk(b'IEND', b'')
+
+# Stands in for Chrome in tests and offline benchmarks: reports the page as
+# ready after readyAfter polls and writes a placeholder PNG
+class StubDriver:
+    def __init__(self, readyAfter=1):
+        self.readyAfter = readyAfter
+        self.polls = 0
+        self.pages = []
+
+    def get(self, url):
+        self.pages.append(url)
+        self.polls = 0
+
+    def execute_script(self, script):
+        self.polls += 1
+        return self.polls >= self.readyAfter
+
+    def save_screenshot(self, path):
+        with open(path, 'wb') as file:
+            file.write(placeholderPng())
+        return True
+
+    def quit(self):
+        pass
+
+# Keeps up to `size` browser sessions warm and renders map HTML files to PNG.
+# Instead of a fixed sleep, each render polls the page until READY_SCRIPT has
+# held for `idleTime` seconds, giving up (and screenshotting anyway) after
+# `timeout` seconds. driverFactory can return a StubDriver in tests.
+class RenderPool:
+    def __init__(self, size=1, driverFactory=chromeDriver, timeout=15.0, idleTime=0.3, pollInterval=0.1):
+        self.size = size
+        self.driverFactory = driverFactory
+        self.timeout = timeout
+        self.idleTime = idleTime
+        self.pollInterval = pollInterval
+        self.idle = queue.Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _acquire(self):
+        wait = 0
+        while True:
+            try:
+                return self.idle.get(timeout=wait)
+            except queue.Empty:
+                pass
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    try:
+                        return self.driverFactory()
+                    except Exception:
+                        self.created -= 1
+                        raise
+            # Every session is busy; wait for one to come back (or be discarded)
+            wait = 0.5
+
+    def _release(self, driver, broken=False):
+        if broken or self.closed:
+            with self.lock:
+                self.created -= 1
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        else:
+            self.idle.put(driver)
+
+    # Polls the page until it has been ready for idleTime seconds; returns False on timeout
+    def waitUntilReady(self, driver):
+        deadline = time.monotonic() + self.timeout
+        readySince = None
+        while time.monotonic() < deadline:
+            if driver.execute_script(READY_SCRIPT):
+                now = time.monotonic()
+                if readySince is None:
+                    readySince = now
+                if now - readySince >= self.idleTime:
+                    return True
+            else:
+                readySince = None
+            time.sleep(self.pollInterval)
+        return False
+
+    # Renders one HTML file to a PNG screenshot; returns whether the page reported ready
+    @stage("renderImage")
+    def render(self, htmlPath, imagePath):
+        driver = self._acquire()
+        try:
+            driver.get("file://" + os.path.abspath(htmlPath))
+            ready = self.waitUntilReady(driver)
+            driver.save_screenshot(imagePath)
+        except Exception:
+            self._release(driver, broken=True)
+            raise
+        self._release(driver)
+        return ready
+
+    # Renders (htmlPath, imagePath) pairs back-to-back across the pool's sessions
+    def renderMany(self, jobs):
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.size, len(jobs)))) as executor:
+            return list(executor.map(lambda job: self.render(*job), jobs))
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._release(driver, broken=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_sharedPool = None
+
+# Returns the process-wide pool used by saveMapAsImage, starting it on first use
+def sharedRenderPool():
+    global _sharedPool
+    if _sharedPool is None:
+        _sharedPool = RenderPool()
+        atexit.register(_sharedPool.close)
+    return _sharedPool
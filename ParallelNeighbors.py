@@ -0,0 +1,88 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.util import Finalize
+from SpatialIndex import KDTree
+
+# State attached once per worker process by _initWorker
+_worker = {}
+
+def _initWorker(sharedName, count, method, k, blockSize):
+    sharedBlock = shared_memory.SharedMemory(name=sharedName)
+    _worker['k'] = k
+    _worker['method'] = method
+    if method == 'kdtree':
+        values = sharedBlock.buf.cast('d')
+        lat = values[:count]
+        lon = values[count:2 * count]
+        _worker['tree'] = KDTree(lat, lon)
+        lat.release()
+        lon.release()
+        values.release()
+        # The tree holds its own copy of the coordinates
+        sharedBlock.close()
+    else:
+        import numpy as np
+        _worker['block'] = sharedBlock
+        _worker['lat'] = np.frombuffer(sharedBlock.buf, dtype=np.float64, count=count)
+        _worker['lon'] = np.frombuffer(sharedBlock.buf, dtype=np.float64, count=count, offset=8 * count)
+        _worker['blockSize'] = blockSize
+        Finalize(None, _releaseWorker, exitpriority=10)
+
+# Drops the worker's views into shared memory before detaching from it;
+# closing while a view is alive raises BufferError
+def _releaseWorker():
+    _worker.pop('lat', None)
+    _worker.pop('lon', None)
+    sharedBlock = _worker.pop('block', None)
+    if sharedBlock is not None:
+        sharedBlock.close()
+
+# Returns [(index, distance), ...] for every query point in [start, stop)
+def _queryShard(start, stop):
+    k = _worker['k']
+    if _worker['method'] == 'kdtree':
+        tree = _worker['tree']
+        return [tree.query(i, k) for i in range(start, stop)]
+    from DistanceKernel import blockedTopK
+    indices, distances = blockedTopK(_worker['lat'], _worker['lon'], k, _worker['blockSize'], start, stop)
+    return [list(zip(row, dist)) for row, dist in zip(indices.tolist(), distances.tolist())]
+
+# Computes the k nearest neighbours of every point on a process pool. The
+# coordinates are placed in shared memory once; each worker attaches to it,
+# builds its own index and answers contiguous shards of query points. Shards
+# are collected in order, so the result is identical to the serial path.
+# progress, if given, is called as progress(done, count) as shards come back.
+def parallelNeighbors(lat, lon, k=3, method='kdtree', blockSize=1024, workers=None, shardSize=None, progress=None):
+    count = len(lat)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shardSize is None:
+        shardSize = max(1, -(-count // (workers * 8)))
+    if method == 'blocked':
+        # Keep shard edges on tile edges so every tile matches the serial run
+        shardSize = -(-shardSize // blockSize) * blockSize
+    coordinates = array('d', lat)
+    coordinates.extend(lon)
+
+    sharedBlock = shared_memory.SharedMemory(create=True, size=max(1, coordinates.itemsize * len(coordinates)))
+    try:
+        sharedBlock.buf[:coordinates.itemsize * len(coordinates)] = coordinates.tobytes()
+        starts = list(range(0, count, shardSize))
+        stops = [min(start + shardSize, count) for start in starts]
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                                       initargs=(sharedBlock.name, count, method, k, blockSize))
+        try:
+            neighbors = []
+            for shard in executor.map(_queryShard, starts, stops):
+                neighbors.extend(shard)
+                if progress:
+                    progress(len(neighbors), count)
+        finally:
+            # Drop shards that have not started if progress raised (e.g. a cancelled job)
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        sharedBlock.close()
+        sharedBlock.unlink()
+    return neighbors
@@ -0,0 +1,330 @@
+import json
+import os
+import time
+from array import array
+from math import radians, degrees, sin, cos, asin, pi
+import numpy as np
+from SpatialIndex import KDTree, EARTH_RADIUS
+from Instrumentation import stage, count
+
+# Memory-mapped columnar store for survey files too large to load with readCSV,
+# and a tile-by-tile closest-point search over it whose memory use depends on
+# the tile size rather than the number of points.
+#
+#   store = convertCSV("country.csv", "country.store")
+#   with openResultWriter("country_ClosestPoints.npy", store.lat, store.lon, store.wifiChannel) as writer:
+#       tiledNeighbors(store, k=3, writer=writer)
+#
+# A store is a directory of raw little-endian columns plus meta.json:
+#   lat.f8, lon.f8, channel.i2       original CSV row order
+#   key.u8                           Z-order (Morton) keys, ascending
+#   sorted_lat.f8, sorted_lon.f8     coordinates in key order
+#   index.i8                         original row index in key order
+# meta.json is written last, so a directory without it is an unfinished conversion.
+
+STORE_VERSION = 1
+KEY_BITS = 31
+COLUMNS = {"lat": "<f8", "lon": "<f8", "channel": "<i2", "key": "<u8",
+           "sorted_lat": "<f8", "sorted_lon": "<f8", "index": "<i8"}
+
+def _columnPath(directory, name):
+    return os.path.join(directory, f"{name}.{COLUMNS[name][1:]}")
+
+# Spreads the low 32 bits of each value out to the even bit positions
+def _spreadBits(values):
+    x = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+# Latitude/longitude quantized to KEY_BITS bits each; monotonic, so a box in
+# degrees maps onto a box of quantized values
+def quantize(lat, lon):
+    scale = float(1 << KEY_BITS)
+    top = (1 << KEY_BITS) - 1
+    qLat = np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / 180.0 * scale), 0, top).astype(np.int64)
+    qLon = np.clip(np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * scale), 0, top).astype(np.int64)
+    return qLat, qLon
+
+# Z-order key interleaving quantized longitude (even bits) and latitude (odd bits)
+def zOrderKey(lat, lon):
+    qLat, qLon = quantize(lat, lon)
+    return _spreadBits(qLon) | (_spreadBits(qLat) << np.uint64(1))
+
+# Opens an existing store read-only; the columns are numpy memmaps
+class PointStore:
+    def __init__(self, directory):
+        metaPath = os.path.join(directory, "meta.json")
+        try:
+            with open(metaPath, 'r') as file:
+                self.meta = json.load(file)
+        except FileNotFoundError:
+            raise ValueError(f"{directory} is not a point store (no meta.json); convert the CSV first")
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"{directory} was written by an incompatible version; convert the CSV again")
+        self.directory = directory
+        self.size = self.meta["count"]
+        columns = {name: self._open(name) for name in COLUMNS}
+        self.lat = columns["lat"]
+        self.lon = columns["lon"]
+        self.wifiChannel = columns["channel"]
+        self.key = columns["key"]
+        self.sortedLat = columns["sorted_lat"]
+        self.sortedLon = columns["sorted_lon"]
+        self.index = columns["index"]
+
+    def _open(self, name):
+        # np.memmap refuses zero-length files
+        if self.size == 0:
+            return np.zeros(0, dtype=COLUMNS[name])
+        return np.memmap(_columnPath(self.directory, name), dtype=COLUMNS[name], mode='r', shape=(self.size,))
+
+    def __len__(self):
+        return self.size
+
+# Appends typed arrays to open column files
+def _appendColumns(columns, files):
+    for column, file in zip(columns, files):
+        np.frombuffer(column, dtype=column.typecode).astype({'d': "<f8", 'h': "<i2"}[column.typecode]).tofile(file)
+
+def _createColumn(directory, name, size):
+    path = _columnPath(directory, name)
+    if size == 0:
+        open(path, 'wb').close()
+        return np.zeros(0, dtype=COLUMNS[name])
+    return np.memmap(path, dtype=COLUMNS[name], mode='w+', shape=(size,))
+
+# Converts a survey CSV (validated like readCSV) into a store in directory,
+# chunkRows rows at a time: the rows are streamed to the original-order
+# columns, Z-order keys are computed, and the rows are bucket-sorted by key
+# into the sorted columns (bucket edges come from a sample of the keys, so
+# each bucket holds about chunkRows / 2 rows and is sorted in memory).
+@stage("convertCSV")
+def convertCSV(csvPath, directory, chunkRows=1000000, progress=None):
+    from Cleaner import readCSVRows
+    os.makedirs(directory, exist_ok=True)
+    metaPath = os.path.join(directory, "meta.json")
+    if os.path.exists(metaPath):
+        os.remove(metaPath)
+
+    # Pass 1: CSV -> original-order columns
+    size = 0
+    with open(_columnPath(directory, "lat"), 'wb') as latFile, \
+            open(_columnPath(directory, "lon"), 'wb') as lonFile, \
+            open(_columnPath(directory, "channel"), 'wb') as channelFile:
+        lat, lon, channel = array('d'), array('d'), array('h')
+        for latitude, longitude, wifi_channel in readCSVRows(csvPath):
+            lat.append(latitude)
+            lon.append(longitude)
+            channel.append(wifi_channel)
+            if len(lat) >= chunkRows:
+                _appendColumns((lat, lon, channel), (latFile, lonFile, channelFile))
+                size += len(lat)
+                lat, lon, channel = array('d'), array('d'), array('h')
+                if progress:
+                    progress(size, None, "Reading CSV")
+        _appendColumns((lat, lon, channel), (latFile, lonFile, channelFile))
+        size += len(lat)
+    count("rows read", size)
+
+    # Pass 2: keys in original order, then bucket edges from an evenly spaced sample
+    keyPath = _columnPath(directory, "key") + ".unsorted"
+    lat = np.memmap(_columnPath(directory, "lat"), dtype="<f8", mode='r', shape=(size,)) if size else np.zeros(0)
+    lon = np.memmap(_columnPath(directory, "lon"), dtype="<f8", mode='r', shape=(size,)) if size else np.zeros(0)
+    unsortedKey = np.memmap(keyPath, dtype="<u8", mode='w+', shape=(size,)) if size else np.zeros(0, dtype="<u8")
+    for start in range(0, size, chunkRows):
+        unsortedKey[start:start + chunkRows] = zOrderKey(lat[start:start + chunkRows], lon[start:start + chunkRows])
+    buckets = max(1, -(-size * 2 // chunkRows))
+    sample = np.sort(np.asarray(unsortedKey[::max(1, size // (buckets * 64))]))
+    edges = np.unique(sample[(np.arange(1, buckets) * len(sample)) // buckets]) if len(sample) else sample
+
+    # Pass 3: scatter rows into their buckets (stable, so equal keys keep row order)
+    bucketSizes = np.zeros(len(edges) + 1, dtype=np.int64)
+    for start in range(0, size, chunkRows):
+        bucketSizes += np.bincount(np.searchsorted(edges, unsortedKey[start:start + chunkRows], side='right'),
+                                   minlength=len(edges) + 1)
+    bucketStarts = np.concatenate(([0], np.cumsum(bucketSizes)))
+    cursor = bucketStarts[:-1].copy()
+    key = _createColumn(directory, "key", size)
+    sortedLat = _createColumn(directory, "sorted_lat", size)
+    sortedLon = _createColumn(directory, "sorted_lon", size)
+    index = _createColumn(directory, "index", size)
+    for start in range(0, size, chunkRows):
+        chunkKey = np.asarray(unsortedKey[start:start + chunkRows])
+        bucket = np.searchsorted(edges, chunkKey, side='right')
+        order = np.argsort(bucket, kind='stable')
+        bucket = bucket[order]
+        counts = np.bincount(bucket, minlength=len(edges) + 1)
+        # Position of each row within its bucket's run in this chunk
+        runStarts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        positions = cursor[bucket] + np.arange(len(bucket)) - runStarts[bucket]
+        cursor += counts
+        key[positions] = chunkKey[order]
+        sortedLat[positions] = lat[start:start + chunkRows][order]
+        sortedLon[positions] = lon[start:start + chunkRows][order]
+        index[positions] = start + order
+        if progress:
+            progress(min(start + chunkRows, size), size, "Sorting")
+
+    # Pass 4: sort each bucket by (key, row)
+    for bucket in range(len(bucketSizes)):
+        start, stop = bucketStarts[bucket], bucketStarts[bucket + 1]
+        if stop - start > 1:
+            order = np.lexsort((index[start:stop], key[start:stop]))
+            for column in (key, sortedLat, sortedLon, index):
+                column[start:stop] = column[start:stop][order]
+
+    for column in (key, sortedLat, sortedLon, index, unsortedKey):
+        if isinstance(column, np.memmap):
+            column.flush()
+    del key, sortedLat, sortedLon, index, unsortedKey, lat, lon
+    os.remove(keyPath)
+
+    meta = {"version": STORE_VERSION, "count": size, "source": os.path.abspath(csvPath),
+            "created": time.time(), "keyBits": KEY_BITS, "columns": COLUMNS}
+    with open(metaPath + ".tmp", 'w') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(metaPath + ".tmp", metaPath)
+    return PointStore(directory)
+
+# Sorted-key ranges [low, high) covering a quantized box: the box is split into
+# at most 4 x 4 aligned Z-order cells, and each cell's keys are contiguous
+def _keyRanges(qLatLow, qLatHigh, qLonLow, qLonHigh):
+    shift = 0
+    while (qLatHigh >> shift) - (qLatLow >> shift) > 3 or (qLonHigh >> shift) - (qLonLow >> shift) > 3:
+        shift += 1
+    cellsLon = np.arange(qLonLow >> shift, (qLonHigh >> shift) + 1)
+    cellsLat = np.arange(qLatLow >> shift, (qLatHigh >> shift) + 1)
+    prefixes = (_spreadBits(np.repeat(cellsLon, len(cellsLat))) |
+                (_spreadBits(np.tile(cellsLat, len(cellsLon))) << np.uint64(1)))
+    ranges = []
+    for prefix in sorted(int(value) for value in prefixes):
+        low, high = prefix << (2 * shift), (prefix + 1) << (2 * shift)
+        if ranges and ranges[-1][1] == low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+    return ranges
+
+# Sorted positions of every point inside a latitude box and one or more
+# longitude ranges, read from the memmaps one key range at a time
+def _pointsInBox(store, latLow, latHigh, lonRanges, chunkRows=262144):
+    found = []
+    for lonLow, lonHigh in lonRanges:
+        qLat, qLon = quantize([latLow, latHigh], [lonLow, lonHigh])
+        for low, high in _keyRanges(int(qLat[0]), int(qLat[1]), int(qLon[0]), int(qLon[1])):
+            first = int(np.searchsorted(store.key, np.uint64(low), side='left'))
+            last = int(np.searchsorted(store.key, np.uint64(high), side='left'))
+            for start in range(first, last, chunkRows):
+                stop = min(last, start + chunkRows)
+                lat = np.asarray(store.sortedLat[start:stop])
+                lon = np.asarray(store.sortedLon[start:stop])
+                inside = (lat >= latLow) & (lat <= latHigh) & (lon >= lonLow) & (lon <= lonHigh)
+                found.append(start + np.nonzero(inside)[0])
+    return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+# Box around [latLow, latHigh] x [lonLow, lonHigh] grown by radius miles, as a
+# latitude range and a list of longitude ranges (split at the antimeridian)
+def _expandBox(latLow, latHigh, lonLow, lonHigh, radius):
+    angle = radius / EARTH_RADIUS * (1 + 1e-9) + 1e-12
+    margin = degrees(angle) + 1e-9
+    farthestLat = radians(max(abs(latLow), abs(latHigh)))
+    newLatLow, newLatHigh = max(-90.0, latLow - margin), min(90.0, latHigh + margin)
+    # Widest longitude spread of a circle of that radius centred at farthestLat
+    if newLatLow <= -90.0 or newLatHigh >= 90.0 or angle >= pi / 2 - farthestLat:
+        return newLatLow, newLatHigh, [(-180.0, 180.0)]
+    lonMargin = degrees(asin(min(1.0, sin(angle) / cos(farthestLat)))) + 1e-9
+    low, high = lonLow - lonMargin, lonHigh + lonMargin
+    if high - low >= 360.0:
+        return newLatLow, newLatHigh, [(-180.0, 180.0)]
+    ranges = [(max(low, -180.0), min(high, 180.0))]
+    if low < -180.0:
+        ranges.append((low + 360.0, 180.0))
+    if high > 180.0:
+        ranges.append((-180.0, high - 360.0))
+    return newLatLow, newLatHigh, ranges
+
+# KD-tree over the points at the given sorted positions. Points are indexed in
+# original row order so ties resolve to the lower row, as in a full run.
+# Returns the tree, the original rows and each sorted position's tree index.
+def _localTree(store, positions):
+    rows = np.asarray(store.index[positions])
+    order = np.argsort(rows, kind='stable')
+    positions, rows = positions[order], rows[order]
+    tree = KDTree(np.asarray(store.sortedLat[positions]).tolist(), np.asarray(store.sortedLon[positions]).tolist())
+    treeIndex = dict(zip(positions.tolist(), range(len(positions))))
+    return tree, rows.tolist(), treeIndex
+
+# Candidates for the points at sorted positions [start, stop): every point
+# within the largest k-th distance found so far of their bounding box
+def _groupCandidates(store, start, stop, results, k):
+    reach = max(neighbors[-1][1] if len(neighbors) == k else float('inf') for neighbors in results)
+    if reach == float('inf'):
+        return np.arange(len(store))
+    lat = np.asarray(store.sortedLat[start:stop])
+    lon = np.asarray(store.sortedLon[start:stop])
+    latLow, latHigh, lonRanges = _expandBox(float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max()), reach)
+    return _pointsInBox(store, latLow, latHigh, lonRanges)
+
+# Sorted position splitting [start, stop) at the highest key bit that differs
+# between its first and last point, i.e. into two aligned Z-order cells
+def _splitPosition(store, start, stop):
+    first, last = int(store.key[start]), int(store.key[stop - 1])
+    if first == last:
+        return None
+    bit = 1 << ((first ^ last).bit_length() - 1)
+    boundary = (last >> (bit.bit_length() - 1)) << (bit.bit_length() - 1)
+    return start + int(np.searchsorted(store.key[start:stop], np.uint64(boundary), side='left'))
+
+# Groups smaller than this are never split further
+MIN_GROUP_ROWS = 32
+
+# Calculates the k closest points to every point in the store, tileRows
+# points (consecutive in Z-order) at a time. Each tile is first searched
+# together with a halo of the tileRows / 4 points on either side. The largest
+# k-th distance found bounds how far any true neighbour can be: if every point
+# within that distance of the tile's bounding box is already in the halo the
+# results are final, otherwise the tile is split along Z-order cells until the
+# boxes are tight and each part not covered by the halo is searched again over
+# its own candidates. Results match calculateClosestPoints exactly, including
+# ties. Each point's [(row, distance)] is passed to writer.add in Z-order.
+# Returns {'tiles', 'researched', 'largestSearch'}.
+@stage("tiledNeighbors")
+def tiledNeighbors(store, k=3, tileRows=50000, writer=None, progress=None):
+    size = len(store)
+    halo = max(k, tileRows // 4)
+    stats = {'tiles': 0, 'researched': 0, 'largestSearch': 0}
+    for tileStart in range(0, size, tileRows):
+        tileStop = min(size, tileStart + tileRows)
+        window = np.arange(max(0, tileStart - halo), min(size, tileStop + halo))
+        tree, rows, treeIndex = _localTree(store, window)
+        results = [[(rows[j], dist) for j, dist in tree.query(treeIndex[p], k)] for p in range(tileStart, tileStop)]
+        stats['largestSearch'] = max(stats['largestSearch'], len(window))
+
+        pending = [(tileStart, tileStop)] if len(window) < size else []
+        while pending:
+            start, stop = pending.pop()
+            group = results[start - tileStart:stop - tileStart]
+            candidates = _groupCandidates(store, start, stop, group, k)
+            if candidates[0] >= window[0] and candidates[-1] <= window[-1]:
+                continue
+            middle = _splitPosition(store, start, stop)
+            if len(candidates) > 4 * (stop - start) and stop - start > MIN_GROUP_ROWS and middle is not None:
+                pending.extend([(start, middle), (middle, stop)])
+                continue
+            positions = np.union1d(candidates, np.arange(start, stop))
+            tree, rows, treeIndex = _localTree(store, positions)
+            for p in range(start, stop):
+                results[p - tileStart] = [(rows[j], dist) for j, dist in tree.query(treeIndex[p], k)]
+            stats['researched'] += 1
+            stats['largestSearch'] = max(stats['largestSearch'], len(positions))
+
+        if writer is not None:
+            for p, neighbors in zip(np.asarray(store.index[tileStart:tileStop]).tolist(), results):
+                writer.add(p, neighbors)
+        stats['tiles'] += 1
+        if progress:
+            progress(tileStop, size)
+    count("points", size)
+    return stats
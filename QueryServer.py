@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+# Local HTTP/JSON service answering closest-point queries against a survey CSV
+# that is loaded once (with readCSV's validation) into a KD-tree. Built on
+# asyncio streams only, so it needs nothing beyond the standard library.
+#
+#   python QueryServer.py survey.csv --port 8765
+#
+#   GET  /nearest?lat=40.1&lon=-75.2&k=3[&maxDistance=2]
+#   GET  /radius?lat=40.1&lon=-75.2&radius=0.5[&limit=1000]
+#   POST /batch      {"queries": [{"type": "nearest", "lat": 40.1, "lon": -75.2, "k": 3},
+#                                 {"type": "radius", "lat": 40.1, "lon": -75.2, "radius": 0.5}]}
+#   GET  /metrics    request counts, latency percentiles, throughput, cache and reload stats
+#   GET  /health
+#
+# Each result is {"index", "lat", "lon", "distance", "channel"}, nearest first,
+# with distances in miles and '#N/A' channels as "#N/A". A radius query returns
+# at most `limit` points (the nearest ones) and says so with "truncated": true;
+# /batch lists the positions of truncated queries. Identical queries
+# that arrive while one is being computed share its result, recent results
+# are kept in an LRU, and the CSV is reloaded when it changes on disk.
+
+MAX_K = 1000
+DEFAULT_RADIUS_LIMIT = 1000
+MAX_RADIUS_LIMIT = 10000
+MAX_BATCH = 10000
+# Most results (sum of k and radius limits) one batch may ask for
+MAX_BATCH_RESULTS = 1000000
+MAX_BODY_BYTES = 16 * 1024 * 1024
+LATENCY_SAMPLES = 2000
+
+class BadRequest(Exception):
+    pass
+
+# The loaded survey: columns, KD-tree and the file stamp it was loaded from
+class SurveyIndex:
+    def __init__(self, csvPath, generation):
+        from Cleaner import readCSV
+        from SpatialIndex import KDTree
+        self.stamp = fileStamp(csvPath)
+        self.lat, self.lon, self.wifiChannel, _ = readCSV(csvPath)
+        self.tree = KDTree(self.lat, self.lon)
+        self.generation = generation
+        self.loadedAt = time.time()
+
+    def _result(self, j, distance):
+        from Cleaner import NO_CHANNEL
+        channel = self.wifiChannel[j]
+        return {"index": j, "lat": self.lat[j], "lon": self.lon[j], "distance": distance,
+                "channel": "#N/A" if channel == NO_CHANNEL else channel}
+
+    # Radius queries return up to limit + 1 points so truncation can be detected
+    def answer(self, query):
+        kind, lat, lon, value, option = query
+        if kind == "nearest":
+            found = self.tree.queryPoint(lat, lon, value, option)
+        else:
+            found = self.tree.queryPoint(lat, lon, option + 1, value)
+        return [self._result(j, distance) for j, distance in found]
+
+def fileStamp(path):
+    status = os.stat(path)
+    return (status.st_mtime_ns, status.st_size)
+
+def _number(source, name, required=True, default=None):
+    value = source.get(name)
+    if value is None:
+        if required:
+            raise BadRequest(f"'{name}' is required")
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"'{name}' must be a number: {value}")
+    if number != number or number in (float('inf'), float('-inf')):
+        raise BadRequest(f"'{name}' must be finite")
+    return number
+
+# Validates one query given as a dict (from JSON or the query string) and
+# returns its hashable form: (type, lat, lon, k or radius, maxDistance or limit)
+def parseQuery(source, kind):
+    lat = _number(source, "lat")
+    lon = _number(source, "lon")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise BadRequest(f"Invalid latitude or longitude value: {lat}, {lon}")
+    if kind == "nearest":
+        k = _number(source, "k", required=False, default=3)
+        if k != int(k) or not 1 <= k <= MAX_K:
+            raise BadRequest(f"'k' must be a whole number from 1 to {MAX_K}")
+        maxDistance = _number(source, "maxDistance", required=False)
+        if maxDistance is not None and maxDistance < 0:
+            raise BadRequest("'maxDistance' must not be negative")
+        return ("nearest", lat, lon, int(k), maxDistance)
+    if kind == "radius":
+        radius = _number(source, "radius")
+        if radius < 0:
+            raise BadRequest("'radius' must not be negative")
+        limit = _number(source, "limit", required=False, default=DEFAULT_RADIUS_LIMIT)
+        if limit != int(limit) or not 1 <= limit <= MAX_RADIUS_LIMIT:
+            raise BadRequest(f"'limit' must be a whole number from 1 to {MAX_RADIUS_LIMIT}")
+        return ("radius", lat, lon, radius, int(limit))
+    raise BadRequest(f"Unknown query type: {kind}")
+
+# Most results a parsed query can return
+def resultLimit(query):
+    return query[3] if query[0] == "nearest" else query[4]
+
+# Cuts a radius query's results down to its limit; returns them and whether any were dropped
+def trimResults(query, results):
+    limit = resultLimit(query)
+    return results[:limit], len(results) > limit
+
+# Request counts, recent latencies and throughput
+class Metrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = {}
+        self.errors = 0
+        self.queries = 0
+        self.cacheHits = 0
+        self.computed = 0
+        self.coalesced = 0
+        self.reloads = 0
+        self.reloadError = None
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.recent = deque()
+
+    def record(self, endpoint, seconds, failed):
+        now = time.monotonic()
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        self.errors += failed
+        self.latencies.append(seconds)
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - 60:
+            self.recent.popleft()
+
+    def snapshot(self):
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+        total = sum(self.requests.values())
+        return {"uptimeSeconds": uptime, "requests": total, "requestsByEndpoint": self.requests,
+                "errors": self.errors, "requestsPerSecond": total / uptime if uptime > 0 else 0.0,
+                "requestsPerSecondLastMinute": len(self.recent) / min(60.0, max(uptime, 1e-9)),
+                "latencyMs": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99),
+                              "max": latencies[-1] * 1000 if latencies else None},
+                "queries": self.queries, "cacheHits": self.cacheHits, "computed": self.computed,
+                "coalesced": self.coalesced, "reloads": self.reloads, "reloadError": self.reloadError}
+
+class QueryServer:
+    def __init__(self, csvPath, cacheSize=4096, reloadInterval=2.0):
+        self.csvPath = csvPath
+        self.cacheSize = cacheSize
+        self.reloadInterval = reloadInterval
+        self.metrics = Metrics()
+        self.cache = OrderedDict()
+        self.inFlight = {}
+        # Queries run one batch at a time off the event loop; loads get their own thread
+        self.queryExecutor = ThreadPoolExecutor(max_workers=1)
+        self.loadExecutor = ThreadPoolExecutor(max_workers=1)
+        self.index = SurveyIndex(csvPath, generation=1)
+        self.server = None
+        self.reloadTask = None
+
+    # Answers queries from the LRU, from identical queries already being
+    # computed, or by computing the rest together in one executor call
+    async def resolve(self, queries):
+        loop = asyncio.get_running_loop()
+        index = self.index
+        answers = [None] * len(queries)
+        waiting = []
+        todo = {}
+        self.metrics.queries += len(queries)
+        for position, query in enumerate(queries):
+            key = (index.generation,) + query
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                answers[position] = self.cache[key]
+                self.metrics.cacheHits += 1
+            elif key in self.inFlight:
+                waiting.append((position, self.inFlight[key]))
+                self.metrics.coalesced += 1
+            else:
+                future = loop.create_future()
+                self.inFlight[key] = future
+                todo[key] = future
+                waiting.append((position, future))
+
+        if todo:
+            keys = list(todo)
+            work = loop.run_in_executor(self.queryExecutor, lambda: [index.answer(key[1:]) for key in keys])
+            try:
+                try:
+                    results = await asyncio.shield(work)
+                except asyncio.CancelledError:
+                    # The request was cancelled (the server is closing or the
+                    # client went away). The batch may be shared with other
+                    # requests and a running one cannot be interrupted, so it is
+                    # awaited and its results handed out before cancelling.
+                    results = await work
+                    self._finish(keys, todo, results)
+                    raise
+            except BaseException as e:
+                self._fail(keys, todo, e)
+                raise
+            self._finish(keys, todo, results)
+
+        for position, future in waiting:
+            answers[position] = await future
+        return answers
+
+    # Hands a computed batch to its waiters and the LRU
+    def _finish(self, keys, todo, results):
+        self.metrics.computed += len(keys)
+        for key, result in zip(keys, results):
+            self.inFlight.pop(key, None)
+            if not todo[key].done():
+                todo[key].set_result(result)
+            self.cache[key] = result
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    # Fails whatever a batch left unanswered, so no waiter hangs on it
+    def _fail(self, keys, todo, error):
+        for key in keys:
+            self.inFlight.pop(key, None)
+            if todo[key].done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                todo[key].cancel()
+            else:
+                todo[key].set_exception(error)
+                # Mark the exception as retrieved for futures nobody else awaits
+                todo[key].exception()
+
+    async def handle(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path in ("/nearest", "/radius") and method == "GET":
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            query = parseQuery(params, path[1:])
+            results, = await self.resolve([query])
+            results, truncated = trimResults(query, results)
+            response = {"query": params, "generation": self.index.generation, "results": results}
+            if query[0] == "radius":
+                response["truncated"] = truncated
+            return 200, response
+        if path == "/batch" and method == "POST":
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError as e:
+                raise BadRequest(f"Body is not valid JSON: {e}")
+            queries = payload.get("queries") if isinstance(payload, dict) else None
+            if not isinstance(queries, list):
+                raise BadRequest("Body must be an object with a 'queries' list")
+            if len(queries) > MAX_BATCH:
+                raise BadRequest(f"At most {MAX_BATCH} queries per batch")
+            parsed = []
+            for n, query in enumerate(queries):
+                if not isinstance(query, dict):
+                    raise BadRequest(f"Query {n}: must be an object")
+                try:
+                    parsed.append(parseQuery(query, query.get("type", "nearest")))
+                except BadRequest as e:
+                    raise BadRequest(f"Query {n}: {e}")
+            if sum(resultLimit(query) for query in parsed) > MAX_BATCH_RESULTS:
+                raise BadRequest(f"A batch may ask for at most {MAX_BATCH_RESULTS} results (sum of k and limit)")
+            results = []
+            truncated = []
+            for n, (query, found) in enumerate(zip(parsed, await self.resolve(parsed))):
+                found, cut = trimResults(query, found)
+                results.append(found)
+                if cut:
+                    truncated.append(n)
+            return 200, {"generation": self.index.generation, "results": results, "truncated": truncated}
+        if path == "/metrics" and method == "GET":
+            snapshot = self.metrics.snapshot()
+            snapshot.update({"points": len(self.index.lat), "generation": self.index.generation,
+                             "loadedAt": self.index.loadedAt, "csvPath": os.path.abspath(self.csvPath),
+                             "cacheEntries": len(self.cache)})
+            return 200, snapshot
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok", "points": len(self.index.lat)}
+        if path in ("/nearest", "/radius", "/batch", "/metrics", "/health"):
+            return 405, {"error": f"{method} is not allowed for {path}"}
+        return 404, {"error": f"Unknown endpoint: {path}"}
+
+    # One HTTP/1.1 connection; requests are served in order until it closes
+    async def connection(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine.strip():
+                    break
+                start = time.perf_counter()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = requestLine.decode('latin-1').split()
+                endpoint = "invalid"
+                try:
+                    if len(parts) != 3:
+                        raise BadRequest("Malformed request line")
+                    method, target, version = parts
+                    endpoint = urlsplit(target).path
+                    length = int(headers.get("content-length", 0) or 0)
+                    if length > MAX_BODY_BYTES:
+                        raise BadRequest(f"Body larger than {MAX_BODY_BYTES} bytes")
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.handle(method.upper(), target, body)
+                except BadRequest as e:
+                    status, payload = 400, {"error": str(e)}
+                except ValueError as e:
+                    status, payload = 400, {"error": f"Bad request: {e}"}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                keepAlive = (len(parts) == 3 and parts[2] == "HTTP/1.1"
+                             and headers.get("connection", "").lower() != "close" and status != 400)
+                data = json.dumps(payload).encode()
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                          500: "Internal Server Error"}[status]
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n"
+                             .encode() + data)
+                await writer.drain()
+                if endpoint != "/metrics":
+                    self.metrics.record(endpoint, time.perf_counter() - start, status >= 400)
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # Reloads the CSV in the background whenever its modification time or size changes.
+    # A file that fails validation leaves the current index in place.
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        failedStamp = None
+        while True:
+            await asyncio.sleep(self.reloadInterval)
+            try:
+                stamp = fileStamp(self.csvPath)
+                if stamp in (self.index.stamp, failedStamp):
+                    continue
+                index = await loop.run_in_executor(self.loadExecutor, SurveyIndex, self.csvPath, self.index.generation + 1)
+            except (OSError, ValueError) as e:
+                # Not retried until the file changes again
+                failedStamp = stamp
+                self.metrics.reloadError = str(e)
+                continue
+            self.index = index
+            self.cache.clear()
+            self.metrics.reloads += 1
+            self.metrics.reloadError = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.connection, host, port)
+        if self.reloadInterval:
+            self.reloadTask = asyncio.create_task(self.watch())
+        return self.server
+
+    async def close(self):
+        if self.reloadTask:
+            self.reloadTask.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.queryExecutor.shutdown(wait=False)
+        self.loadExecutor.shutdown(wait=False)
+
+async def serve(csvPath, host, port, cacheSize, reloadInterval):
+    server = QueryServer(csvPath, cacheSize, reloadInterval)
+    await server.start(host, port)
+    print(f"Serving {len(server.index.lat)} points from {csvPath} on http://{host}:{port}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve closest-point queries for a survey CSV over HTTP/JSON.")
+    parser.add_argument("csv", help="survey CSV with Lat, Lon and WiFi Channel columns")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=4096, help="results kept for repeated queries")
+    parser.add_argument("--reload-interval", type=float, default=2.0,
+                        help="seconds between checks for a changed CSV (0 disables reloading)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.csv, args.host, args.port, args.cache_size, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"{args.csv}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
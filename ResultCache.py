@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".tws_cache")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Exclusive lock on an open file, held until _unlockFile, across processes
+def _lockFile(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlockFile(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+# Hashes a file's contents in fixed-size chunks
+def fileHash(filePath, chunkSize=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filePath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Content-addressed store for output files. An entry is keyed by the hashes of
+# the input files plus the parameters that shaped the output (k, colors, output
+# kind, ...), so a hit means the stored files are exactly what a fresh run would
+# write. The least recently used entries are evicted once the store grows past
+# maxBytes. Hit and miss counts are kept across runs in index.json.
+# One store can be shared by several threads and processes: every change to
+# the index happens under a lock (index.lock) on the latest index on disk.
+# A key of None (an input could not be hashed) is never stored or found.
+class ResultCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.indexPath = os.path.join(directory, "index.json")
+        self.lockPath = os.path.join(directory, "index.lock")
+        self.threadLock = threading.Lock()
+        self.index = self._loadIndex()
+
+    def _loadIndex(self):
+        try:
+            with open(self.indexPath, 'r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('hits', 0)
+        index.setdefault('misses', 0)
+        return index
+
+    # Written to a temporary file and swapped in, so readers never see half an index
+    def _saveIndex(self):
+        descriptor, temporaryPath = tempfile.mkstemp(prefix="index.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(self.index, file)
+            os.replace(temporaryPath, self.indexPath)
+        except BaseException:
+            os.remove(temporaryPath)
+            raise
+
+    # Holds the thread and file locks and reloads the index, so changes made by
+    # other processes since it was last read are kept
+    @contextmanager
+    def _locked(self):
+        with self.threadLock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lockPath, 'a+b') as lockFile:
+                _lockFile(lockFile)
+                try:
+                    self.index = self._loadIndex()
+                    yield self.index
+                finally:
+                    _unlockFile(lockFile)
+
+    # Builds the cache key for a set of input files and output parameters, or
+    # returns None if an input cannot be read (the run then bypasses the cache)
+    def key(self, inputPaths, **params):
+        digest = hashlib.sha256()
+        try:
+            for inputPath in inputPaths:
+                digest.update(fileHash(inputPath).encode())
+        except OSError:
+            return None
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    # Copies a cached entry's files to their destinations. outputs maps the stored
+    # name of each file to where it should be written. Returns True on a hit.
+    def get(self, key, outputs):
+        if key is None:
+            return False
+        with self._locked() as index:
+            entry = index['entries'].get(key)
+            entryDir = os.path.join(self.directory, key)
+            hit = entry is not None and all(os.path.exists(os.path.join(entryDir, name)) for name in outputs)
+            if hit:
+                for name, destination in outputs.items():
+                    shutil.copyfile(os.path.join(entryDir, name), destination)
+                entry['lastUsed'] = time.time()
+                index['hits'] += 1
+            else:
+                index['misses'] += 1
+            self._saveIndex()
+        return hit
+
+    # Stores freshly written output files under key. outputs maps the stored name
+    # of each file to the path it was written to.
+    def put(self, key, outputs):
+        if key is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # Files are copied outside the lock into a directory of this call's own
+        temporaryDir = tempfile.mkdtemp(prefix=key + ".", suffix=".tmp", dir=self.directory)
+        try:
+            size = 0
+            for name, source in outputs.items():
+                shutil.copyfile(source, os.path.join(temporaryDir, name))
+                size += os.path.getsize(source)
+            with self._locked() as index:
+                entryDir = os.path.join(self.directory, key)
+                shutil.rmtree(entryDir, ignore_errors=True)
+                os.replace(temporaryDir, entryDir)
+                index['entries'][key] = {'size': size, 'lastUsed': time.time(), 'files': sorted(outputs)}
+                self._evict()
+                self._saveIndex()
+        finally:
+            shutil.rmtree(temporaryDir, ignore_errors=True)
+
+    # Drops least recently used entries until the store fits in maxBytes
+    def _evict(self):
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda name: entries[name]['lastUsed']):
+            if total <= self.maxBytes:
+                break
+            total -= entries[key]['size']
+            del entries[key]
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def clear(self):
+        with self._locked():
+            for key in list(self.index['entries']):
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            self.index = {'entries': {}, 'hits': 0, 'misses': 0}
+            self._saveIndex()
+
+    # Hit/miss counts and current size of the store
+    def stats(self):
+        with self._locked() as index:
+            entries = index['entries']
+            lookups = index['hits'] + index['misses']
+            return {'hits': index['hits'], 'misses': index['misses'],
+                    'hitRate': index['hits'] / lookups if lookups else 0.0,
+                    'entries': len(entries), 'bytes': sum(entry['size'] for entry in entries.values())}
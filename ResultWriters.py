@@ -0,0 +1,212 @@
+import csv
+import os
+from abc import ABC, abstractmethod
+
+# Output layer for closest-point results. Writers are fed one point at a time
+# with add(i, neighbors), where neighbors is [(j, distance), ...] nearest first,
+# buffer chunkRows points and write each chunk in one go. Every row carries the
+# source point's index and coordinates next to its k neighbours.
+#
+#   with openResultWriter("out.parquet", lat, lon, wifiChannel, k=3) as writer:
+#       for i in range(len(lat)):
+#           writer.add(i, tree.query(i, 3))
+#
+# mode='closest' stores whether each neighbour shares the point's channel,
+# mode='cochannel' stores each neighbour's channel. setMetadata() (called by
+# calculateClosestPoints for exact and approximate runs alike) records the
+# mode and, for approximate runs, the recall: as Mode and Recall columns at the
+# end of each CSV row, in the Parquet schema metadata, or in a <file>.meta.json
+# next to a .npy file (which has no room for it).
+
+# Base class: buffering and the per-neighbour channel column. Subclasses
+# write one buffered chunk at a time in _writeChunk.
+class ResultWriter(ABC):
+    def __init__(self, filePath, lat, lon, wifiChannel, k=3, mode='closest', chunkRows=50000):
+        if mode not in ('closest', 'cochannel'):
+            raise ValueError(f"Unknown output mode: {mode}")
+        self.filePath = filePath
+        self.lat = lat
+        self.lon = lon
+        self.wifiChannel = wifiChannel
+        self.k = k
+        self.mode = mode
+        self.chunkRows = chunkRows
+        self.buffer = []
+        self.rowsWritten = 0
+        self.metadata = {}
+
+    # Must be called before any rows are written
+    def setMetadata(self, metadata):
+        if self.rowsWritten:
+            raise ValueError("Metadata must be set before results are written")
+        self.metadata = dict(metadata)
+
+    def _channelValue(self, i, j):
+        if self.mode == 'closest':
+            return self.wifiChannel[i] == self.wifiChannel[j]
+        return self.wifiChannel[j]
+
+    def add(self, i, neighbors):
+        self.buffer.append((i, neighbors))
+        if len(self.buffer) >= self.chunkRows:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._writeChunk(self.buffer)
+            self.rowsWritten += len(self.buffer)
+            self.buffer = []
+
+    @abstractmethod
+    def _writeChunk(self, chunk):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# CSV with Index, Lat, Lon and then the usual per-neighbour columns
+class CSVResultWriter(ResultWriter):
+    def __init__(self, filePath, lat, lon, wifiChannel, k=3, mode='closest', chunkRows=50000):
+        super().__init__(filePath, lat, lon, wifiChannel, k, mode, chunkRows)
+        self.file = open(filePath, 'w', newline='', buffering=1024 * 1024)
+        self.writer = csv.writer(self.file)
+        self.headerWritten = False
+
+    # The header goes out with the first chunk so metadata set before then is included
+    def _writeHeader(self):
+        from Cleaner import closestPointFields, RUN_FIELDS, runValues
+        fields = ['Index', 'Lat', 'Lon'] + closestPointFields(self.k, self.mode)
+        self.width = len(fields)
+        self.run = runValues(self.metadata) if self.metadata else None
+        self.writer.writerow(fields + RUN_FIELDS if self.run else fields)
+        self.headerWritten = True
+
+    def _writeChunk(self, chunk):
+        if not self.headerWritten:
+            self._writeHeader()
+        rows = []
+        for i, neighbors in chunk:
+            row = [i, self.lat[i], self.lon[i]]
+            for j, dist in neighbors:
+                row.extend([self.lat[j], self.lon[j], dist, self._channelValue(i, j)])
+            if self.run:
+                row.extend([''] * (self.width - len(row)) + self.run)
+            rows.append(row)
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.flush()
+        if not self.headerWritten:
+            self._writeHeader()
+        self.file.close()
+
+# lat/lon as float64 arrays, converted once per writer (no copy for arrays or
+# memory maps that already are float64) so each chunk only gathers its own rows
+def _coordinateArrays(lat, lon):
+    import numpy as np
+    return np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+
+# Columnar arrays for one chunk: index/lat/lon plus neighbourIndex, distance and
+# sameChannel (or channel) as (rows, k) arrays; missing neighbours are -1 / NaN
+def _chunkArrays(writer, chunk):
+    import numpy as np
+    rows = len(chunk)
+    k = writer.k
+    index = np.fromiter((i for i, _ in chunk), dtype=np.int64, count=rows)
+    neighborIndex = np.full((rows, k), -1, dtype=np.int64)
+    distance = np.full((rows, k), np.nan, dtype=np.float64)
+    channelType = np.bool_ if writer.mode == 'closest' else np.int16
+    channel = np.zeros((rows, k), dtype=channelType)
+    for row, (i, neighbors) in enumerate(chunk):
+        for n, (j, dist) in enumerate(neighbors):
+            neighborIndex[row, n] = j
+            distance[row, n] = dist
+            channel[row, n] = writer._channelValue(i, j)
+    return index, writer.latArray[index], writer.lonArray[index], neighborIndex, distance, channel
+
+# Parquet file with one row group per chunk (needs pyarrow)
+class ParquetResultWriter(ResultWriter):
+    def __init__(self, filePath, lat, lon, wifiChannel, k=3, mode='closest', chunkRows=100000):
+        super().__init__(filePath, lat, lon, wifiChannel, k, mode, chunkRows)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output needs the pyarrow package (pip install pyarrow)")
+        self.pa = pyarrow
+        self.writer = None
+        self.latArray, self.lonArray = _coordinateArrays(lat, lon)
+
+    def _writeChunk(self, chunk):
+        import numpy as np
+        pa = self.pa
+        index, lat, lon, neighborIndex, distance, channel = _chunkArrays(self, chunk)
+        columns = {'index': index, 'lat': lat, 'lon': lon}
+        channelName = 'same_channel' if self.mode == 'closest' else 'channel'
+        latAll, lonAll = self.latArray, self.lonArray
+        for n in range(self.k):
+            valid = neighborIndex[:, n] >= 0
+            columns[f'neighbor_index{n + 1}'] = pa.array(neighborIndex[:, n], mask=~valid)
+            columns[f'lat{n + 1}'] = pa.array(np.where(valid, latAll[neighborIndex[:, n]], np.nan), mask=~valid)
+            columns[f'lon{n + 1}'] = pa.array(np.where(valid, lonAll[neighborIndex[:, n]], np.nan), mask=~valid)
+            columns[f'distance{n + 1}'] = pa.array(distance[:, n], mask=~valid)
+            columns[f'{channelName}{n + 1}'] = pa.array(channel[:, n], mask=~valid)
+        table = pa.table(columns)
+        if self.metadata:
+            table = table.replace_schema_metadata({key: str(value) for key, value in self.metadata.items()})
+        if self.writer is None:
+            self.writer = pa.parquet.ParquetWriter(self.filePath, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            # No rows: still write an empty file with the right schema
+            self._writeChunk([])
+        self.writer.close()
+
+# NumPy .npy file holding a structured array, one record per point, that can be
+# opened with np.load(path, mmap_mode='r'). Fields: index, lat, lon and
+# (k,)-shaped neighbor_index, distance and same_channel (or channel).
+class NumpyResultWriter(ResultWriter):
+    def __init__(self, filePath, lat, lon, wifiChannel, k=3, mode='closest', chunkRows=100000):
+        super().__init__(filePath, lat, lon, wifiChannel, k, mode, chunkRows)
+        import numpy as np
+        channelName, channelType = ('same_channel', np.bool_) if mode == 'closest' else ('channel', np.int16)
+        self.channelName = channelName
+        dtype = np.dtype([('index', np.int64), ('lat', np.float64), ('lon', np.float64),
+                          ('neighbor_index', np.int64, (k,)), ('distance', np.float64, (k,)),
+                          (channelName, channelType, (k,))])
+        self.records = np.lib.format.open_memmap(filePath, mode='w+', dtype=dtype, shape=(len(lat),))
+        self.latArray, self.lonArray = _coordinateArrays(lat, lon)
+
+    def _writeChunk(self, chunk):
+        index, lat, lon, neighborIndex, distance, channel = _chunkArrays(self, chunk)
+        self.records['index'][index] = index
+        self.records['lat'][index] = lat
+        self.records['lon'][index] = lon
+        self.records['neighbor_index'][index] = neighborIndex
+        self.records['distance'][index] = distance
+        self.records[self.channelName][index] = channel
+
+    def close(self):
+        self.flush()
+        self.records.flush()
+        del self.records
+        from Cleaner import writeMetadata
+        writeMetadata(self.filePath, self.metadata)
+
+WRITERS = {'.csv': CSVResultWriter, '.parquet': ParquetResultWriter, '.npy': NumpyResultWriter}
+
+# Picks the writer from the file extension (.csv, .parquet or .npy)
+def openResultWriter(filePath, lat, lon, wifiChannel, k=3, mode='closest', **options):
+    extension = os.path.splitext(filePath)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"Unsupported output format '{extension}', use one of: {', '.join(WRITERS)}")
+    return WRITERS[extension](filePath, lat, lon, wifiChannel, k, mode, **options)
@@ -0,0 +1,299 @@
+import heapq
+from Instrumentation import stage
+from array import array
+from math import radians, sin, cos, asin, sqrt
+
+# Mean Earth radius in miles, shared by every distance calculation
+EARTH_RADIUS = 3959.87433
+
+# Converts a latitude/longitude in degrees to a point on the unit sphere
+def toUnitVector(latitude, longitude):
+    latRad = radians(float(latitude))
+    lonRad = radians(float(longitude))
+    cosLat = cos(latRad)
+    return (cosLat * cos(lonRad), cosLat * sin(lonRad), sin(latRad))
+
+# Converts a straight-line distance through the unit sphere into miles along the surface
+def chordToMiles(chord):
+    return 2 * EARTH_RADIUS * asin(min(1.0, chord / 2))
+
+# Converts a surface distance in miles into a straight-line distance through the unit sphere
+def milesToChord(miles):
+    return 2 * sin(min(miles / EARTH_RADIUS, 3.141592653589793) / 2)
+
+# Haversine distance in miles between two points given in radians, with the
+# cosines of their latitudes. Every scalar distance (Cleaner.haversine, the
+# tree and grid searches) goes through this so they agree to the last bit.
+def sphericalDistance(latRad1, latRad2, lonRad1, lonRad2, cosLat1, cosLat2):
+    a = sin((latRad2 - latRad1)/2)**2 + cosLat1 * cosLat2 * sin((lonRad2 - lonRad1)/2)**2
+    return 2 * asin(sqrt(a)) * EARTH_RADIUS
+
+# Precomputes radians, cos(latitude) and unit vectors for a set of points
+def _prepare(lat, lon):
+    latRad = [radians(float(value)) for value in lat]
+    lonRad = [radians(float(value)) for value in lon]
+    cosLat = [cos(value) for value in latRad]
+    xyz = [(c * cos(o), c * sin(o), sin(a)) for a, o, c in zip(latRad, lonRad, cosLat)]
+    return latRad, lonRad, cosLat, xyz
+
+# KD-tree over 3D unit-sphere coordinates. Boxes are pruned on chord length and
+# candidates are ranked with the exact haversine distance, so results match the
+# brute-force search, including ties (lower index wins).
+class KDTree:
+    @stage("buildKDTree")
+    def __init__(self, lat, lon, leafSize=16):
+        self.size = len(lat)
+        self.leafSize = leafSize
+        self.latRad, self.lonRad, self.cosLat, self.xyz = _prepare(lat, lon)
+
+        # Flat node arrays: bounding box, children (-1 for leaves) and leaf slice
+        self.order = list(range(self.size))
+        self.boxLo = []
+        self.boxHi = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.end = []
+        if self.size:
+            self._build(0, self.size)
+
+    def _build(self, start, end):
+        node = len(self.left)
+        points = [self.xyz[i] for i in self.order[start:end]]
+        lo = tuple(min(p[axis] for p in points) for axis in range(3))
+        hi = tuple(max(p[axis] for p in points) for axis in range(3))
+        self.boxLo.append(lo)
+        self.boxHi.append(hi)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(start)
+        self.end.append(end)
+
+        if end - start <= self.leafSize:
+            return node
+
+        # Split on the axis with the widest spread, at the median
+        axis = max(range(3), key=lambda a: hi[a] - lo[a])
+        self.order[start:end] = sorted(self.order[start:end], key=lambda i: self.xyz[i][axis])
+        middle = (start + end) // 2
+        self.left[node] = self._build(start, middle)
+        self.right[node] = self._build(middle, end)
+        return node
+
+    # Squared distance from a point to a node's bounding box
+    def _boxDistance(self, node, x, y, z):
+        lo = self.boxLo[node]
+        hi = self.boxHi[node]
+        total = 0.0
+        for value, low, high in ((x, lo[0], hi[0]), (y, lo[1], hi[1]), (z, lo[2], hi[2])):
+            if value < low:
+                total += (low - value) ** 2
+            elif value > high:
+                total += (value - high) ** 2
+        return total
+
+    def _search(self, x, y, z, latRad, lonRad, cosLat, k, exclude, maxDistance=None):
+        if k <= 0 or not self.size:
+            return []
+        limit = float('inf') if maxDistance is None else maxDistance
+        # Max-heap of (-distance, -index) holding the best k candidates so far
+        best = []
+        stack = [0]
+        order = self.order
+        pointLat = self.latRad
+        pointLon = self.lonRad
+        pointCos = self.cosLat
+        while stack:
+            node = stack.pop()
+            worst = -best[0][0] if len(best) == k else limit
+            if worst != float('inf'):
+                bound = chordToMiles(sqrt(self._boxDistance(node, x, y, z)))
+                # Small tolerance so rounding in the chord bound never hides a tie
+                if bound > worst * (1 + 1e-9) + 1e-12:
+                    continue
+            if self.left[node] == -1:
+                for p in range(self.start[node], self.end[node]):
+                    j = order[p]
+                    if j == exclude:
+                        continue
+                    distance = sphericalDistance(latRad, pointLat[j], lonRad, pointLon[j], cosLat, pointCos[j])
+                    if distance > limit:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, -j))
+                    elif (distance, j) < (-best[0][0], -best[0][1]):
+                        heapq.heapreplace(best, (-distance, -j))
+                continue
+            # Visit the nearer child first so the bound tightens quickly
+            nearChild, farChild = self.left[node], self.right[node]
+            if self._boxDistance(farChild, x, y, z) < self._boxDistance(nearChild, x, y, z):
+                nearChild, farChild = farChild, nearChild
+            stack.append(farChild)
+            stack.append(nearChild)
+        return sorted(((-negIndex, -negDistance) for negDistance, negIndex in best), key=lambda item: (item[1], item[0]))
+
+    # Returns the k nearest indexed points to point i as (index, distance) pairs, nearest first,
+    # optionally only those within maxDistance miles
+    def query(self, i, k, maxDistance=None):
+        x, y, z = self.xyz[i]
+        return self._search(x, y, z, self.latRad[i], self.lonRad[i], self.cosLat[i], k, i, maxDistance)
+
+    # Returns the k nearest indexed points to an arbitrary latitude/longitude; exclude skips one index
+    def queryPoint(self, latitude, longitude, k, maxDistance=None, exclude=-1):
+        x, y, z = toUnitVector(latitude, longitude)
+        latRad = radians(float(latitude))
+        return self._search(x, y, z, latRad, radians(float(longitude)), cos(latRad), k, exclude, maxDistance)
+
+    # Returns every indexed point within maxDistance miles of a latitude/longitude, nearest first
+    def queryRadius(self, latitude, longitude, maxDistance, exclude=-1):
+        return self.queryPoint(latitude, longitude, self.size, maxDistance, exclude)
+
+    # Largest reach of any point under each node, for queryReach. reach holds a
+    # distance in miles per indexed point; a negative reach never matches.
+    def nodeReach(self, reach):
+        nodeMax = [-1.0] * len(self.left)
+        # Children are always numbered after their parent
+        for node in reversed(range(len(self.left))):
+            if self.left[node] == -1:
+                nodeMax[node] = max((reach[j] for j in self.order[self.start[node]:self.end[node]]), default=-1.0)
+            else:
+                nodeMax[node] = max(nodeMax[self.left[node]], nodeMax[self.right[node]])
+        return nodeMax
+
+    # Reverse search: returns the indexed points j that lie within their own
+    # reach[j] miles of a latitude/longitude, in no particular order. nodeMax
+    # comes from nodeReach(reach), so one point with a large reach only widens
+    # the search through the nodes that contain it.
+    def queryReach(self, latitude, longitude, reach, nodeMax):
+        x, y, z = toUnitVector(latitude, longitude)
+        latRad = radians(float(latitude))
+        lonRad = radians(float(longitude))
+        cosLat = cos(latRad)
+        found = []
+        stack = [0] if self.size else []
+        while stack:
+            node = stack.pop()
+            limit = nodeMax[node]
+            if limit < 0:
+                continue
+            if limit != float('inf'):
+                bound = chordToMiles(sqrt(self._boxDistance(node, x, y, z)))
+                if bound > limit * (1 + 1e-9) + 1e-12:
+                    continue
+            if self.left[node] == -1:
+                for p in range(self.start[node], self.end[node]):
+                    j = self.order[p]
+                    # Measured from j, exactly as j's own neighbour search would
+                    if sphericalDistance(self.latRad[j], latRad, self.lonRad[j], lonRad, self.cosLat[j], cosLat) <= reach[j]:
+                        found.append(j)
+                continue
+            stack.append(self.left[node])
+            stack.append(self.right[node])
+        return found
+
+# Channel spread that covers every overlapping 20 MHz channel in the 2.4 GHz band
+OVERLAPPING_CHANNEL_SPREAD = 4
+
+# One KD-tree per WiFi channel, so interference queries only search the
+# buckets for channels within `spread` of the query point's channel.
+# Points whose channel is noChannel are indexed nowhere and have no interferers.
+class ChannelIndex:
+    def __init__(self, lat, lon, wifiChannel, noChannel=None, leafSize=16):
+        self.lat = lat
+        self.lon = lon
+        self.wifiChannel = wifiChannel
+        self.noChannel = noChannel
+        members = {}
+        for i, channel in enumerate(wifiChannel):
+            if channel != noChannel:
+                members.setdefault(channel, []).append(i)
+        # channel -> (tree over the bucket, bucket position -> point index)
+        self.buckets = {}
+        self.localIndex = {}
+        for channel, indices in members.items():
+            tree = KDTree([lat[i] for i in indices], [lon[i] for i in indices], leafSize)
+            self.buckets[channel] = (tree, indices)
+            for position, i in enumerate(indices):
+                self.localIndex[i] = position
+
+    # Returns the k nearest points to point i whose channel is within spread of its own,
+    # optionally only those within maxDistance miles, as (index, distance) pairs
+    def query(self, i, k, spread=0, maxDistance=None):
+        channel = self.wifiChannel[i]
+        if channel == self.noChannel:
+            return []
+        candidates = []
+        for other in range(channel - spread, channel + spread + 1):
+            if other not in self.buckets:
+                continue
+            tree, indices = self.buckets[other]
+            exclude = self.localIndex[i] if other == channel else -1
+            for position, distance in tree.queryPoint(self.lat[i], self.lon[i], k, maxDistance, exclude):
+                candidates.append((indices[position], distance))
+        candidates.sort(key=lambda item: (item[1], item[0]))
+        return candidates[:k]
+
+# Offsets of a grid cell and its 26 neighbours
+_NEIGHBOR_CELLS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+# Uniform grid over 3D unit-sphere coordinates for fixed-radius queries. Cells
+# are as wide as the chord of the radius, so every point within the radius
+# lies in the query point's cell or one of its 26 neighbours. Works the same
+# at the poles and across the antimeridian.
+class GridIndex:
+    @stage("buildGridIndex")
+    def __init__(self, lat, lon, radius):
+        self.size = len(lat)
+        self.radius = radius
+        self.latRad, self.lonRad, self.cosLat, self.xyz = _prepare(lat, lon)
+        self.cellSize = max(milesToChord(radius) * (1 + 1e-9), 1e-12)
+        self.cellOf = [self._cell(x, y, z) for x, y, z in self.xyz]
+        self.cells = {}
+        for i, cell in enumerate(self.cellOf):
+            self.cells.setdefault(cell, []).append(i)
+
+    def _cell(self, x, y, z):
+        size = self.cellSize
+        return (int((x + 1) // size), int((y + 1) // size), int((z + 1) // size))
+
+    def _search(self, cell, latRad, lonRad, cosLat, exclude):
+        cx, cy, cz = cell
+        radius = self.radius
+        pointLat = self.latRad
+        pointLon = self.lonRad
+        pointCos = self.cosLat
+        found = []
+        for dx, dy, dz in _NEIGHBOR_CELLS:
+            for j in self.cells.get((cx + dx, cy + dy, cz + dz), ()):
+                if j == exclude:
+                    continue
+                if sphericalDistance(latRad, pointLat[j], lonRad, pointLon[j], cosLat, pointCos[j]) <= radius:
+                    found.append(j)
+        found.sort()
+        return found
+
+    # Returns the indices of every other point within the radius of point i, ascending
+    def query(self, i):
+        return self._search(self.cellOf[i], self.latRad[i], self.lonRad[i], self.cosLat[i], i)
+
+    # Returns the indices of every indexed point within the radius of a latitude/longitude
+    def queryPoint(self, latitude, longitude):
+        latRad = radians(float(latitude))
+        return self._search(self._cell(*toUnitVector(latitude, longitude)), latRad, radians(float(longitude)),
+                            cos(latRad), -1)
+
+    # Counts the neighbours of every point. With withLists the neighbours are also
+    # returned in CSR layout: point i's neighbours are indices[offsets[i]:offsets[i + 1]].
+    def neighborsWithin(self, withLists=False):
+        counts = array('l')
+        offsets = array('q', [0])
+        indices = array('q')
+        for i in range(self.size):
+            found = self.query(i)
+            counts.append(len(found))
+            if withLists:
+                indices.extend(found)
+                offsets.append(len(indices))
+        if withLists:
+            return counts, offsets, indices
+        return counts, None, None
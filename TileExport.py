@@ -0,0 +1,232 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+from branca.element import MacroElement
+from folium.template import Template
+from Instrumentation import stage, count
+
+# Tiled export of site and path points. Instead of embedding every marker in
+# the map HTML, the points are written once as zoom-aware vector tiles and a
+# small Leaflet layer loads only the tiles in view and draws them on canvas, so
+# the HTML stays the same size however large the survey is.
+#
+#   stats = exportTiledMap("sites.csv", "path.csv", "map.html")
+#
+# Tiles follow the usual z/x/y Web Mercator scheme, 256 pixels square. Each
+# tile holds the distinct pixels (0-255) its points fall on, so no tile has more
+# than 65,536 points at any zoom. Tiles are JavaScript files that hand their
+# points to a callback (script tags load from file:// where fetch would not);
+# a tile with no points is simply not written. Site tiles also carry a label
+# per pixel, shown in a popup when the site is clicked.
+
+TILE_SIZE = 256
+# Deepest zoom whose global pixel coordinates still pack into one int64 key
+MAX_TILE_ZOOM = 22
+# Web Mercator stops here
+MAX_LATITUDE = 85.0511287798
+
+# Global pixel coordinates of lat/lon points at a zoom level
+def pixelCoordinates(lat, lon, zoom):
+    scale = TILE_SIZE * (1 << zoom)
+    latRad = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.arcsinh(np.tan(latRad)) / np.pi) / 2.0 * scale
+    return (np.clip(x.astype(np.int64), 0, scale - 1), np.clip(y.astype(np.int64), 0, scale - 1))
+
+def checkZoomRange(minZoom, maxZoom):
+    if not 0 <= minZoom <= maxZoom <= MAX_TILE_ZOOM:
+        raise ValueError(f"Zoom levels must satisfy 0 <= min zoom <= max zoom <= {MAX_TILE_ZOOM}, "
+                         f"got {minZoom} and {maxZoom}")
+
+# Text shown for a pixel holding `count` points, the first of them labelled `label`
+def pixelLabel(label, count):
+    return label if count == 1 else f"{label} (+{count - 1} more)"
+
+# Writes <directory>/<z>/<x>/<y>.js tiles for zoom levels minZoom..maxZoom.
+# points is an (n, 2) array of [lat, lon]; name identifies the layer in the
+# tile callbacks. labels, if given, has one string per point and each pixel
+# is written with the label of its first point. Returns {'tiles', 'bytes',
+# 'points'} with points per zoom.
+@stage("writePointTiles")
+def writePointTiles(points, directory, name, minZoom=0, maxZoom=16, progress=None, labels=None):
+    checkZoomRange(minZoom, maxZoom)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    stats = {"tiles": 0, "bytes": 0, "points": {}}
+    for zoom in range(minZoom, maxZoom + 1):
+        x, y = pixelCoordinates(points[:, 0], points[:, 1], zoom)
+        # One entry per distinct pixel, grouped by tile
+        bits = 8 + zoom
+        pixels, first, counts = np.unique((x << bits) | y, return_index=True, return_counts=True)
+        x, y = pixels >> bits, pixels & ((1 << bits) - 1)
+        tileKey = ((x >> 8) << zoom) | (y >> 8)
+        order = np.argsort(tileKey, kind='stable')
+        x, y, tileKey, first, counts = x[order], y[order], tileKey[order], first[order], counts[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(tileKey)) + 1, [len(tileKey)]))
+        for start, stop in zip(starts[:-1], starts[1:]):
+            tileX, tileY = int(x[start] >> 8), int(y[start] >> 8)
+            local = np.empty(2 * (stop - start), dtype=np.int64)
+            local[0::2] = x[start:stop] & 255
+            local[1::2] = y[start:stop] & 255
+            tileDirectory = os.path.join(directory, str(zoom), str(tileX))
+            os.makedirs(tileDirectory, exist_ok=True)
+            arguments = f'"{name}/{zoom}/{tileX}/{tileY}",[{",".join(map(str, local.tolist()))}]'
+            if labels is not None:
+                arguments += "," + json.dumps([pixelLabel(labels[p], c) for p, c in
+                                               zip(first[start:stop].tolist(), counts[start:stop].tolist())])
+            data = f'twsTile({arguments});\n'.encode()
+            with open(os.path.join(tileDirectory, f"{tileY}.js"), 'wb') as file:
+                file.write(data)
+            stats["tiles"] += 1
+            stats["bytes"] += len(data)
+        stats["points"][zoom] = len(pixels)
+        if progress:
+            progress(zoom - minZoom + 1, maxZoom - minZoom + 1)
+    count("tiles written", stats["tiles"])
+    return stats
+
+# Leaflet layer drawing the tiles written by writePointTiles as canvas dots.
+# Past maxNativeZoom the last tiles are scaled up instead of loading more.
+class PointTileLayer(MacroElement):
+    _template = Template("""
+{% macro script(this, kwargs) %}
+if (!window.twsPointTileLayer) {
+    // Each tile request tags its script with a nonce and waits under it, so
+    // a tile requested again before the first load finishes gets its own answer
+    window.twsTileCallbacks = {};
+    window.twsTileNonce = 0;
+    window.twsTile = function (key, points, labels) {
+        var script = document.currentScript;
+        var nonce = script && script.getAttribute('data-tws-nonce');
+        var entry = window.twsTileCallbacks[nonce];
+        if (entry && entry.key === key) {
+            delete window.twsTileCallbacks[nonce];
+            entry.callback(points, labels);
+        }
+    };
+    window.twsPointTileLayer = L.GridLayer.extend({
+        initialize: function (options) {
+            L.GridLayer.prototype.initialize.call(this, options);
+            this._labels = {};
+            this.on('tileunload', function (event) {
+                delete this._labels[this._tilePath(event.coords)];
+            });
+        },
+        onAdd: function (map) {
+            L.GridLayer.prototype.onAdd.call(this, map);
+            if (this.options.popups) { map.on('click', this._showPopup, this); }
+        },
+        onRemove: function (map) {
+            map.off('click', this._showPopup, this);
+            L.GridLayer.prototype.onRemove.call(this, map);
+        },
+        _tilePath: function (coords) {
+            return coords.z + '/' + coords.x + '/' + coords.y;
+        },
+        // Opens the label of the point drawn nearest the click, if one is under it
+        _showPopup: function (event) {
+            var map = this._map;
+            var zoom = this._clampZoom(Math.round(map.getZoom()));
+            var scale = Math.pow(2, map.getZoom() - zoom);
+            var pixel = map.project(event.latlng, zoom);
+            var tileX = Math.floor(pixel.x / 256), tileY = Math.floor(pixel.y / 256);
+            var tile = this._labels[zoom + '/' + tileX + '/' + tileY];
+            if (!tile) { return; }
+            var x = pixel.x - tileX * 256, y = pixel.y - tileY * 256;
+            var reach = (this.options.radius + 2) / scale, best = -1, bestDistance = reach * reach;
+            for (var i = 0; i < tile.points.length; i += 2) {
+                var dx = tile.points[i] + 0.5 - x, dy = tile.points[i + 1] + 0.5 - y;
+                if (dx * dx + dy * dy <= bestDistance) {
+                    best = i;
+                    bestDistance = dx * dx + dy * dy;
+                }
+            }
+            if (best < 0) { return; }
+            var content = document.createElement('div');
+            content.textContent = tile.labels[best / 2];
+            var at = map.unproject([tileX * 256 + tile.points[best] + 0.5, tileY * 256 + tile.points[best + 1] + 0.5], zoom);
+            L.popup().setLatLng(at).setContent(content).openOn(map);
+        },
+        createTile: function (coords, done) {
+            var layer = this;
+            var options = this.options;
+            var tile = L.DomUtil.create('canvas', 'leaflet-tile');
+            var size = this.getTileSize();
+            tile.width = size.x;
+            tile.height = size.y;
+            var path = this._tilePath(coords);
+            var key = options.name + '/' + path;
+            var nonce = String(++window.twsTileNonce);
+            var script = document.createElement('script');
+            var finish = function () {
+                if (script.parentNode) { script.parentNode.removeChild(script); }
+                done(null, tile);
+            };
+            window.twsTileCallbacks[nonce] = {key: key, callback: function (points, labels) {
+                var context = tile.getContext('2d');
+                var scale = size.x / 256;
+                context.fillStyle = options.color;
+                for (var i = 0; i < points.length; i += 2) {
+                    context.beginPath();
+                    context.arc((points[i] + 0.5) * scale, (points[i + 1] + 0.5) * scale, options.radius, 0, 2 * Math.PI);
+                    context.fill();
+                }
+                if (labels) { layer._labels[path] = {points: points, labels: labels}; }
+                finish();
+            }};
+            // Tiles without points were never written
+            script.onerror = function () {
+                delete window.twsTileCallbacks[nonce];
+                finish();
+            };
+            script.setAttribute('data-tws-nonce', nonce);
+            script.src = options.url + '/' + path + '.js';
+            document.head.appendChild(script);
+            return tile;
+        }
+    });
+}
+var {{ this.get_name() }} = new window.twsPointTileLayer({{ this.options|tojson }}).addTo({{ this._parent.get_name() }});
+{% endmacro %}
+""")
+
+    def __init__(self, url, name, color='black', radius=1.5, minNativeZoom=0, maxNativeZoom=16, popups=False):
+        super().__init__()
+        self._name = "PointTileLayer"
+        self.options = {"url": url, "name": name, "color": color, "radius": radius, "popups": popups,
+                        "minNativeZoom": minNativeZoom, "maxNativeZoom": maxNativeZoom, "maxZoom": 22}
+
+# Builds a map whose sites and path are drawn from tiles written next to the
+# HTML (in <html name>_tiles/ unless tilesDirectory is given) and saves it.
+# Tiles are written for zoom levels minZoom..maxZoom; clicking a site shows
+# its name as the marker popups of the untiled map do. Returns tile counts and sizes, the HTML size and the time taken.
+@stage("exportTiledMap")
+def exportTiledMap(siteFile, pathFile, htmlPath, tilesDirectory=None, site_color='red', path_color='black',
+                   minZoom=0, maxZoom=16):
+    import MapGenerator
+    start = time.perf_counter()
+    checkZoomRange(minZoom, maxZoom)
+    if tilesDirectory is None:
+        tilesDirectory = os.path.splitext(htmlPath)[0] + "_tiles"
+    geoSiteList, geoSiteDF = MapGenerator.readSiteColumns(siteFile)
+    geoPathList, geoPathDF = MapGenerator.readPathColumns(pathFile)
+    # Tiles left from an earlier export would otherwise still show
+    for layer in ("sites", "path"):
+        shutil.rmtree(os.path.join(tilesDirectory, layer), ignore_errors=True)
+    siteLabels = ["SiteName: " + str(name) for name in geoSiteDF.SiteName.tolist()]
+    siteStats = writePointTiles(geoSiteList, os.path.join(tilesDirectory, "sites"), "sites", minZoom, maxZoom,
+                                labels=siteLabels)
+    pathStats = writePointTiles(geoPathList, os.path.join(tilesDirectory, "path"), "path", minZoom, maxZoom)
+
+    map = MapGenerator.createMap(geoSiteList)
+    url = os.path.relpath(tilesDirectory, os.path.dirname(os.path.abspath(htmlPath))).replace(os.sep, "/")
+    PointTileLayer(url + "/path", "path", color=path_color, radius=1.5,
+                   minNativeZoom=minZoom, maxNativeZoom=maxZoom).add_to(map)
+    PointTileLayer(url + "/sites", "sites", color=site_color, radius=5,
+                   minNativeZoom=minZoom, maxNativeZoom=maxZoom, popups=True).add_to(map)
+    MapGenerator.fitMapBounds(map, geoSiteList, geoPathList)
+    MapGenerator.saveMapHtml(map, htmlPath)
+    return {"sites": len(geoSiteList), "pathPoints": len(geoPathList),
+            "tiles": siteStats["tiles"] + pathStats["tiles"], "tileBytes": siteStats["bytes"] + pathStats["bytes"],
+            "htmlBytes": os.path.getsize(htmlPath), "seconds": time.perf_counter() - start}
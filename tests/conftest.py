@@ -0,0 +1,48 @@
+import os
+import random
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Random survey points as (lat, lon, channels) lists, uniform within spread
+# degrees of 40N 75W; the same seed always gives the same points
+def randomSurvey(n, seed, spread=0.5, channels=(1, 6, 11)):
+    rng = random.Random(seed)
+    lat = [rng.uniform(40 - spread, 40 + spread) for _ in range(n)]
+    lon = [rng.uniform(-75 - spread, -75 + spread) for _ in range(n)]
+    return lat, lon, [rng.choice(channels) for _ in range(n)]
+
+# size x size points `step` degrees apart on one channel, row by row; full of
+# equal distances
+def gridSurvey(size, step=0.001, channel=1):
+    lat = [40 + step * (n // size) for n in range(size * size)]
+    lon = [-75 + step * (n % size) for n in range(size * size)]
+    return lat, lon, [channel] * (size * size)
+
+@pytest.fixture
+def survey():
+    return randomSurvey
+
+@pytest.fixture
+def grid():
+    return gridSurvey
+
+# Writes text to a file in tmp_path and returns its path as a string
+@pytest.fixture
+def csvFile(tmp_path):
+    def write(text, name="survey.csv"):
+        path = tmp_path / name
+        path.write_text(text)
+        return str(path)
+    return write
+
+# Writes lat/lon/channel lists as a survey CSV readCSV accepts ('#N/A' for NO_CHANNEL)
+@pytest.fixture
+def surveyFile(csvFile):
+    def write(lat, lon, channels, name="survey.csv"):
+        from Cleaner import NO_CHANNEL
+        lines = [f"{la!r},{lo!r},{'#N/A' if ch == NO_CHANNEL else ch}" for la, lo, ch in zip(lat, lon, channels)]
+        return csvFile("Lat,Lon,WiFi Channel\n" + "".join(line + "\n" for line in lines), name)
+    return write
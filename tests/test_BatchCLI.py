@@ -0,0 +1,34 @@
+import csv
+import pytest
+import BatchCLI
+
+# Computes closest points for a survey, then builds the map for a site/path pair
+def test_closest_then_map(tmp_path, survey, surveyFile, csvFile, capsys):
+    lat, lon, channels = survey(40, 1)
+    surveyPath = surveyFile(lat, lon, channels)
+    outputDir = str(tmp_path / "out")
+    assert BatchCLI.main(["--quiet", "closest", surveyPath, "--output-dir", outputDir, "-k", "2"]) == 0
+    with open(tmp_path / "out" / "survey_ClosestPoints.csv", newline='') as file:
+        rows = list(csv.reader(file))
+    assert len(rows) == 41 and "Mode" in rows[0]
+
+    sites = csvFile("".join(["SiteName,Lat,Long\n"] + [f"S{n},{la},{lo}\n" for n, (la, lo) in enumerate(zip(lat[:5], lon[:5]))]),
+                    "sites.csv")
+    path = csvFile("".join(["Latitude,Longitude\n"] + [f"{la},{lo}\n" for la, lo in zip(lat, lon)]), "path.csv")
+    assert BatchCLI.main(["--quiet", "map", "--pair", sites, path, "--output-dir", outputDir]) == 0
+    html = (tmp_path / "out" / "sites_map.html").read_text()
+    assert "SiteName: S4" in html
+    assert capsys.readouterr().err == ""
+
+@pytest.mark.parametrize("argv", [["closest", "survey.csv", "-k", "0"], ["closest", "survey.csv", "-k", "-1"],
+                                  ["closest", "survey.csv", "-k", "three"], ["closest", "survey.csv", "--workers", "-1"],
+                                  ["closest", "survey.csv", "--tile-rows", "0"], ["convert", "survey.csv", "--chunk-rows", "0"]])
+def test_out_of_range_counts_are_rejected(argv, capsys):
+    with pytest.raises(SystemExit) as exit:
+        BatchCLI.main(argv)
+    assert exit.value.code == 2
+    assert "argument" in capsys.readouterr().err
+
+def test_zero_workers_means_one_per_core():
+    args = BatchCLI.buildParser().parse_args(["closest", "survey.csv", "--workers", "0", "-k", "1"])
+    assert args.workers == 0 and args.k == 1
@@ -0,0 +1,35 @@
+import zipfile
+from pptx import Presentation
+from BatchExport import assembleDeck
+from MapRenderer import placeholderPng
+
+def writeImages(directory, count):
+    paths = []
+    for n in range(count):
+        path = directory / f"{n}.png"
+        path.write_bytes(placeholderPng(n % 7 + 2, n % 5 + 3))
+        paths.append(str(path))
+    return paths
+
+def pictureBlobs(pptxPath):
+    prs = Presentation(pptxPath)
+    return [[shape.image.blob for shape in slide.shapes if shape.shape_type == 13] for slide in prs.slides]
+
+# Every image becomes one full-slide picture, in order and byte for byte
+def test_deck_holds_each_image_in_order(tmp_path):
+    paths = writeImages(tmp_path, 3)
+    paths.append(paths[0])
+    assembleDeck(paths, str(tmp_path / "deck.pptx"))
+    assert pictureBlobs(str(tmp_path / "deck.pptx")) == [[open(path, 'rb').read()] for path in paths]
+    assert not (tmp_path / "deck.pptx.part").exists() and not (tmp_path / "deck.pptx.tmp").exists()
+
+# With many slides (including repeated images) each slide still gets its own
+# image part holding exactly its PNG
+def test_large_deck_has_one_image_part_per_slide(tmp_path):
+    paths = writeImages(tmp_path, 120)
+    assembleDeck(paths, str(tmp_path / "deck.pptx"))
+    assert pictureBlobs(str(tmp_path / "deck.pptx")) == [[open(path, 'rb').read()] for path in paths]
+    with zipfile.ZipFile(tmp_path / "deck.pptx") as deck:
+        assert zipfile.ZipFile.testzip(deck) is None
+        media = [name for name in deck.namelist() if name.startswith("ppt/media/")]
+    assert len(media) == len(paths)
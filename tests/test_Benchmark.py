@@ -0,0 +1,17 @@
+from Benchmark import compareWithBaseline
+
+def result(seconds, peakBytes):
+    return {"seconds": seconds, "peakBytes": peakBytes}
+
+# Millisecond jitter on small stages is not a regression; real slowdowns are
+def test_small_differences_are_ignored():
+    baseline = {"1k/uniform/readCSV": result(0.0015, 100000), "10k/uniform/readCSV": result(0.5, 50 * 1024 * 1024)}
+    jitter = {"1k/uniform/readCSV": result(0.0019, 180000), "10k/uniform/readCSV": result(0.52, 52 * 1024 * 1024)}
+    assert compareWithBaseline(jitter, baseline, 0.2, 0.2) == []
+    slower = {"1k/uniform/readCSV": result(0.0019, 100000), "10k/uniform/readCSV": result(0.7, 70 * 1024 * 1024)}
+    regressions = compareWithBaseline(slower, baseline, 0.2, 0.2)
+    assert len(regressions) == 2 and all(line.startswith("10k/uniform/readCSV") for line in regressions)
+
+def test_floor_can_be_lowered():
+    baseline = {"1k/uniform/readCSV": result(0.0015, None)}
+    assert compareWithBaseline({"1k/uniform/readCSV": result(0.0019, None)}, baseline, 0.2, 0.2, minSeconds=0)
@@ -0,0 +1,144 @@
+import pytest
+from Cleaner import (NO_CHANNEL, calculateClosestPoints, calculateClosestPointsBruteForce, calculateCoChannelPoints,
+                     calculatePointsWithinRadius, haversine, readCSV)
+
+def assertKDTreeMatchesBruteForce(lat, lon, channels, k):
+    kdtree, expected = {}, {}
+    calculateClosestPoints(lat, lon, channels, kdtree, k=k, method='kdtree')
+    calculateClosestPointsBruteForce(lat, lon, channels, expected, k=k)
+    assert kdtree == expected
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_kdtree_matches_brute_force_on_random_points(survey, k):
+    assertKDTreeMatchesBruteForce(*survey(400, k), k=k)
+
+def test_kdtree_matches_brute_force_worldwide(survey):
+    assertKDTreeMatchesBruteForce(*survey(300, 4, spread=49), k=3)
+
+# Co-located points are at distance 0 from each other and ties go to the lower index
+def test_kdtree_matches_brute_force_with_duplicates(survey):
+    lat, lon, channels = survey(60, 7)
+    lat, lon, channels = lat * 3, lon * 3, channels * 3
+    lat += [40.0] * 10
+    lon += [-75.0] * 10
+    channels += [6] * 10
+    assertKDTreeMatchesBruteForce(lat, lon, channels, k=5)
+
+# A square grid has many neighbours at exactly the same distance
+def test_kdtree_matches_brute_force_on_grid(grid):
+    assertKDTreeMatchesBruteForce(*grid(12, step=0.01), k=6)
+
+def test_kdtree_with_fewer_points_than_k():
+    assertKDTreeMatchesBruteForce([40.0, 40.1], [-75.0, -75.1], [1, 1], k=3)
+
+# Every pair compared: the k nearest points on a channel within spread, ties to the lower index
+def coChannelBruteForce(lat, lon, channels, k, radius, spread):
+    interferers = {}
+    for i in range(len(lat)):
+        found = []
+        if channels[i] != NO_CHANNEL:
+            for j in range(len(lat)):
+                if j != i and channels[j] != NO_CHANNEL and abs(channels[j] - channels[i]) <= spread:
+                    dist = haversine(lat[i], lat[j], lon[i], lon[j])
+                    if radius is None or dist <= radius:
+                        found.append((dist, j))
+        found.sort()
+        interferers[i] = [(lat[j], lon[j], dist, channels[j]) for dist, j in found[:k]]
+    return interferers
+
+# '#N/A' rows have no interferers and are nobody's interferer, whatever the spread
+@pytest.mark.parametrize("spread", [0, 1, 4])
+@pytest.mark.parametrize("radius", [None, 5])
+def test_cochannel_matches_brute_force(survey, spread, radius):
+    lat, lon, channels = survey(300, spread, channels=(1, 2, 5, 6, 11, NO_CHANNEL))
+    interferers = {}
+    calculateCoChannelPoints(lat, lon, channels, interferers, k=4, radius=radius, spread=spread)
+    assert interferers == coChannelBruteForce(lat, lon, channels, 4, radius, spread)
+    assert all(interferers[i] == [] for i in range(len(lat)) if channels[i] == NO_CHANNEL)
+
+# Channels exactly spread apart still interfere; one further apart do not
+def test_cochannel_spread_limit():
+    lat, lon, channels = [40.0, 40.001, 40.003], [-75.0, -75.0, -75.0], [6, 10, 11]
+    interferers = {}
+    calculateCoChannelPoints(lat, lon, channels, interferers, k=3, spread=4)
+    assert [[row[3] for row in interferers[i]] for i in range(3)] == [[10], [6, 11], [10]]
+
+def test_cochannel_duplicates_and_grid_ties(grid):
+    lat, lon, channels = grid(10, channel=6)
+    lat, lon, channels = lat * 2, lon * 2, channels[:100] + [7] * 100
+    for spread in (0, 1):
+        interferers = {}
+        calculateCoChannelPoints(lat, lon, channels, interferers, k=5, spread=spread)
+        assert interferers == coChannelBruteForce(lat, lon, channels, 5, None, spread)
+
+# Checks counts and the CSR offsets/indices against every pair compared
+def assertWithinRadiusMatchesBruteForce(lat, lon, radius):
+    counts, offsets, indices = calculatePointsWithinRadius(lat, lon, radius, withLists=True)
+    expected = [[j for j in range(len(lat)) if j != i and haversine(lat[i], lat[j], lon[i], lon[j]) <= radius]
+                for i in range(len(lat))]
+    assert list(counts) == [len(found) for found in expected]
+    assert offsets[0] == 0 and len(offsets) == len(lat) + 1 and offsets[-1] == len(indices)
+    assert [list(indices[offsets[i]:offsets[i + 1]]) for i in range(len(lat))] == expected
+    countsOnly, noOffsets, noIndices = calculatePointsWithinRadius(lat, lon, radius)
+    assert list(countsOnly) == list(counts) and noOffsets is None and noIndices is None
+    return counts
+
+@pytest.mark.parametrize("radius", [0.5, 2, 10])
+def test_within_radius_matches_brute_force(survey, radius):
+    assertWithinRadiusMatchesBruteForce(*survey(300, 11, spread=0.2)[:2], radius)
+
+# The grid cells wrap neither at the antimeridian nor at the poles
+def test_within_radius_worldwide(survey):
+    lat, lon, _ = survey(200, 12, spread=49)
+    lat += [89.99, 89.995, -89.99, -89.995, 10.0, 10.0]
+    lon += [0.0, 180.0, 45.0, -135.0, 179.999, -179.999]
+    assertWithinRadiusMatchesBruteForce(lat, lon, 300)
+
+# Radius 0 finds only co-located points; a radius wider than the survey finds every other point
+def test_within_radius_extremes(survey):
+    lat, lon, _ = survey(80, 13)
+    lat, lon = lat + lat[:10], lon + lon[:10]
+    counts = assertWithinRadiusMatchesBruteForce(lat, lon, 0)
+    assert list(counts) == [1] * 10 + [0] * 70 + [1] * 10
+    assert list(assertWithinRadiusMatchesBruteForce(lat, lon, 500)) == [89] * 90
+    assert list(assertWithinRadiusMatchesBruteForce(lat, lon, 20000)) == [89] * 90
+
+# csv.DictReader skipped blank lines, and so does readCSV
+def test_readCSV_skips_blank_lines(csvFile):
+    path = csvFile("Lat,Lon,WiFi Channel\n40.1,-75.2,6\n\n40.3,-75.4,#N/A\n\n")
+    lat, lon, wifiChannel, topThree = readCSV(path)
+    assert list(lat) == [40.1, 40.3]
+    assert list(lon) == [-75.2, -75.4]
+    assert list(wifiChannel) == [6, NO_CHANNEL]
+
+# A repeated header name refers to its last column, as with csv.DictReader
+def test_readCSV_duplicate_header_uses_last_column(csvFile):
+    path = csvFile("Lat,Lon,Lat,WiFi Channel,WiFi Channel\n1,-75.2,40.1,99,6\n")
+    lat, lon, wifiChannel, topThree = readCSV(path)
+    assert (list(lat), list(lon), list(wifiChannel)) == ([40.1], [-75.2], [6])
+
+# Quoted fields are unquoted; '#N/A' and blank channels read as NO_CHANNEL
+def test_readCSV_quoted_fields_and_missing_channels(csvFile):
+    path = csvFile('Lat,Lon,WiFi Channel,Note\n"40.1","-75.2","6","a, b"\n40.3,-75.4,#N/A,\n40.5,-75.6,,x\n')
+    lat, lon, wifiChannel, topThree = readCSV(path)
+    assert (list(lat), list(lon)) == ([40.1, 40.3, 40.5], [-75.2, -75.4, -75.6])
+    assert list(wifiChannel) == [6, NO_CHANNEL, NO_CHANNEL]
+
+@pytest.mark.parametrize("row, match", [("40.1,abc,6", "Row 3: Invalid latitude or longitude value: 40.1, abc"),
+                                        ("40.1", "Row 3: Invalid latitude or longitude value: 40.1"),
+                                        ("40.1,-75.2,six", "Row 3: WiFi Channel must be a number or '#N/A': six"),
+                                        ("40.1,-75.2,-32768", "Row 3: WiFi Channel must be a number")])
+def test_readCSV_rejects_bad_rows(csvFile, row, match):
+    path = csvFile(f"Lat,Lon,WiFi Channel\n40.0,-75.0,1\n{row}\n")
+    with pytest.raises(ValueError, match=match):
+        readCSV(path)
+
+def test_readCSV_reports_row_number(csvFile):
+    path = csvFile("Lat,Lon,WiFi Channel\n40.1,-75.2,6\n\n95,-75.4,6\n")
+    with pytest.raises(ValueError, match="Row 4: Invalid latitude or longitude value: 95, -75.4"):
+        readCSV(path)
+
+def test_readCSV_missing_columns(csvFile):
+    path = csvFile("Lat,Longitude,WiFi Channel\n40.1,-75.2,6\n")
+    with pytest.raises(ValueError, match="missing: Lon"):
+        readCSV(path)
@@ -0,0 +1,40 @@
+import numpy as np
+from Cleaner import haversine, calculateClosestPoints, calculateClosestPointsBruteForce
+from DistanceKernel import DISTANCE_TOLERANCE, haversineArray, approximateTopK
+from SpatialIndex import KDTree
+
+# The scalar haversine and the KD-tree share one formula, so they agree exactly
+def test_kdtree_distances_match_scalar_haversine(survey):
+    lat, lon, _ = survey(50, 1)
+    tree = KDTree(lat, lon)
+    for i in range(len(lat)):
+        for j, distance in tree.query(i, len(lat) - 1):
+            assert distance == haversine(lat[i], lat[j], lon[i], lon[j])
+
+# The NumPy kernel agrees with the scalar formula to DISTANCE_TOLERANCE
+def test_kernel_distances_within_tolerance(survey):
+    lat, lon, _ = survey(200, 2)
+    kernel = haversineArray(np.array(lat)[:, None], np.array(lat)[None, :], np.array(lon)[:, None], np.array(lon)[None, :])
+    for i in range(len(lat)):
+        for j in range(len(lat)):
+            expected = haversine(lat[i], lat[j], lon[i], lon[j])
+            assert abs(kernel[i, j] - expected) <= expected * DISTANCE_TOLERANCE
+
+# Blocked results match the brute-force reference up to the order of
+# neighbours whose distances lie within DISTANCE_TOLERANCE of each other
+def test_blocked_matches_brute_force_within_tolerance(survey):
+    lat, lon, _ = survey(300, 3)
+    channels = [1] * len(lat)
+    blocked, expected = {}, {}
+    calculateClosestPoints(lat, lon, channels, blocked, k=5, method='blocked', blockSize=64)
+    calculateClosestPointsBruteForce(lat, lon, channels, expected, k=5)
+    for i in range(len(lat)):
+        for got, want in zip(blocked[i], expected[i]):
+            assert abs(got[2] - want[2]) <= want[2] * DISTANCE_TOLERANCE
+            if (got[0], got[1]) != (want[0], want[1]):
+                assert haversine(lat[i], got[0], lon[i], got[1]) <= want[2] * (1 + DISTANCE_TOLERANCE)
+
+# With a single point there are no neighbours, as in the exact kernel
+def test_approximate_single_point():
+    indices, distances = approximateTopK([40.0], [-75.0], k=3)
+    assert indices.shape == (1, 0) and distances.shape == (1, 0)
@@ -0,0 +1,70 @@
+import pickle
+import random
+import pytest
+from IncrementalUpdate import updateNeighbors
+from SpatialIndex import KDTree
+
+def freshNeighbors(lat, lon, k):
+    tree = KDTree(lat, lon)
+    return [tree.query(i, k) for i in range(len(lat))]
+
+def test_update_matches_fresh_run(tmp_path, survey):
+    statePath = str(tmp_path / "survey.state")
+    lat, lon, channels = survey(500, 1)
+    updateNeighbors(lat, lon, channels, 3, statePath)
+    # Remove a few rows, edit one and add some
+    for i in (400, 250, 10):
+        del lat[i], lon[i], channels[i]
+    lat[20] += 0.01
+    more = survey(20, 2)
+    lat, lon, channels = lat + more[0], lon + more[1], channels + more[2]
+    neighbors, stats = updateNeighbors(lat, lon, channels, 3, statePath)
+    assert neighbors == freshNeighbors(lat, lon, 3)
+    assert stats['added'] == 21 and stats['removed'] == 4
+    assert stats['recomputed'] < len(lat)
+
+# One far-away point must not make every added row a candidate for every point
+def test_isolated_point_keeps_update_local(tmp_path, survey):
+    statePath = str(tmp_path / "survey.state")
+    lat, lon, channels = survey(500, 3)
+    lat.append(10.0)
+    lon.append(10.0)
+    channels.append(1)
+    updateNeighbors(lat, lon, channels, 3, statePath)
+    lat.append(40.0)
+    lon.append(-75.0)
+    channels.append(6)
+    neighbors, stats = updateNeighbors(lat, lon, channels, 3, statePath)
+    assert neighbors == freshNeighbors(lat, lon, 3)
+    assert stats['recomputed'] < 50
+
+@pytest.mark.parametrize("content", [b"", b"not a state file", pickle.dumps({'version': 1, 'k': 3})])
+def test_unreadable_state_is_rebuilt(tmp_path, survey, content):
+    statePath = tmp_path / "survey.state"
+    statePath.write_bytes(content)
+    lat, lon, channels = survey(50, 4)
+    neighbors, stats = updateNeighbors(lat, lon, channels, 3, str(statePath))
+    assert neighbors == freshNeighbors(lat, lon, 3)
+    assert stats['recomputed'] == 50
+
+# A state file that cannot be written (here its directory is a file) is not an error
+def test_unwritable_state_path(tmp_path, survey):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    lat, lon, channels = survey(50, 5)
+    neighbors, stats = updateNeighbors(lat, lon, channels, 3, str(blocker / "survey.state"))
+    assert neighbors == freshNeighbors(lat, lon, 3)
+
+# Grid points have many equal distances; after the rows are shuffled (and a
+# few added) ties must still resolve by current row index, as in a fresh run
+@pytest.mark.parametrize("extra", [0, 5])
+def test_shuffled_rows_match_fresh_run(tmp_path, grid, extra):
+    statePath = str(tmp_path / "grid.state")
+    lat, lon, channels = grid(12)
+    updateNeighbors(lat, lon, channels, 3, statePath)
+    rows = list(zip(lat, lon, channels)) + [(40.0005 + n * 0.001, -74.9995, 6) for n in range(extra)]
+    random.Random(7).shuffle(rows)
+    lat, lon, channels = (list(values) for values in zip(*rows))
+    neighbors, stats = updateNeighbors(lat, lon, channels, 3, statePath)
+    assert neighbors == freshNeighbors(lat, lon, 3)
+    assert stats['added'] == extra
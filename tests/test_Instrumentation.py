@@ -0,0 +1,47 @@
+import threading
+import Instrumentation
+from Instrumentation import stage, count
+
+@stage("work")
+def work(value):
+    count("items", value)
+
+# Two runs on different threads each keep their own trace
+def test_concurrent_runs_do_not_share_a_trace():
+    Instrumentation.enable()
+    try:
+        traces = {}
+        bothStarted = threading.Barrier(2)
+
+        def job(name, value):
+            with Instrumentation.run(name) as trace:
+                bothStarted.wait()
+                for _ in range(100):
+                    work(value)
+                bothStarted.wait()
+            traces[name] = trace
+
+        threads = [threading.Thread(target=job, args=(name, value)) for name, value in (("a", 1), ("b", 2))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        Instrumentation.disable()
+    assert traces["a"]["stages"]["work"]["calls"] == 100
+    assert traces["b"]["stages"]["work"]["calls"] == 100
+    assert traces["a"]["counters"] == {"items": 100}
+    assert traces["b"]["counters"] == {"items": 200}
+
+def test_stages_outside_a_run_are_not_recorded():
+    Instrumentation.enable()
+    try:
+        with Instrumentation.run("outer") as trace:
+            thread = threading.Thread(target=work, args=(5,))
+            thread.start()
+            thread.join()
+            work(1)
+    finally:
+        Instrumentation.disable()
+    assert trace["stages"]["work"]["calls"] == 1
+    assert trace["counters"] == {"items": 1}
@@ -0,0 +1,114 @@
+import threading
+import pytest
+from JobRunner import Cancelled, Job, formatProgress
+
+# Stands in for the Tk root: after() only records the callback, and tick()
+# runs the one that is due, as the Tk event loop would
+class FakeRoot:
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, callback):
+        self.pending.append((ms, callback))
+
+    def tick(self):
+        ms, callback = self.pending.pop(0)
+        callback()
+        return ms
+
+# Records every callback the job makes on the "Tk thread"
+class Calls:
+    def __init__(self):
+        self.events = []
+
+    def callbacks(self):
+        return dict(onProgress=lambda job: self.events.append(("progress", job.progress()[:2])),
+                    onDone=lambda result: self.events.append(("done", result)),
+                    onError=lambda error: self.events.append(("error", error)),
+                    onCancelled=lambda: self.events.append(("cancelled",)))
+
+def startJob(work, pollMs=50):
+    root, calls = FakeRoot(), Calls()
+    job = Job(root, work, pollMs=pollMs, **calls.callbacks()).start()
+    return root, calls, job
+
+def test_polls_until_done_then_reports_result():
+    release = threading.Event()
+
+    def work(job):
+        job.report(3, 10, "reading")
+        release.wait(5)
+        job.report(10)
+        return "result"
+
+    root, calls, job = startJob(work)
+    assert [ms for ms, _ in root.pending] == [50]
+    while job.done < 3:
+        pass
+    assert root.tick() == 50
+    assert calls.events == [("progress", (3, 10))] and len(root.pending) == 1
+    assert formatProgress(job).startswith("reading  3/10 points")
+    release.set()
+    job.thread.join(5)
+    root.tick()
+    assert calls.events[1:] == [("progress", (10, 10)), ("done", "result")]
+    assert root.pending == []
+
+# The exception raised by the work reaches onError unchanged, and only onError
+def test_error_reaches_ui_callback():
+    error = ValueError("Row 4: Invalid latitude or longitude value")
+
+    def work(job):
+        raise error
+
+    root, calls, job = startJob(work)
+    job.thread.join(5)
+    root.tick()
+    assert calls.events[-1] == ("error", error)
+    assert [event[0] for event in calls.events] == ["progress", "error"]
+    assert root.pending == []
+
+def test_cancel_stops_work_at_next_report():
+    started = threading.Event()
+    reports = []
+
+    def work(job):
+        started.set()
+        for done in range(10 ** 6):
+            reports.append(done)
+            job.report(done, 10 ** 6)
+        return "finished"
+
+    root, calls, job = startJob(work)
+    started.wait(5)
+    job.cancel()
+    job.thread.join(5)
+    assert isinstance(job.error, Cancelled) and len(reports) < 10 ** 6
+    root.tick()
+    assert calls.events[-1] == ("cancelled",) and root.pending == []
+
+# Work that finishes without reporting again after cancel() still counts as cancelled
+@pytest.mark.parametrize("result", ["finished", None])
+def test_cancel_wins_over_late_result(result):
+    release = threading.Event()
+
+    def work(job):
+        release.wait(5)
+        return result
+
+    root, calls, job = startJob(work)
+    job.cancel()
+    release.set()
+    job.thread.join(5)
+    root.tick()
+    assert [event[0] for event in calls.events] == ["progress", "cancelled"]
+
+def test_progress_rate_and_eta(monkeypatch):
+    import JobRunner
+    job = Job(FakeRoot(), lambda job: None)
+    assert job.progress() == (0, 0, 0.0, None)
+    job.startTime = 100.0
+    monkeypatch.setattr(JobRunner.time, "monotonic", lambda: 110.0)
+    job.report(500, 1000, "reading")
+    assert job.progress() == (500, 1000, 50.0, 10.0)
+    assert formatProgress(job) == "reading  500/1,000 points  50 points/s  ETA 10 s"
@@ -0,0 +1,114 @@
+import random
+import folium
+import pytest
+import MapGenerator
+from MapGenerator import addPathMarkers, douglasPeucker, gridDownsample
+
+def track(n, seed=1):
+    rng = random.Random(seed)
+    return [[40 + rng.uniform(0, 0.5), -75 + rng.uniform(0, 0.5)] for _ in range(n)]
+
+# Layers addPathMarkers added to a fresh map
+def layers(map):
+    return [child for name, child in map._children.items() if not name.startswith("openstreetmap")]
+
+# 'auto' switches at the limits: markers up to PATH_MARKER_LIMIT points, one
+# GeoJSON layer above that, and grid downsampling above PATH_POINT_LIMIT
+@pytest.mark.parametrize("n, mode, downsampled", [(20, 'markers', False), (21, 'geojson', False),
+                                                  (100, 'geojson', False), (101, 'geojson', True)])
+def test_auto_mode_thresholds(monkeypatch, n, mode, downsampled):
+    monkeypatch.setattr(MapGenerator, "PATH_MARKER_LIMIT", 20)
+    monkeypatch.setattr(MapGenerator, "PATH_POINT_LIMIT", 100)
+    map = folium.Map()
+    stats = addPathMarkers(track(n), map)
+    assert stats["mode"] == mode and stats["points"] == n
+    assert (stats["rendered"] < n) == downsampled
+    assert len(layers(map)) == (n if mode == 'markers' else 1)
+
+@pytest.mark.parametrize("mode", ['markers', 'geojson', 'polyline', 'cluster'])
+def test_explicit_modes_draw_every_point(mode):
+    stats = addPathMarkers(track(50), folium.Map(), mode=mode)
+    assert (stats["mode"], stats["rendered"]) == (mode, 50)
+
+def test_explicit_downsampling():
+    points = track(500)
+    assert addPathMarkers(points, folium.Map(), mode='polyline', downsample='grid')["rendered"] \
+        == len(gridDownsample(points, grid=int(MapGenerator.PATH_POINT_LIMIT ** 0.5)))
+    assert addPathMarkers(points, folium.Map(), mode='polyline', downsample='douglas-peucker')["rendered"] \
+        == len(douglasPeucker(points))
+
+def test_unknown_mode_and_downsampling():
+    with pytest.raises(ValueError, match="Unknown path rendering mode"):
+        addPathMarkers(track(5), folium.Map(), mode='heatmap')
+    with pytest.raises(ValueError, match="Unknown path downsampling"):
+        addPathMarkers(track(5), folium.Map(), downsample='random')
+
+# At most one point per cell, in track order, and every occupied cell kept
+def test_grid_downsample_bounds():
+    points = track(5000)
+    kept = gridDownsample(points, grid=10)
+    assert len(kept) <= 100 and kept[0] == points[0]
+    positions = [points.index(point) for point in kept]
+    assert positions == sorted(positions)
+    low = [min(point[axis] for point in points) for axis in (0, 1)]
+    span = [max(point[axis] for point in points) - low[axis] for axis in (0, 1)]
+    def cell(point):
+        return tuple(min(int((point[axis] - low[axis]) / span[axis] * 10), 9) for axis in (0, 1))
+    assert len({cell(point) for point in kept}) == len(kept)
+    assert {cell(point) for point in kept} == {cell(point) for point in points}
+
+def test_grid_downsample_degenerate_tracks():
+    assert gridDownsample([]) == []
+    assert gridDownsample([[40.0, -75.0]] * 10) == [[40.0, -75.0]]
+    # All points on one meridian still spread over the grid rows
+    line = [[40 + n * 0.001, -75.0] for n in range(100)]
+    assert len(gridDownsample(line, grid=10)) == 10
+
+def test_douglas_peucker_keeps_endpoints_and_corners():
+    line = [[40 + n * 0.001, -75 + n * 0.001] for n in range(100)]
+    assert douglasPeucker(line) == [line[0], line[-1]]
+    zigzag = [[40 + n * 0.01, -75 + (0.01 if n % 2 else 0)] for n in range(11)]
+    assert douglasPeucker(zigzag, tolerance=0.001) == zigzag
+    assert douglasPeucker(zigzag, tolerance=0.02) == [zigzag[0], zigzag[-1]]
+    assert douglasPeucker(line[:2]) == line[:2] and douglasPeucker([]) == []
+
+# Every dropped point lies within tolerance of the simplified track
+def test_douglas_peucker_tolerance_bound():
+    points = track(300, seed=2)
+    kept = douglasPeucker(points, tolerance=0.05)
+    assert kept[0] == points[0] and kept[-1] == points[-1]
+    positions = [points.index(point) for point in kept]
+    assert positions == sorted(positions)
+    for a, b in zip(positions, positions[1:]):
+        (y0, x0), (y1, x1) = points[a], points[b]
+        length = ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5
+        for y, x in points[a + 1:b]:
+            assert abs((y1 - y0) * (x - x0) - (x1 - x0) * (y - y0)) / length <= 0.05 + 1e-12
+
+# Quoted site names may hold commas and quotes; extra columns are ignored
+def test_site_reader_quoted_fields(csvFile):
+    path = csvFile('Notes,SiteName,Lat,Long\n"a, b","Tower ""A"", North",40.1,-75.2\nx,Plain,40.3,-75.4\n')
+    for chunkSize in (None, 1):
+        sites, df = MapGenerator.readSiteColumns(path, chunkSize)
+        assert sites.tolist() == [[40.1, -75.2], [40.3, -75.4]]
+        assert df.SiteName.tolist() == ['Tower "A", North', "Plain"]
+        assert list(df.columns) == ["SiteName", "Lat", "Long"]
+
+def test_path_reader_chunks_match(csvFile):
+    path = csvFile("Latitude,Longitude\n" + "".join(f'"{40 + n / 100}",{-75 - n / 100}\n' for n in range(25)))
+    whole, _ = MapGenerator.readPathColumns(path)
+    chunked, _ = MapGenerator.readPathColumns(path, chunkSize=4)
+    assert whole.tolist() == chunked.tolist() == [[40 + n / 100, -75 - n / 100] for n in range(25)]
+
+@pytest.mark.parametrize("row, match", [("40.1,abc", "abc"), ("40.1,", "nan"), ("95,-75.2", "95.0, -75.2"),
+                                        ("40.1,-181", "40.1, -181.0")])
+def test_path_reader_rejects_bad_rows(csvFile, row, match):
+    path = csvFile(f"Latitude,Longitude\n40.0,-75.0\n{row}\n")
+    with pytest.raises(ValueError, match=match):
+        MapGenerator.readPathColumns(path)
+
+def test_site_reader_rejects_bad_rows_and_missing_columns(csvFile):
+    with pytest.raises(ValueError, match="in site info file: nan, -75.2"):
+        MapGenerator.readSiteColumns(csvFile("SiteName,Lat,Long\nA,,-75.2\n"))
+    with pytest.raises(ValueError, match="Missing columns in site info file: Long"):
+        MapGenerator.readSiteColumns(csvFile("SiteName,Lat,Lon\nA,40.1,-75.2\n"))
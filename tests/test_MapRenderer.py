@@ -0,0 +1,93 @@
+import threading
+import time
+import pytest
+from MapRenderer import RenderPool, StubDriver
+
+def render(pool, tmp_path, name="map"):
+    html = tmp_path / f"{name}.html"
+    html.write_text("<html></html>")
+    return pool.render(str(html), str(tmp_path / f"{name}.png"))
+
+# The page is polled until it reports ready, then screenshotted
+def test_render_polls_until_ready(tmp_path):
+    drivers = []
+
+    def factory():
+        drivers.append(StubDriver(readyAfter=4))
+        return drivers[-1]
+
+    with RenderPool(driverFactory=factory, idleTime=0, pollInterval=0) as pool:
+        assert render(pool, tmp_path)
+    assert drivers[0].polls == 4
+    assert (tmp_path / "map.png").read_bytes().startswith(b'\x89PNG')
+
+# A page that never becomes ready is screenshotted anyway after the timeout
+def test_render_gives_up_after_timeout(tmp_path):
+    with RenderPool(driverFactory=lambda: StubDriver(readyAfter=10 ** 9), timeout=0.05, pollInterval=0.01) as pool:
+        start = time.monotonic()
+        assert not render(pool, tmp_path)
+    assert time.monotonic() - start < 1
+    assert (tmp_path / "map.png").exists()
+
+# Readiness has to hold for idleTime before the page counts as ready
+def test_ready_must_hold_for_idle_time():
+    class FlickeringDriver(StubDriver):
+        def execute_script(self, script):
+            self.polls += 1
+            return self.polls % 2 == 0
+
+    pool = RenderPool(driverFactory=FlickeringDriver, timeout=0.1, idleTime=0.05, pollInterval=0.01)
+    assert not pool.waitUntilReady(FlickeringDriver())
+
+class BrokenDriver(StubDriver):
+    quits = 0
+
+    def save_screenshot(self, path):
+        raise RuntimeError("session lost")
+
+    def quit(self):
+        BrokenDriver.quits += 1
+
+# A driver that fails is quit and not handed out again
+def test_broken_driver_is_released(tmp_path):
+    drivers = [BrokenDriver(), StubDriver()]
+    with RenderPool(driverFactory=lambda: drivers.pop(0), idleTime=0, pollInterval=0) as pool:
+        with pytest.raises(RuntimeError):
+            render(pool, tmp_path)
+        assert BrokenDriver.quits == 1 and pool.created == 0
+        assert render(pool, tmp_path)
+        assert pool.created == 1 and not drivers
+
+# No more than `size` sessions exist, and renders beyond that wait for one
+def test_pool_never_exceeds_its_size(tmp_path):
+    lock = threading.Lock()
+    state = {"created": 0, "busy": 0, "mostBusy": 0}
+
+    class SlowDriver(StubDriver):
+        def save_screenshot(self, path):
+            with lock:
+                state["busy"] += 1
+                state["mostBusy"] = max(state["mostBusy"], state["busy"])
+            time.sleep(0.02)
+            with lock:
+                state["busy"] -= 1
+            return super().save_screenshot(path)
+
+    def factory():
+        with lock:
+            state["created"] += 1
+        return SlowDriver()
+
+    jobs = []
+    for n in range(8):
+        (tmp_path / f"{n}.html").write_text("<html></html>")
+        jobs.append((str(tmp_path / f"{n}.html"), str(tmp_path / f"{n}.png")))
+    with RenderPool(size=2, driverFactory=factory, idleTime=0, pollInterval=0) as pool:
+        # More threads than sessions, so some renders have to wait for a free one
+        threads = [threading.Thread(target=pool.render, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert state["created"] == 2 and state["mostBusy"] == 2
+    assert all((tmp_path / f"{n}.png").exists() for n in range(8))
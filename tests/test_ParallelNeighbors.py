@@ -0,0 +1,20 @@
+import pytest
+from Cleaner import calculateClosestPoints, writeCSV
+
+def closestPointsCSV(tmp_path, name, lat, lon, channels, **options):
+    topThree = {}
+    calculateClosestPoints(lat, lon, channels, topThree, k=3, **options)
+    path = tmp_path / name
+    writeCSV(topThree, k=3, filePath=str(path))
+    return path.read_bytes()
+
+# The process pool writes exactly the same file as the serial path
+@pytest.mark.parametrize("method", ["kdtree", "blocked"])
+def test_parallel_output_identical_to_serial(tmp_path, survey, method):
+    lat, lon, channels = survey(3000, 5)
+    # Duplicates give equal distances whose order must not depend on the shards
+    lat[100:110] = [lat[0]] * 10
+    lon[100:110] = [lon[0]] * 10
+    serial = closestPointsCSV(tmp_path, "serial.csv", lat, lon, channels, method=method, blockSize=256)
+    parallel = closestPointsCSV(tmp_path, "parallel.csv", lat, lon, channels, method=method, blockSize=256, workers=3)
+    assert parallel == serial
@@ -0,0 +1,94 @@
+import random
+import numpy as np
+import pytest
+from Cleaner import readCSV
+from DistanceKernel import DISTANCE_TOLERANCE, blockedTopK
+from PointStore import PointStore, convertCSV, tiledNeighbors
+
+# Collects what tiledNeighbors hands to its writer
+class Collector:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, i, neighbors):
+        self.results[i] = neighbors
+
+def tiledResults(tmp_path, surveyFile, lat, lon, channels, k, tileRows, chunkRows=1000):
+    store = convertCSV(surveyFile(lat, lon, channels), str(tmp_path / "store"), chunkRows=chunkRows)
+    collector = Collector()
+    tiledNeighbors(store, k=k, tileRows=tileRows, writer=collector)
+    assert sorted(collector.results) == list(range(len(lat)))
+    return collector.results
+
+# Tiled results equal the exact kernel's, up to the order of neighbours whose
+# distances lie within DISTANCE_TOLERANCE of each other
+def assertMatchesBlocked(results, lat, lon, k):
+    indices, distances = blockedTopK(lat, lon, k)
+    for i, neighbors in results.items():
+        got = np.array([dist for j, dist in neighbors])
+        np.testing.assert_allclose(got, distances[i], rtol=DISTANCE_TOLERANCE, atol=1e-12)
+        for n, (j, dist) in enumerate(neighbors):
+            if j != indices[i, n]:
+                assert abs(dist - distances[i, n]) <= dist * DISTANCE_TOLERANCE + 1e-12
+
+def points(rng, count, latRange, lonRange):
+    return [(rng.uniform(*latRange), rng.uniform(*lonRange)) for _ in range(count)]
+
+# Small tiles so most points sit near a tile edge, clustered where the
+# Z-order curve makes its largest jumps (the equator and prime meridian)
+def test_tiles_match_blocked_across_tile_edges(tmp_path, survey, surveyFile):
+    rng = random.Random(3)
+    lat, lon, channels = survey(1500, 1)
+    extra = points(rng, 500, (-0.05, 0.05), (-0.05, 0.05))
+    lat += [p[0] for p in extra]
+    lon += [p[1] for p in extra]
+    channels += [1] * len(extra)
+    results = tiledResults(tmp_path, surveyFile, lat, lon, channels, k=4, tileRows=64, chunkRows=300)
+    assertMatchesBlocked(results, lat, lon, 4)
+
+# Neighbours across the antimeridian and around both poles, where the
+# search box wraps in longitude or covers every longitude
+@pytest.mark.parametrize("latRange, lonRange", [((-10, 10), (179.5, 180)), ((89.5, 90), (-180, 180)),
+                                                ((-90, -89.9), (-180, 180))])
+def test_tiles_match_blocked_at_the_edges_of_the_map(tmp_path, surveyFile, latRange, lonRange):
+    rng = random.Random(5)
+    cluster = points(rng, 300, latRange, lonRange)
+    if lonRange == (179.5, 180):
+        # Mirror half the points to just west of the antimeridian
+        cluster = [(la, lo if n % 2 else -lo) for n, (la, lo) in enumerate(cluster)]
+    cluster += points(rng, 100, (-60, 60), (-170, 170))
+    lat, lon = [p[0] for p in cluster], [p[1] for p in cluster]
+    results = tiledResults(tmp_path, surveyFile, lat, lon, [6] * len(lat), k=3, tileRows=40)
+    assertMatchesBlocked(results, lat, lon, 3)
+
+# Equal distances resolve to the lower row, exactly as the KD-tree run does
+def test_tiles_match_kdtree_ties_on_grid(tmp_path, grid, surveyFile):
+    from Cleaner import calculateClosestPoints
+    lat, lon, channels = grid(20)
+    results = tiledResults(tmp_path, surveyFile, lat, lon, channels, k=6, tileRows=50)
+    expected = {}
+    calculateClosestPoints(lat, lon, channels, expected, k=6)
+    assert {i: [(lat[j], lon[j], dist) for j, dist in neighbors] for i, neighbors in results.items()} == \
+           {i: [row[:3] for row in rows] for i, rows in expected.items()}
+
+# A store written in several chunks reopens as memmaps holding the CSV's
+# columns, with the sorted columns a key-ordered permutation of them
+def test_store_round_trip(tmp_path, survey, surveyFile):
+    lat, lon, channels = survey(2500, 9, spread=40, channels=(1, 6, 11, -1))
+    path = surveyFile(lat, lon, channels)
+    convertCSV(path, str(tmp_path / "store"), chunkRows=400)
+    store = PointStore(str(tmp_path / "store"))
+    assert len(store) == 2500
+    assert isinstance(store.lat, np.memmap) and isinstance(store.sortedLat, np.memmap)
+    csvLat, csvLon, csvChannel, _ = readCSV(path)
+    assert store.lat.tolist() == list(csvLat) and store.lon.tolist() == list(csvLon)
+    assert store.wifiChannel.tolist() == list(csvChannel)
+    assert sorted(store.index.tolist()) == list(range(2500))
+    assert np.all(np.diff(store.key.astype(np.float64)) >= 0)
+    assert store.sortedLat.tolist() == store.lat[store.index].tolist()
+    assert store.sortedLon.tolist() == store.lon[store.index].tolist()
+
+def test_store_without_meta_is_rejected(tmp_path):
+    (tmp_path / "store").mkdir()
+    with pytest.raises(ValueError, match="not a point store"):
+        PointStore(str(tmp_path / "store"))
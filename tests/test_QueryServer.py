@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import pytest
+import QueryServer
+from QueryServer import QueryServer as Server, BadRequest
+
+# 50 points along a diagonal line
+@pytest.fixture
+def server(surveyFile):
+    n = range(50)
+    server = Server(surveyFile([40 + i * 1e-4 for i in n], [-75 + i * 1e-4 for i in n], [1 + i % 11 for i in n]))
+    yield server
+    server.queryExecutor.shutdown()
+    server.loadExecutor.shutdown()
+
+def test_radius_results_are_capped(server):
+    status, payload = asyncio.run(server.handle("GET", "/radius?lat=40&lon=-75&radius=100&limit=10", b''))
+    assert status == 200 and payload["truncated"]
+    distances = [result["distance"] for result in payload["results"]]
+    assert len(distances) == 10 and distances == sorted(distances)
+    status, payload = asyncio.run(server.handle("GET", "/radius?lat=40&lon=-75&radius=100", b''))
+    assert len(payload["results"]) == 50 and not payload["truncated"]
+    with pytest.raises(BadRequest):
+        asyncio.run(server.handle("GET", f"/radius?lat=40&lon=-75&radius=1&limit={QueryServer.MAX_RADIUS_LIMIT + 1}", b''))
+
+def test_batch_lists_truncated_queries(server):
+    body = b'{"queries": [{"type": "radius", "lat": 40, "lon": -75, "radius": 100, "limit": 5},' \
+           b' {"type": "nearest", "lat": 40, "lon": -75, "k": 2}]}'
+    status, payload = asyncio.run(server.handle("POST", "/batch", body))
+    assert payload["truncated"] == [0]
+    assert [len(results) for results in payload["results"]] == [5, 2]
+
+# A cancelled request still completes the batch it started, so a request
+# sharing the same query gets its answer and nothing is left in flight
+def test_cancelled_request_hands_off_its_batch(server):
+    release = threading.Event()
+    answer = server.index.answer
+
+    def slowAnswer(query):
+        release.wait(5)
+        return answer(query)
+
+    server.index.answer = slowAnswer
+
+    async def scenario():
+        query = QueryServer.parseQuery({"lat": 40, "lon": -75, "k": 3}, "nearest")
+        first = asyncio.ensure_future(server.resolve([query]))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(server.resolve([query]))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        assert not first.done()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    results, = asyncio.run(scenario())
+    assert len(results) == 3
+    assert not server.inFlight and server.metrics.computed == 1
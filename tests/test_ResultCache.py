@@ -0,0 +1,41 @@
+import json
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from ResultCache import ResultCache
+
+def test_unhashable_input_bypasses_cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    output = tmp_path / "out.csv"
+    output.write_text("x")
+    key = cache.key([str(tmp_path / "missing.csv")], kind="closest")
+    assert key is None
+    cache.put(key, {"out.csv": str(output)})
+    assert not cache.get(key, {"out.csv": str(output)})
+    assert cache.stats()['entries'] == 0
+
+def putMany(directory, sourceDir, worker, count):
+    cache = ResultCache(directory)
+    for n in range(count):
+        source = f"{sourceDir}/{worker}_{n}.csv"
+        with open(source, 'w') as file:
+            file.write(f"{worker},{n}")
+        cache.put(f"{worker:04d}{n:04d}", {"out.csv": source})
+        cache.get(f"{worker:04d}{n:04d}", {"out.csv": source})
+
+# Entries and counts from every thread and process end up in the index
+def test_concurrent_writers_keep_every_entry(tmp_path):
+    directory = str(tmp_path / "cache")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda worker: putMany(directory, str(tmp_path), worker, 10), range(4)))
+    processes = [multiprocessing.Process(target=putMany, args=(directory, str(tmp_path), worker, 10))
+                 for worker in range(4, 7)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    with open(tmp_path / "cache" / "index.json") as file:
+        index = json.load(file)
+    assert len(index['entries']) == 70
+    assert index['hits'] == 70
+    assert not [name for name in (tmp_path / "cache").iterdir() if name.suffix == ".tmp"]
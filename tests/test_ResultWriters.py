@@ -0,0 +1,91 @@
+import csv
+import json
+import numpy as np
+import pytest
+from Cleaner import calculateClosestPoints, writeCSV
+from ResultWriters import ResultWriter, openResultWriter
+
+LAT = [40.0, 40.1, 40.2, 40.3]
+LON = [-75.0, -75.1, -75.2, -75.3]
+CHANNELS = [1, 6, 1, 11]
+NEIGHBORS = [[(1, 1.5), (2, 2.5)], [(0, 1.5)], [(1, 1.0), (0, 2.5)], [(2, 3.0), (1, 4.0)]]
+
+def writeResults(path, chunkRows):
+    with openResultWriter(str(path), LAT, LON, CHANNELS, k=2, chunkRows=chunkRows) as writer:
+        for i, neighbors in enumerate(NEIGHBORS):
+            writer.add(i, neighbors)
+
+def test_base_writer_is_abstract():
+    with pytest.raises(TypeError):
+        ResultWriter("out.csv", LAT, LON, CHANNELS)
+
+# Chunk boundaries do not change what is written
+@pytest.mark.parametrize("chunkRows", [1, 3, 100])
+def test_npy_and_csv_agree(tmp_path, chunkRows):
+    writeResults(tmp_path / "out.npy", chunkRows)
+    writeResults(tmp_path / "out.csv", chunkRows)
+    records = np.load(tmp_path / "out.npy")
+    with open(tmp_path / "out.csv", newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert records['lat'].tolist() == LAT
+    assert records['neighbor_index'][1].tolist() == [0, -1]
+    assert records['same_channel'][0].tolist() == [False, True]
+    for record, row in zip(records, rows):
+        assert float(row['Lat']) == record['lat'] and float(row['Lon']) == record['lon']
+        assert float(row['Distance1']) == record['distance'][0]
+
+def test_parquet_gathers_neighbour_coordinates(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    writeResults(tmp_path / "out.parquet", 3)
+    table = pq.read_table(tmp_path / "out.parquet").to_pydict()
+    assert table['lat1'] == [40.1, 40.0, 40.1, 40.2]
+    assert table['lon2'] == [-75.2, None, -75.0, -75.1]
+
+# Exact and approximate runs both record their mode (and recall) in the CSV
+# itself, as trailing columns that keep it readable as a plain table
+@pytest.mark.parametrize("method", ["kdtree", "approximate"])
+def test_csv_records_run_mode(tmp_path, method):
+    path = tmp_path / "out.csv"
+    with openResultWriter(str(path), LAT, LON, CHANNELS, k=2) as writer:
+        info = calculateClosestPoints(LAT, LON, CHANNELS, None, k=2, method=method, writer=writer)
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == len(LAT) and float(rows[0]['Lat']) == LAT[0]
+    assert {row['Mode'] for row in rows} == {info['mode']}
+    assert {float(row['Recall']) for row in rows} == {info.get('recall@2', 1.0)}
+    assert not (tmp_path / "out.csv.meta.json").exists()
+
+# Rows with fewer than k neighbours are padded so the run columns line up
+def test_writeCSV_pads_short_rows(tmp_path):
+    path = tmp_path / "ClosestPoints.csv"
+    topThree = {0: [(40.1, -75.1, 1.5, True)], 1: [(40.0, -75.0, 1.5, True), (40.2, -75.2, 2.0, False)]}
+    writeCSV(topThree, k=2, filePath=str(path), metadata={'mode': 'approximate', 'recall@2': 0.95})
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['Mode'] for row in rows] == ['approximate', 'approximate']
+    assert rows[0]['Recall'] == '0.95' and rows[0]['Lat2'] == ''
+    writeCSV(topThree, k=2, filePath=str(path))
+    with open(path, newline='') as file:
+        assert 'Mode' not in next(csv.reader(file))
+
+def test_parquet_keeps_run_metadata_in_schema(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    with openResultWriter(str(path), LAT, LON, CHANNELS, k=2) as writer:
+        info = calculateClosestPoints(LAT, LON, CHANNELS, None, k=2, method='approximate', writer=writer)
+    metadata = pq.read_schema(path).metadata
+    assert metadata[b'mode'] == b'approximate' and float(metadata[b'recall@2']) == info['recall@2']
+
+# .npy results keep the metadata next to them; a stale file is removed
+def test_npy_metadata_sidecar(tmp_path):
+    path = tmp_path / "out.npy"
+    with openResultWriter(str(path), LAT, LON, CHANNELS, k=2) as writer:
+        info = calculateClosestPoints(LAT, LON, CHANNELS, None, k=2, method='kdtree', writer=writer)
+    with open(str(path) + ".meta.json") as file:
+        assert json.load(file) == info
+
+def test_stale_sidecar_is_removed(tmp_path):
+    path = tmp_path / "out.npy"
+    (tmp_path / "out.npy.meta.json").write_text("{}")
+    writeResults(path, 2)
+    assert not (tmp_path / "out.npy.meta.json").exists()
@@ -0,0 +1,22 @@
+import json
+import pytest
+from TileExport import exportTiledMap, writePointTiles
+
+def test_zoom_range_is_respected(tmp_path):
+    points = [[40.0, -75.0], [40.5, -74.5]]
+    stats = writePointTiles(points, str(tmp_path), "path", minZoom=4, maxZoom=7)
+    assert sorted(stats["points"]) == [4, 5, 6, 7]
+    assert sorted(int(p.name) for p in tmp_path.iterdir()) == [4, 5, 6, 7]
+    with pytest.raises(ValueError):
+        writePointTiles(points, str(tmp_path), "path", minZoom=8, maxZoom=7)
+
+# Site tiles carry one label per pixel for the click popups
+def test_site_tiles_carry_labels(tmp_path, csvFile):
+    sites = csvFile("SiteName,Lat,Long\nAlpha,40.0,-75.0\nBeta,40.0,-75.0\nGamma,40.5,-74.5\n", "sites.csv")
+    path = csvFile("Latitude,Longitude\n40.1,-75.1\n", "path.csv")
+    exportTiledMap(sites, path, str(tmp_path / "map.html"), minZoom=2, maxZoom=5)
+    tile, = (tmp_path / "map_tiles" / "sites" / "5").glob("*/*.js")
+    arguments = json.loads("[" + tile.read_text().strip()[len("twsTile("):-len(");")] + "]")
+    assert arguments[0] == "sites/5/9/12" and len(arguments[1]) == 4
+    assert arguments[2] == ["SiteName: Alpha (+1 more)", "SiteName: Gamma"]
+    assert not (tmp_path / "map_tiles" / "sites" / "1").exists()